@@ -0,0 +1,87 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# how --workers scales: the same load against one process and against 1, 2, 4... workers. The load comes from several
+# client/bench.py processes at once, one of them alone can not keep more than a core or two of server busy. Reports
+# games per second and the speedup over one process. The broker pairs every player of the cluster in one process, and
+# every core the bots use is one the workers do not get, so the speedup stops growing long before the core count
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+import launcher
+
+
+def start_server(engine, workers, port):
+    return launcher.start_server(port, ["--engine", engine, "--workers", str(workers), "--accept-rate", "0",
+                                        "--message-rate", "0", "--byte-rate", "0", "--start-delay", "0",
+                                        "--resume-grace", "0", "--log-level", "warning"])
+
+
+# every load process plays bots games at the same time, returns (games, errors, seconds until the last one ended)
+def play(port, loads, bots, directory):
+    outputs = [os.path.join(directory, f"load{index}.json") for index in range(loads)]
+    started = time.perf_counter()
+    processes = [subprocess.Popen([sys.executable, "-m", "client.bench", "--port", str(port), "--bots", str(bots),
+                                   "--seed", str(index), "--output", output], cwd=launcher.ROOT,
+                                  stdout=subprocess.DEVNULL)
+                 for index, output in enumerate(outputs)]
+    for process in processes:
+        process.wait()
+    elapsed = time.perf_counter() - started
+    games = errors = 0
+    for output in outputs:
+        with open(output) as results:
+            results = json.load(results)
+        games += results["games"]
+        errors += sum(results["errors"].values())
+    return games, errors, elapsed
+
+
+def run(engine, workers, loads, bots, rounds, directory):
+    port = launcher.free_port()
+    server = start_server(engine, workers, port)
+    try:
+        # the first round warms up the server (and forks the handler threads of every worker)
+        play(port, loads, bots, directory)
+        rates = []
+        errors = 0
+        for _ in range(rounds):
+            games, failed, elapsed = play(port, loads, bots, directory)
+            rates.append(games / elapsed)
+            errors += failed
+    finally:
+        server.terminate()
+        server.wait()
+    return max(rates), errors
+
+
+if __name__ == "__main__":
+    cores = os.cpu_count()
+    parser = argparse.ArgumentParser(description="Games per second against the number of worker processes")
+    parser.add_argument("--engine", choices=["threaded", "async"], default="async")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({0, 1, 2, 4, cores} - {n for n in (2, 4) if n > cores}),
+                        help="worker counts to try, 0 is a single process without a broker")
+    parser.add_argument("--loads", type=int, default=max(1, cores // 2), help="client/bench.py processes at once")
+    parser.add_argument("--bots", type=int, default=500, help="bots of each load process, an even number")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{cores} cores, {args.loads} load processes x {args.bots} bots x {args.rounds} rounds on the "
+          f"{args.engine} engine")
+    print(f"{'workers':>8} {'games/s':>9} {'speedup':>8} {'errors':>7}")
+    single = None
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in args.workers:
+            rate, errors = run(args.engine, workers, args.loads, args.bots, args.rounds, directory)
+            if single is None:
+                single = rate
+            print(f"{workers:>8} {rate:>9.1f} {rate / single:>7.2f}x {errors:>7}")
+    if max(args.workers) + args.loads > cores:
+        print(f"more workers and load processes than the {cores} cores, they take turns on the same ones")
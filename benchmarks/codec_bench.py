@@ -0,0 +1,80 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# compares the size on the wire and the encode/decode cost of each wire format for the messages of a typical game
+import argparse
+import json
+import time
+from protocols import Protocols, CODECS
+
+# (type, data) of the messages a game is mostly made of
+MESSAGES = [
+    (Protocols.Request.GUESS, 250),
+    (Protocols.Response.GUESS_TOO_LOW, None),
+    (Protocols.Request.GUESS, 375),
+    (Protocols.Response.GUESS_TOO_HIGH, None),
+    (Protocols.Response.GAME_BOUNDS, {"lower": 0, "upper": 500}),
+    (Protocols.Response.OPPONENT, "player_two"),
+    (Protocols.Response.CORRECT_NUMBER, 312),
+    (Protocols.Response.START, None),
+]
+
+
+# the path the server and client used before the codecs, kept here as the baseline
+def legacy_encode(r_type, data):
+    return json.dumps({"type": r_type, "data": data}).encode("UTF-8") + b"\n"
+
+
+def legacy_decode(stream):
+    buffer = stream.decode("UTF-8")
+    messages = []
+    while "\n" in buffer:
+        msg_str, buffer = buffer.split("\n", 1)
+        messages.append(json.loads(msg_str))
+    return messages
+
+
+def codec_decode(codec, stream):
+    messages = []
+    start = 0
+    while True:
+        frame, start = codec.next_frame(stream, start)
+        if frame is None:
+            return messages
+        messages.append(codec.parse(frame))
+
+
+def bench(name, encode, decode, rounds):
+    count = rounds * len(MESSAGES)
+
+    start = time.perf_counter_ns()
+    for _ in range(rounds):
+        for r_type, data in MESSAGES:
+            encode(r_type, data)
+    encode_ns = (time.perf_counter_ns() - start) / count
+
+    # decode one message at a time so the cost of the buffer does not hide the cost of the format
+    frames = [encode(r_type, data) for r_type, data in MESSAGES]
+    start = time.perf_counter_ns()
+    for _ in range(rounds):
+        for frame in frames:
+            decode(frame)
+    decode_ns = (time.perf_counter_ns() - start) / count
+
+    size = sum(len(frame) for frame in frames) / len(frames)
+    assert decode(b"".join(frames)) == [{"type": r_type, "data": data} for r_type, data in MESSAGES]
+    print(f"{name:<8} {size:>10.1f} {encode_ns:>12.0f} {decode_ns:>12.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wire format benchmark")
+    parser.add_argument("--rounds", type=int, default=50000)
+    args = parser.parse_args()
+
+    print(f"{'format':<8} {'bytes/msg':>10} {'encode ns':>12} {'decode ns':>12}")
+    bench("legacy", legacy_encode, legacy_decode, args.rounds)
+    for codec in CODECS.values():
+        bench(codec.name, codec.encode, lambda stream, codec=codec: codec_decode(codec, stream), args.rounds)
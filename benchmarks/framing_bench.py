@@ -0,0 +1,96 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# feeds a burst of pipelined guesses through the old string buffer receive loop and through FrameReader
+import argparse
+import json
+import time
+from framing import FrameReader
+from protocols import Protocols, CODECS
+
+
+# stands in for a socket, hands out the stream recv_size bytes at a time
+class StreamSocket:
+    def __init__(self, stream):
+        self.stream = memoryview(stream)
+        self.position = 0
+
+    def recv(self, size):
+        data = bytes(self.stream[self.position:self.position + size])
+        self.position += len(data)
+        return data
+
+    def recv_into(self, buffer):
+        data = self.stream[self.position:self.position + len(buffer)]
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+# the receive loop the server and client used before FrameReader
+def old_path(sock, recv_size):
+    count = 0
+    buffer = ""
+    while True:
+        data = sock.recv(recv_size).decode("UTF-8")
+        if not data:
+            return count
+        buffer += data
+        while "\n" in buffer:
+            msg_str, buffer = buffer.split("\n", 1)
+            json.loads(msg_str)
+            count += 1
+
+
+def new_path(sock, recv_size, codec):
+    count = 0
+    reader = FrameReader(recv_size)
+    while True:
+        frame = reader.next_frame(codec)
+        if frame is not None:
+            codec.parse(frame)
+            count += 1
+            continue
+        if not reader.recv_into(sock):
+            return count
+
+
+def run(name, path, stream, guesses):
+    start = time.perf_counter()
+    count = path(StreamSocket(stream))
+    elapsed = time.perf_counter() - start
+    assert count == guesses, f"{name} decoded {count} of {guesses} messages"
+    print(f"{name:<20} {elapsed:>8.2f}s {guesses / elapsed:>14,.0f} msg/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Receive buffer benchmark")
+    parser.add_argument("--guesses", type=int, default=1_000_000)
+    parser.add_argument("--recv-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    streams = {
+        name: b"".join(codec.encode(Protocols.Request.GUESS, i % 501) for i in range(args.guesses))
+        for name, codec in CODECS.items()
+    }
+
+    print(f"{args.guesses:,} pipelined guesses, recv size {args.recv_size}")
+    run("old string buffer", lambda sock: old_path(sock, args.recv_size), streams["json"], args.guesses)
+    for name, codec in CODECS.items():
+        run(f"FrameReader {name}", lambda sock, codec=codec: new_path(sock, args.recv_size, codec),
+            streams[name], args.guesses)
+
+    # the old loop cannot cope with a multibyte character split between two reads, FrameReader only decodes
+    # complete frames
+    nickname = json.dumps({"type": Protocols.Request.NICKNAME, "data": "é" * 600}, ensure_ascii=False)
+    nickname = nickname.encode("UTF-8") + b"\n"
+    try:
+        old_path(StreamSocket(nickname), 1023)
+        print("old string buffer: split UTF-8 character decoded")
+    except UnicodeDecodeError:
+        print("old string buffer: UnicodeDecodeError on a split UTF-8 character")
+    new_path(StreamSocket(nickname), 1023, CODECS["json"])
+    print("FrameReader: split UTF-8 character decoded")
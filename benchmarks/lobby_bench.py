@@ -0,0 +1,135 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# matchmaking by rating, simulated: a population of players with a hidden skill plays game after game. Each game is
+# won according to the skills, the Elo ratings learn them, and the lobby pairs the players either in order of arrival
+# or by rating. We report how fair the games were (the chance of the weaker player to win, 50% is a perfect match)
+# against how long the players waited. Then the cost of the lobby itself: a join and the passes of match() with 1k to
+# 100k players waiting
+import argparse
+import heapq
+import random
+import statistics
+import time
+from server.matchmaking import Matchmaker, RatedMatchmaker
+from server.rating import Ratings, expected_score
+from launcher import percentile
+
+
+class Player:
+    def __init__(self, name, skill):
+        self.name = name
+        self.skill = skill
+        self.joined = 0
+
+    def __repr__(self):
+        return self.name
+
+
+# returns (waits, chances of the underdog, rating gaps) of the games started in the second half, once the ratings
+# have had time to settle
+def simulate(kind, players, seconds, game_time, rest, step, rng, window, widen, max_window):
+    ratings = Ratings()
+    clock = [0]
+    if kind == "rating":
+        lobby = RatedMatchmaker(2, rating=lambda player: ratings.get(player.name), window=window, widen=widen,
+                                max_window=max_window, clock=lambda: clock[0])
+    else:
+        lobby = Matchmaker(2)
+    population = [Player(f"p{index}", rng.gauss(1500, 300)) for index in range(players)]
+    # (time, order, player) of the players coming back to the lobby, everybody arrives in the first game_time
+    returning = [(rng.uniform(0, game_time), index, player) for index, player in enumerate(population)]
+    heapq.heapify(returning)
+    order = players
+
+    waits = []
+    chances = []
+    gaps = []
+    now = 0
+    while now < seconds:
+        clock[0] = now
+        groups = []
+        while returning and returning[0][0] <= now:
+            _, _, player = heapq.heappop(returning)
+            player.joined = now
+            groups += lobby.join(player)
+        groups += lobby.match(now)
+
+        for first, second in groups:
+            if now >= seconds / 2:
+                waits += [now - first.joined, now - second.joined]
+                chance = expected_score(first.skill, second.skill)
+                chances.append(min(chance, 1 - chance))
+                gaps.append(abs(ratings.get(first.name) - ratings.get(second.name)))
+            winner = first if rng.random() < expected_score(first.skill, second.skill) else second
+            ratings.record(winner.name, [first.name, second.name])
+            for player in (first, second):
+                order += 1
+                heapq.heappush(returning, (now + game_time + rng.expovariate(1 / rest), order, player))
+        now += step
+    return waits, chances, gaps
+
+
+# µs per join and leave with size players waiting, and ms per match() while their windows widen: the ratings are
+# spread so that some neighbours are paired by the widening and the rest never are, match() is called every step
+# seconds until every window is as wide as it gets. Returns (join, leave, mean match, slowest match)
+def lobby_cost(size, joins, rng, window, widen, max_window, step):
+    clock = [0]
+    lobby = RatedMatchmaker(2, rating=lambda player: player, window=window, widen=widen, max_window=max_window,
+                            clock=lambda: clock[0])
+    lobby.join_many([rng.random() * size * max_window for _ in range(size)])
+    ticks = []
+    while clock[0] <= (max_window - window) / widen + step:
+        started = time.perf_counter()
+        lobby.match(clock[0])
+        ticks.append(time.perf_counter() - started)
+        clock[0] += step
+
+    newcomers = [rng.random() * size * max_window for _ in range(joins)]
+    started = time.perf_counter()
+    for newcomer in newcomers:
+        lobby.join(newcomer)
+    join = (time.perf_counter() - started) / joins
+    started = time.perf_counter()
+    for newcomer in newcomers:
+        lobby.leave(newcomer)
+    leave = (time.perf_counter() - started) / joins
+    return join, leave, statistics.mean(ticks), max(ticks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rating matchmaking simulation")
+    parser.add_argument("--players", type=int, nargs="+", default=[200, 2000, 20_000])
+    parser.add_argument("--seconds", type=float, default=3600, help="simulated seconds")
+    parser.add_argument("--game-time", type=float, default=30, help="seconds a game lasts")
+    parser.add_argument("--rest", type=float, default=10, help="mean seconds between two games of a player")
+    parser.add_argument("--step", type=float, default=0.25, help="seconds between two passes of the lobby")
+    parser.add_argument("--window", type=float, default=50, help="rating difference accepted right away")
+    parser.add_argument("--widen", type=float, default=25, help="what the window grows every second")
+    parser.add_argument("--max-window", type=float, default=800)
+    parser.add_argument("--lobby-sizes", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.seconds:g}s simulated, games of {args.game_time:g}s, window {args.window:g} + {args.widen:g}/s "
+          f"up to {args.max_window:g}, the second half is measured")
+    print(f"{'lobby':<8} {'players':>8} {'games':>8} {'wait p50':>9} {'wait p99':>9} {'underdog':>9} "
+          f"{'fair 40%+':>10} {'gap p50':>8}")
+    for players in args.players:
+        for kind in ("fifo", "rating"):
+            waits, chances, gaps = simulate(kind, players, args.seconds, args.game_time, args.rest, args.step,
+                                            random.Random(args.seed), args.window, args.widen, args.max_window)
+            fair = sum(1 for chance in chances if chance >= 0.4) / len(chances)
+            print(f"{kind:<8} {players:>8,} {len(chances):>8,} {percentile(waits, 0.5):>8.2f}s "
+                  f"{percentile(waits, 0.99):>8.2f}s {statistics.mean(chances):>9.1%} {fair:>10.1%} "
+                  f"{percentile(gaps, 0.5):>8.0f}")
+
+    print()
+    print(f"{'waiting':>8} {'join µs':>8} {'leave µs':>9} {'match ms':>9} {'slowest ms':>11}")
+    rng = random.Random(args.seed)
+    for size in args.lobby_sizes:
+        join, leave, match, slowest = lobby_cost(size, 10_000, rng, args.window, args.widen, args.max_window, args.step)
+        print(f"{size:>8,} {join * 1e6:>8.2f} {leave * 1e6:>9.2f} {match * 1000:>9.3f} {slowest * 1000:>11.3f}")
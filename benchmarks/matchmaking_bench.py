@@ -0,0 +1,95 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# stress test for the matchmaking queue: many threads join players at the same time, like handler threads do when
+# thousands of clients connect at once, and we check that no player is lost or paired twice
+import argparse
+import random
+import threading
+import time
+from server.matchmaking import Matchmaker
+
+
+def run(threads, players_per_thread, leave_ratio, interval):
+    matchmaker = Matchmaker()
+    groups_lock = threading.Lock()
+    groups = []
+    left = set()
+    # pairings counted per time interval so we can see if the rate stays stable
+    timeline = []
+    start_barrier = threading.Barrier(threads + 1)
+
+    def worker(worker_id):
+        rng = random.Random(worker_id)
+        start_barrier.wait()
+        for i in range(players_per_thread):
+            player = (worker_id, i)
+            formed = matchmaker.join(player)
+            # some players disconnect while they wait
+            if rng.random() < leave_ratio:
+                matchmaker.leave(player)
+                with groups_lock:
+                    left.add(player)
+            if formed:
+                now = time.perf_counter()
+                with groups_lock:
+                    groups.extend(formed)
+                    timeline.extend([now] * len(formed))
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    start_barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    # every player must be in at most one room
+    seen = {}
+    double_paired = 0
+    for group in groups:
+        for player in group:
+            if player in seen:
+                double_paired += 1
+            seen[player] = group
+
+    # a player that never left must be in a room, or still be in the queue
+    lost = 0
+    for worker_id in range(threads):
+        for i in range(players_per_thread):
+            player = (worker_id, i)
+            if player not in seen and player not in left and player not in matchmaker:
+                lost += 1
+
+    # pairings per interval, the first and last intervals are partial so we leave them out
+    buckets = {}
+    for moment in timeline:
+        bucket = int((moment - start) / interval)
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+    rates = [buckets[b] / interval for b in sorted(buckets)][1:-1]
+
+    total = threads * players_per_thread
+    print(f"players: {total} from {threads} threads, {len(left)} disconnected after joining")
+    print(f"rooms created: {len(groups)} in {elapsed:.3f}s ({len(groups) / elapsed:,.0f} pairings/s)")
+    if rates:
+        print(f"pairings/s per {interval}s interval: min {min(rates):,.0f}, max {max(rates):,.0f}")
+    print(f"still waiting: {len(matchmaker)}")
+    print(f"lost players: {lost}")
+    print(f"double paired players: {double_paired}")
+    return lost == 0 and double_paired == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Matchmaking queue stress benchmark")
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--players", type=int, default=5000, help="players joined by each thread")
+    parser.add_argument("--leave-ratio", type=float, default=0.05)
+    parser.add_argument("--interval", type=float, default=0.1)
+    args = parser.parse_args()
+
+    ok = run(args.threads, args.players, args.leave_ratio, args.interval)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,81 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# what the sampling profiler costs the server: the same load (client/bench.py bots playing whole games) against a
+# server without the profiler, with --profile, and with --profile --profile-idle, which also walks the stacks of the
+# threads waiting for their client. Reports games per second, the guess round trip and the server's CPU time per game
+# (Linux only), and the size of the collapsed stacks file written when the server stops
+import argparse
+import json
+import os
+import signal
+import subprocess
+import tempfile
+import launcher
+# flags besides --profile, None runs the server without the profiler
+MODES = {
+    "off": None,
+    "profile": [],
+    "profile idle": ["--profile-idle"],
+}
+
+
+def start_server(engine, port, flags):
+    return launcher.start_server(port, ["--engine", engine, "--accept-rate", "0", "--message-rate", "0",
+                                        "--byte-rate", "0", "--start-delay", "0", "--log-level", "warning"] + flags)
+
+
+# one round of bots, returns the results of client/bench.py
+def play(port, bots, output):
+    subprocess.run([sys.executable, "-m", "client.bench", "--port", str(port), "--bots", str(bots), "--seed", "1",
+                    "--output", output], cwd=launcher.ROOT, stdout=subprocess.DEVNULL, check=True)
+    with open(output) as results:
+        return json.load(results)
+
+
+def run(engine, flags, bots, rounds, directory):
+    port = launcher.free_port()
+    if flags is not None:
+        flags = ["--profile", os.path.join(directory, "profile")] + flags
+    server = start_server(engine, port, flags or [])
+    output = os.path.join(directory, "results.json")
+    try:
+        # the first round warms up the server, its threads and the profiler's names
+        play(port, bots, output)
+        rates = []
+        p99s = []
+        games = 0
+        cpu = launcher.cpu_seconds(server.pid)
+        for _ in range(rounds):
+            results = play(port, bots, output)
+            rates.append(results["games_per_sec"])
+            p99s.append(results["guess_rtt"]["p99"])
+            games += results["games"]
+        cpu = launcher.cpu_seconds(server.pid) - cpu
+    finally:
+        # CTRL + C, the server writes the profile while it closes
+        server.send_signal(signal.SIGINT)
+        server.wait()
+    written = [name for name in os.listdir(directory) if name.endswith(".folded")]
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in written)
+    for name in written:
+        os.remove(os.path.join(directory, name))
+    return max(rates), launcher.percentile(p99s, 0.5), cpu / games, size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sampling profiler overhead benchmark")
+    parser.add_argument("--engine", choices=["threaded", "async"], default="threaded")
+    parser.add_argument("--bots", type=int, default=1000, help="bots in each round, an even number")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{args.bots} bots x {args.rounds} rounds on the {args.engine} engine")
+    print(f"{'profiler':<14} {'games/s':>9} {'guess p99 ms':>13} {'CPU µs/game':>12} {'profile KiB':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, flags in MODES.items():
+            rate, p99, cpu, size = run(args.engine, flags, args.bots, args.rounds, directory)
+            print(f"{name:<14} {rate:>9.1f} {p99 * 1000:>13.2f} {cpu * 1e6:>12.0f} {size / 1024:>12.1f}")
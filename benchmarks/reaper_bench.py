@@ -0,0 +1,113 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# the cost of watching the deadlines of many open connections: the reaper's heap, which only looks at the sessions
+# whose deadline has come, against a pass over every session once a second. Time is simulated, a tenth of the players
+# send something every second, the others are quiet, get a PING after the heartbeat interval and are disconnected
+# after the idle timeout
+import argparse
+import logging
+import random
+import time
+from server.main import Server
+from server.reaper import Reaper
+from protocols import DEFAULT_CODEC
+
+
+# stands in for a socket and an outbound queue, what is sent is dropped
+class FakeClient:
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeOutbox:
+    def put(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+def build_sessions(server, players, seed):
+    rng = random.Random(seed)
+    sessions = []
+    for index in range(players):
+        session = server.sessions.create(FakeClient(), DEFAULT_CODEC)
+        session.outbox = FakeOutbox()
+        session.name = f"p{index}"
+        session.heartbeat = server.heartbeat
+        # connected over the last idle timeout, so the deadlines are spread out
+        session.opened = session.seen = -rng.uniform(0, server.idle_timeout)
+        sessions.append(session)
+    return sessions
+
+
+# the simulated seconds, returns (CPU seconds spent looking at deadlines, sessions reaped)
+def run(server, sessions, seconds, active, seed, look):
+    rng = random.Random(seed)
+    reaped = server.metrics.reaped.labels("idle")
+    before = reaped.value
+    spent = 0
+    for now in range(1, seconds + 1):
+        # the active players are heard from, a handler only notes the time
+        for session in rng.sample(sessions, int(len(sessions) * active)):
+            if session.outbox is not None:
+                session.seen = now - rng.random()
+        started = time.process_time()
+        look(now)
+        spent += time.process_time() - started
+    return spent, reaped.value - before
+
+
+# a reaped session has no outbox anymore, like after the handler cleaned up
+def forget(server):
+    def abort(client):
+        pass
+    server.abort_client = abort
+    original = server.reap_client
+
+    def reap_client(session, reason, detail):
+        original(session, reason, detail)
+        session.outbox = None
+    server.reap_client = reap_client
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deadline reaper benchmark")
+    parser.add_argument("--players", type=int, default=100_000)
+    parser.add_argument("--seconds", type=int, default=120, help="simulated seconds")
+    parser.add_argument("--active", type=float, default=0.1, help="part of the players heard from every second")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    print(f"{args.players:,} players, {args.seconds}s simulated, {args.active:.0%} active every second")
+    print(f"{'watcher':<10} {'ms/second':>10} {'µs/player/s':>12} {'reaped':>8}")
+    for name in ("scan", "heap"):
+        # port 0, the benchmark never accepts a connection
+        server = Server(port=0, resume_grace=0, login_timeout=10, idle_timeout=60, heartbeat=15)
+        forget(server)
+        sessions = build_sessions(server, args.players, args.seed)
+
+        if name == "heap":
+            server.reaper = Reaper()
+            for session in sessions:
+                server.reaper.schedule(session, session.seen + server.heartbeat)
+
+            look = server.reap
+        else:
+            # every session once a second, what the reaper would do without its heap
+            def look(now):
+                for session in sessions:
+                    server.check_deadline(session, now)
+
+        spent, reaped = run(server, sessions, args.seconds, args.active, args.seed, look)
+        per_second = spent / args.seconds
+        print(f"{name:<10} {per_second * 1000:>10.2f} {per_second / args.players * 1e6:>12.3f} {reaped:>8,}")
+        server.server.close()
@@ -0,0 +1,115 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# frame time and CPU use of the game window, drawn from scratch 30 times a second like it used to be, and drawn only
+# when something changed with the text cache and dirty rectangles. Two screens: waiting for an opponent, where
+# nothing happens, and a game with a message arriving every few milliseconds. Without a display SDL's dummy driver
+# is used, so the time spent by a real display in pygame.display.update() is not part of it. The dummy driver also
+# wakes up every millisecond in pygame.event.wait(), which is most of the CPU of the idle window here
+import argparse
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import threading
+import time
+import pygame
+from client.core import GameClient
+from client.game import Game, SERVER_MESSAGE
+from client.render import Renderer
+
+
+def make_game():
+    game = Game(GameClient())
+    game.client.quiet = True
+    screen = pygame.display.set_mode((800, 600))
+    game.renderer = Renderer(screen)
+    game.font = pygame.font.SysFont("monospace", 24)
+    game.message_font = pygame.font.SysFont("monospace", 18)
+    game.logged_in = True
+    return game
+
+
+# stands in for the client's thread: a message every interval, and the event that wakes up the window
+def feed(client, interval, stop):
+    count = 0
+    while not stop.wait(interval):
+        count += 1
+        client.add_message(f"Your guess was too low. ({count})")
+        pygame.event.post(pygame.event.Event(SERVER_MESSAGE))
+
+
+# the old loop: 30 frames a second, every frame drawn from scratch
+def every_frame(game, seconds, times):
+    clock = pygame.time.Clock()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        clock.tick(30)
+        pygame.event.get()
+        game.renderer.invalidate()
+        game.renderer.cache.clear()
+        started = time.perf_counter()
+        game.draw()
+        times.append(time.perf_counter() - started)
+
+
+# the window's loop now: sleep until an event, draw what changed, at most max_fps times a second
+def on_change(game, seconds, times):
+    clock = pygame.time.Clock()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pygame.event.wait(1000)
+        pygame.event.get()
+        started = time.perf_counter()
+        if game.draw():
+            times.append(time.perf_counter() - started)
+        clock.tick(game.max_fps)
+
+
+def measure(loop, scenario, seconds, interval):
+    game = make_game()
+    if scenario == "feed":
+        client = game.client
+        client.started = True
+        client.lower_bound, client.upper_bound = 0, 500
+        client.opponent_name = "opponent"
+    game.draw()
+
+    stop = threading.Event()
+    feeder = None
+    if scenario == "feed":
+        feeder = threading.Thread(target=feed, args=(game.client, interval, stop))
+        feeder.start()
+
+    times = []
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    loop(game, seconds, times)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    stop.set()
+    if feeder:
+        feeder.join()
+
+    times.sort()
+    mean = sum(times) / len(times) if times else 0
+    p99 = times[int(len(times) * 0.99)] if times else 0
+    # the share of the time spent drawing, and the CPU used by the whole process
+    return len(times), mean, p99, 100 * sum(times) / wall, 100 * cpu / wall
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Game window drawing benchmark")
+    parser.add_argument("--seconds", type=float, default=5, help="of each run")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between messages of the busy feed")
+    args = parser.parse_args()
+
+    pygame.init()
+    print(f"{'screen':<10} {'loop':<12} {'frames':>7} {'mean ms':>8} {'p99 ms':>8} {'draw %':>7} {'CPU %':>6}")
+    for scenario in ("waiting", "feed"):
+        for name, loop in (("every frame", every_frame), ("on change", on_change)):
+            frames, mean, p99, drawing, cpu = measure(loop, scenario, args.seconds, args.interval)
+            print(f"{scenario:<10} {name:<12} {frames:>7} {mean * 1e3:>8.3f} {p99 * 1e3:>8.3f} {drawing:>7.2f} "
+                  f"{cpu:>6.1f}")
+    pygame.quit()
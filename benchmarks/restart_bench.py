@@ -0,0 +1,133 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# what a deploy costs the players: bots play game after game against a server that is replaced halfway through the
+# run, and we count the games that were cut off, the connections that were refused and the longest time nobody could
+# connect. The server is replaced three ways: stopped with CTRL+C and started again (kill), drained with SIGTERM while
+# the new one starts (drain), and restarted in place with SIGUSR2 (hot, see server/restart.py)
+import argparse
+import asyncio
+import os
+import random
+import signal
+import time
+from client.bench import Bot, binary_search
+import launcher
+
+
+def start_server(engine, port):
+    return launcher.start_server(port, ["--engine", engine, "--accept-rate", "0", "--message-rate", "0",
+                                        "--byte-rate", "0", "--resume-grace", "0", "--log-level", "warning"])
+
+
+# every server on our port, a hot restart leaves one we did not start ourselves
+def servers_on(port):
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as cmdline:
+                arguments = cmdline.read().decode().split("\0")
+        except OSError:
+            continue
+        if launcher.MAIN in arguments and str(port) in arguments:
+            pids.append(int(entry))
+    return pids
+
+
+class Tally:
+    def __init__(self):
+        self.completed = 0
+        self.broken = 0
+        self.refused = 0
+        self.refused_since = None
+        self.outage = 0
+
+
+# one player, game after game until stop is set. Every guess waits a little so that games are under way when the
+# server is replaced
+async def player(name, port, delay, rng, tally, stop):
+    while not stop.is_set():
+        bot = Bot(name, binary_search, "127.0.0.1", port, "binary", rng)
+        original = bot.client.guess
+
+        async def guess(number, original=original):
+            await asyncio.sleep(delay)
+            return await original(number)
+        bot.client.guess = guess
+
+        try:
+            await asyncio.wait_for(bot.run(asyncio.Semaphore(1)), 30)
+        except (OSError, asyncio.TimeoutError) as error:
+            await bot.client.close()
+            if bot.connect_latency is None and isinstance(error, ConnectionRefusedError):
+                tally.refused += 1
+                now = time.perf_counter()
+                if tally.refused_since is None:
+                    tally.refused_since = now
+                tally.outage = max(tally.outage, now - tally.refused_since)
+                await asyncio.sleep(0.01)
+                continue
+            tally.broken += 1
+            continue
+        if bot.connect_latency is not None:
+            tally.refused_since = None
+        if bot.client.winner is not None:
+            tally.completed += 1
+        elif bot.time_to_start is not None or not stop.is_set():
+            # the server let go of us before the game was over, or before we were even paired
+            tally.broken += 1
+
+
+async def replace(mode, engine, port, server):
+    if mode == "hot":
+        server.send_signal(signal.SIGUSR2)
+        return
+    server.send_signal(signal.SIGINT if mode == "kill" else signal.SIGTERM)
+    if mode == "kill":
+        await asyncio.to_thread(server.wait)
+    else:
+        # the draining server closes its listening socket right away
+        await asyncio.sleep(0.05)
+    await asyncio.to_thread(start_server, engine, port)
+
+
+async def run(mode, engine, players, seconds, delay, seed):
+    port = launcher.free_port()
+    server = start_server(engine, port)
+    rng = random.Random(seed)
+    tally = Tally()
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(player(f"bot{i}", port, delay, random.Random(rng.random()), tally, stop))
+             for i in range(players)]
+    await asyncio.sleep(seconds / 2)
+    await replace(mode, engine, port, server)
+    await asyncio.sleep(seconds / 2)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    for pid in servers_on(port):
+        os.kill(pid, signal.SIGINT)
+    server.wait()
+    return tally
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server restart benchmark")
+    parser.add_argument("--engine", choices=["threaded", "async"], default="threaded")
+    parser.add_argument("--players", type=int, default=200, help="players at any time, an even number")
+    parser.add_argument("--seconds", type=float, default=6, help="length of each run, the server is replaced halfway")
+    parser.add_argument("--guess-delay", type=float, default=0.1, help="seconds a bot thinks before each guess")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.players} players on the {args.engine} engine, {args.seconds:g}s per run, "
+          f"{args.guess_delay * 1000:g} ms per guess")
+    print(f"{'restart':<8} {'completed':>10} {'broken':>8} {'refused':>8} {'outage ms':>10}")
+    for mode in ("kill", "drain", "hot"):
+        tally = asyncio.run(run(mode, args.engine, args.players, args.seconds, args.guess_delay, args.seed))
+        print(f"{mode:<8} {tally.completed:>10,} {tally.broken:>8,} {tally.refused:>8,} {tally.outage * 1000:>10.0f}")
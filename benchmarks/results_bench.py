@@ -0,0 +1,81 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# how long record() holds up the player who ended a game, how fast the writer gets the games into SQLite, and how
+# long the leaderboard queries take once the database holds millions of rows
+import argparse
+import os
+import random
+import tempfile
+import time
+from server.results import ResultStore, GameResult, PlayerResult
+
+
+def make_games(count, names, rng):
+    games = []
+    for _ in range(count):
+        first, second = rng.sample(names, 2)
+        winner = rng.random() < 0.5
+        players = (PlayerResult(first, rng.randint(1, 12), int(winner), winner),
+                   PlayerResult(second, rng.randint(1, 12), int(not winner), not winner))
+        games.append(GameResult(time.time(), rng.uniform(2, 30), 0, 500, (rng.randint(0, 500),),
+                                first if winner else second, players))
+    return games
+
+
+def timings(query, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        query()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Results database benchmark")
+    parser.add_argument("--games", type=int, default=1_000_000, help="two players each")
+    parser.add_argument("--players", type=int, default=100_000, help="distinct names")
+    parser.add_argument("--repeat", type=int, default=1000, help="runs of each query")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = [f"player{i}" for i in range(args.players)]
+    games = make_games(args.games, names, rng)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "results.db")
+        # the server's settings, except that nothing may be dropped
+        store = ResultStore(path, max_pending=args.games)
+
+        started = time.perf_counter()
+        for game in games:
+            store.record(game)
+        recorded = time.perf_counter() - started
+        store.close()
+        written = time.perf_counter() - started
+
+        print(f"{args.games:,} games, {2 * args.games:,} player rows, {args.players:,} players")
+        print(f"record()  {recorded * 1e6 / args.games:8.2f} µs per game")
+        print(f"written   {args.games / written:8.0f} games/s")
+
+        store = ResultStore(path)
+        print(f"{'query':<22} {'p50 ms':>8} {'p99 ms':>8}")
+        for name, query in (("top_players(10)", lambda: store.top_players(10)),
+                            ("best_games(10)", lambda: store.best_games(10))):
+            p50, p99 = timings(query, args.repeat)
+            print(f"{name:<22} {p50 * 1e3:>8.3f} {p99 * 1e3:>8.3f}")
+
+        # the same leaderboard added up from the games, what top_players() would cost without the totals table
+        def aggregate():
+            with store.reader_lock:
+                store.reader.execute("SELECT name, SUM(won) AS wins FROM game_players GROUP BY name "
+                                     "ORDER BY wins DESC LIMIT 10").fetchall()
+        p50, p99 = timings(aggregate, 3)
+        print(f"{'GROUP BY game_players':<22} {p50 * 1e3:>8.3f} {p99 * 1e3:>8.3f}")
+        store.close()
@@ -0,0 +1,224 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# memory per player and the cost of disconnecting everybody, on a server with its default settings: every player has
+# a resume token and deadlines in the reaper. Resume tokens are signed instead of stored, the "stored" layout is the
+# registry as it was before, with a random token per session kept in a dictionary. The old per-field dictionaries
+# keyed by socket are shown for reference, they could not resume a session and had no deadlines. Every player is
+# paired in a room, which is where the server spends most of its time
+import argparse
+import logging
+import random
+import secrets
+import socket
+import time
+import tracemalloc
+from enum import Enum
+from server.main import Server
+from server.matchmaking import Matchmaker
+from server.session import PlayerSession, SessionRegistry
+from protocols import Protocols, CODECS
+
+
+# stands in for a socket, the same objects are used for both layouts and created before measuring
+class FakeClient:
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+
+# the outbound queue of every player, its own memory is the same in both layouts. What is sent is dropped
+class FakeOutbox:
+    def put(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+OUTBOX = FakeOutbox()
+
+
+# the state the server kept before sessions, kept here as the baseline
+class LegacyGuessResult(Enum):
+    CORRECT = 0
+    TOO_LOW = 1
+    TOO_HIGH = 2
+    GAME_OVER = 3
+
+
+class LegacyRoom:
+    def __init__(self, client1, client2):
+        self.game_over = False
+        self.lower_bound = 0
+        self.upper_bound = 500
+        self.client1 = client1
+        self.client2 = client2
+        self.correct_number = random.randint(self.lower_bound, self.upper_bound)
+
+
+class LegacyState:
+    def __init__(self):
+        self.client_name = {}
+        self.rooms = {}
+        self.opponent = {}
+        self.matchmaker = Matchmaker()
+        self.room_ready = {}
+        self.codecs = {}
+        self.outboxes = {}
+
+    def login(self, client, name):
+        self.client_name[client] = name
+        self.codecs[client] = CODECS["binary"]
+        self.outboxes[client] = OUTBOX
+
+    def create_room(self, client, opponent):
+        room = LegacyRoom(client, opponent)
+        self.opponent[client] = opponent
+        self.opponent[opponent] = client
+        self.rooms[client] = room
+        self.rooms[opponent] = room
+
+    # Server.send_to_opponent(OPPONENT_EXITED) and Server.disconnect_client before sessions, closing the client like
+    # Server.close_client did
+    def disconnect_client(self, client):
+        opponent = self.opponent.get(client)
+        if opponent:
+            self.outboxes[opponent].put(self.codecs[opponent].encode(Protocols.Response.OPPONENT_EXITED, None))
+        if opponent in self.opponent:
+            del self.opponent[opponent]
+        if client in self.opponent:
+            del self.opponent[client]
+        if client in self.client_name:
+            del self.client_name[client]
+        if opponent in self.client_name:
+            del self.client_name[opponent]
+        if client in self.rooms:
+            del self.rooms[client]
+        if opponent in self.rooms:
+            del self.rooms[opponent]
+        self.matchmaker.leave(client)
+        self.room_ready.pop(client, None)
+        self.codecs.pop(client, None)
+        self.outboxes.pop(client, None)
+        try:
+            client.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        client.close()
+
+
+# the registry before tokens were signed, a session kept its token and the registry every token
+class StoredTokenSession(PlayerSession):
+    __slots__ = ("token",)
+
+    def __init__(self, session_id, client, codec):
+        super().__init__(session_id, client, codec)
+        self.token = None
+
+
+class StoredTokenRegistry(SessionRegistry):
+    def __init__(self):
+        super().__init__()
+        self.tokens = {}
+
+    def create(self, client, codec):
+        session = StoredTokenSession(next(self.ids), client, codec)
+        self.sessions[session.id] = session
+        return session
+
+    def remove(self, session):
+        self.sessions.pop(session.id, None)
+        if session.token:
+            self.tokens.pop(session.token, None)
+
+    def issue_token(self, session):
+        if session.token:
+            self.tokens.pop(session.token, None)
+        session.token_count += 1
+        session.token = secrets.token_urlsafe(16)
+        self.tokens[session.token] = session
+        return session.token
+
+    def find(self, token):
+        return self.tokens.get(token)
+
+
+# returns (bytes per player, µs per disconnect)
+def measure(name, build, disconnect, clients):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    handles = build(clients)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for handle in handles:
+        disconnect(handle)
+    disconnect_time = time.perf_counter() - started
+
+    count = len(clients)
+    print(f"{name:<10} {used / count:>12.0f} {used / 2 ** 20:>10.1f} {disconnect_time * 1e6 / count:>14.2f}")
+    return used / count, disconnect_time * 1e6 / count
+
+
+def build_legacy(state):
+    def build(clients):
+        for i, client in enumerate(clients):
+            state.login(client, f"player{i}")
+        for i in range(0, len(clients), 2):
+            state.create_room(clients[i + 1], clients[i])
+        return clients
+    return build
+
+
+# every player goes through add_connection() like a real connection, with the server's default settings
+def build_sessions(server):
+    # the outbound queue is the same stand-in as in the old layout
+    server.new_outbox = lambda session: OUTBOX
+
+    def build(clients):
+        sessions = []
+        for i, client in enumerate(clients):
+            session = server.add_connection(client)
+            session.name = f"player{i}"
+            session.codec = CODECS["binary"]
+            sessions.append(session)
+        for i in range(0, len(sessions), 2):
+            server.create_room((sessions[i], sessions[i + 1]))
+        return sessions
+    return build
+
+
+def disconnect_session(server):
+    def disconnect(session):
+        server.disconnect_client(session)
+        server.sessions.remove(session)
+    return disconnect
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-player memory benchmark")
+    parser.add_argument("--players", type=int, default=100_000, help="an even number, every player is in a room")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    clients = [FakeClient() for _ in range(args.players)]
+    # port 0, the benchmark never accepts a connection
+    stored = Server(port=0)
+    stored.sessions = StoredTokenRegistry()
+    server = Server(port=0)
+    legacy = LegacyState()
+
+    print(f"{args.players:,} players in rooms")
+    print(f"{'layout':<10} {'bytes/player':>12} {'total MiB':>10} {'disconnect µs':>14}")
+    measure("legacy", build_legacy(legacy), legacy.disconnect_client, clients)
+    stored_bytes, _ = measure("stored", build_sessions(stored), disconnect_session(stored), clients)
+    session_bytes, _ = measure("sessions", build_sessions(server), disconnect_session(server), clients)
+    assert not legacy.rooms and not server.open_rooms() and not len(server.sessions) and not stored.sessions.tokens
+    assert session_bytes < stored_bytes, "signed tokens take more memory than stored ones"
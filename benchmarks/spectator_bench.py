@@ -0,0 +1,118 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# the cost of sending a game to its spectators: one room, two players playing a binary search, and 100 to 10k
+# spectators that get every guess, the winner and the numbers. broadcast() encodes each message once per wire format
+# and puts the same bytes in every spectator's queue, against encoding it again for every spectator with send(). The
+# cost per spectator should stay flat as the audience grows
+import argparse
+import logging
+import random
+import time
+from server.main import Server
+from protocols import CODECS
+
+
+# stands in for a socket, nothing is ever written to it
+class FakeClient:
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+
+# keeps the last message queued, and counts them
+class CountingOutbox:
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.last = None
+
+    def put(self, data):
+        self.messages += 1
+        self.bytes += len(data)
+        self.last = data
+
+    def close(self):
+        pass
+
+
+def new_session(server, name, codec):
+    session = server.sessions.create(FakeClient(), codec)
+    session.outbox = CountingOutbox()
+    session.name = name
+    return session
+
+
+# what the server did before broadcast(): every message encoded for each player on their own
+def send_to_each(server):
+    def broadcast(r_type, data, players, exclude=None):
+        for player in players:
+            if player is not exclude:
+                server.send(r_type, data, player)
+    server.broadcast = broadcast
+
+
+# one game watched by every spectator, returns the seconds it took
+def play(server, spectators, rng):
+    players = (new_session(server, "alice", CODECS["binary"]), new_session(server, "bob", CODECS["binary"]))
+    server.create_room(players)
+    room = players[0].room
+    for spectator in spectators:
+        spectator.watching = room
+        room.watch(spectator)
+
+    # each player narrows down the number on their own, a server with the default settings hides just one
+    bounds = {player: [room.lower_bound, room.upper_bound] for player in players}
+    started = time.perf_counter()
+    while not room.game_over:
+        player = rng.choice(players)
+        lower, upper = bounds[player]
+        guess = (lower + upper) // 2
+        server.handle_guess(guess, room, player)
+        if guess < room.correct_number:
+            bounds[player][0] = guess + 1
+        else:
+            bounds[player][1] = guess - 1
+    elapsed = time.perf_counter() - started
+
+    server.close_room(room)
+    for spectator in spectators:
+        room.unwatch(spectator)
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spectator fan-out benchmark")
+    parser.add_argument("--spectators", type=int, nargs="+", default=[100, 1000, 10_000])
+    parser.add_argument("--games", type=int, default=20, help="games watched at each size")
+    parser.add_argument("--json", type=float, default=0.5, help="part of the spectators using the JSON wire format")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    print(f"{args.games} games at each size, {args.json:.0%} of the spectators on JSON")
+    print(f"{'delivery':<10} {'spectators':>10} {'events':>7} {'µs/event':>10} {'ns/spectator':>13} "
+          f"{'buffers/event':>14}")
+    for name in ("send", "broadcast"):
+        for count in args.spectators:
+            # port 0, the benchmark never accepts a connection
+            server = Server(port=0, resume_grace=0, login_timeout=0, idle_timeout=0, heartbeat=0)
+            if name == "send":
+                send_to_each(server)
+            rng = random.Random(args.seed)
+            spectators = [new_session(server, "spectator", CODECS["json" if rng.random() < args.json else "binary"])
+                          for _ in range(count)]
+
+            elapsed = sum(play(server, spectators, rng) for _ in range(args.games))
+            events = spectators[0].outbox.messages
+            per_event = elapsed / events
+            # the last message of every spectator, the same object for everybody on the same wire format
+            buffers = len({id(spectator.outbox.last) for spectator in spectators})
+            print(f"{name:<10} {count:>10,} {events // args.games:>7} {per_event * 1e6:>10.1f} "
+                  f"{per_event / count * 1e9:>13.1f} {buffers:>14,}")
+            server.server.close()
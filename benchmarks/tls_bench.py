@@ -0,0 +1,84 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# cost of opening a connection to the server: plain TCP, TLS with a full handshake and TLS resuming the session of an
+# earlier connection. Every connection waits for the server's first message (the nickname request), so the time is
+# what a player waits before they can log in. The server's CPU time per connection is read from /proc (Linux only)
+import argparse
+import asyncio
+import tempfile
+import time
+from tls import ClientContext, make_self_signed
+import launcher
+
+
+# with TLS unless certfile is None
+def start_server(engine, port, certfile=None, keyfile=None):
+    flags = ["--engine", engine, "--accept-rate", "0", "--log-level", "warning"]
+    if certfile:
+        flags += ["--tls-cert", certfile, "--tls-key", keyfile]
+    return launcher.start_server(port, flags)
+
+
+async def connect_once(port, context, resume):
+    if context is not None and not resume:
+        context.sessions.clear()
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, ssl=context)
+    await reader.read(1024)
+    elapsed = time.perf_counter() - started
+    reused = False
+    if context is not None:
+        ssl_object = writer.get_extra_info("ssl_object")
+        reused = ssl_object.session_reused
+        context.remember("127.0.0.1", ssl_object)
+    writer.close()
+    await writer.wait_closed()
+    return elapsed, reused
+
+
+async def measure(port, pid, context, resume, count):
+    # one connection first, so a resumed run has a session to resume
+    await connect_once(port, context, False)
+    times = []
+    reused = 0
+    cpu = launcher.cpu_seconds(pid)
+    for _ in range(count):
+        elapsed, was_reused = await connect_once(port, context, resume)
+        times.append(elapsed)
+        reused += was_reused
+    cpu = launcher.cpu_seconds(pid) - cpu
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.99)], cpu / count, reused
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TLS handshake benchmark")
+    parser.add_argument("--connections", type=int, default=1000, help="per run")
+    parser.add_argument("--engine", choices=["threaded", "async"], default="async")
+    parser.add_argument("--key", choices=["ec", "rsa"], default="ec", help="key of the server's certificate")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = make_self_signed(directory, key=args.key)
+        runs = [("tcp", None, False),
+                ("tls full", ClientContext(certfile), False),
+                ("tls resumed", ClientContext(certfile), True)]
+        print(f"{args.connections} connections, {args.engine} server, {args.key} certificate")
+        print(f"{'run':<12} {'p50 ms':>8} {'p99 ms':>8} {'server CPU µs':>14} {'resumed':>8}")
+        for name, context, resume in runs:
+            # the plain TCP run needs a server without TLS
+            port = launcher.free_port()
+            if context is None:
+                server = start_server(args.engine, port)
+            else:
+                server = start_server(args.engine, port, certfile, keyfile)
+            try:
+                p50, p99, cpu, reused = asyncio.run(measure(port, server.pid, context, resume, args.connections))
+            finally:
+                server.terminate()
+                server.wait()
+            print(f"{name:<12} {p50 * 1e3:>8.3f} {p99 * 1e3:>8.3f} {cpu * 1e6:>14.0f} {reused:>8}")
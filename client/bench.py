@@ -0,0 +1,223 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# headless load generator: thousands of bots log in, get paired and play, then we report how the server coped.
+# Run it with:  python3 -m client.bench --bots 1000 --output results.json
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import time
+from client.core import GameClient
+from tls import ClientContext
+from protocols import Protocols
+from launcher import percentile
+
+
+# how a bot picks its next guess between the bounds it has narrowed down
+def binary_search(lower, upper, rng):
+    return (lower + upper) // 2
+
+
+def random_guess(lower, upper, rng):
+    return rng.randint(lower, upper)
+
+
+STRATEGIES = {
+    "binary": binary_search,
+    "random": random_guess,
+}
+
+
+class Bot:
+    # a headless GameClient (client/core.py) and what we measure of its game, a single process can run thousands
+    def __init__(self, name, strategy, host, port, wire_format, rng, tls=None):
+        self.client = GameClient(host, port, wire_format, reconnect_attempts=0, tls=tls)
+        self.client.quiet = True
+        self.name = name
+        self.strategy = strategy
+        self.rng = rng
+
+        # measurements
+        self.connect_latency = None
+        self.time_to_start = None
+        self.rtts = []
+
+    @property
+    def won(self):
+        return self.client.winner == self.name
+
+    async def run(self, connect_slots):
+        began = time.perf_counter()
+        # only so many connections are opened at the same time, so the listen queue does not overflow
+        async with connect_slots:
+            await self.client.connect()
+        self.connect_latency = time.perf_counter() - began
+
+        try:
+            await self.client.login(self.name)
+            if not await self.client.wait_for_start():
+                return
+            self.time_to_start = time.perf_counter() - began
+            await self.play()
+        finally:
+            await self.client.close()
+
+    async def play(self):
+        client = self.client
+        lower, upper = client.lower_bound, client.upper_bound
+        while not client.finished:
+            guess = self.strategy(lower, upper, self.rng)
+            sent = time.perf_counter()
+            result = await client.guess(guess)
+            if result is None:
+                return
+            self.rtts.append(time.perf_counter() - sent)
+
+            if result == Protocols.Response.GUESS_TOO_LOW:
+                lower = guess + 1
+            elif result == Protocols.Response.GUESS_TOO_HIGH:
+                upper = guess - 1
+            else:
+                # the hints are about the smallest number left, the next one is above this one. WINNER follows the
+                # correct guess once every number has been found
+                lower = guess + 1
+            # another player found the number we were closing in on, the next one can be above upper
+            if lower > upper:
+                upper = client.upper_bound
+
+
+# resident memory of a process and all its children (the workers in --workers mode), in bytes. Linux only
+def server_rss(pid):
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as children:
+                    pending.extend(int(child) for child in children.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def percentiles(values):
+    if not values:
+        return None
+    return {
+        "p50": percentile(values, 0.50),
+        "p90": percentile(values, 0.90),
+        "p99": percentile(values, 0.99),
+        "max": max(values),
+        "mean": sum(values) / len(values),
+    }
+
+
+async def watch_rss(pid, samples, interval=0.5):
+    while True:
+        samples.append(server_rss(pid))
+        await asyncio.sleep(interval)
+
+
+async def run_bench(args):
+    rng = random.Random(args.seed)
+    strategy = STRATEGIES[args.strategy]
+    # one context for every bot, the first one's TLS session is resumed by the others
+    tls = ClientContext(args.tls_ca) if args.tls_ca else None
+    bots = [
+        Bot(f"bot{i}", strategy, args.host, args.port, args.wire_format, random.Random(rng.random()), tls)
+        for i in range(args.bots)
+    ]
+    connect_slots = asyncio.Semaphore(args.connect_concurrency)
+
+    rss_samples = []
+    watcher = None
+    if args.server_pid:
+        watcher = asyncio.get_running_loop().create_task(watch_rss(args.server_pid, rss_samples))
+
+    began = time.perf_counter()
+    outcomes = await asyncio.gather(
+        *(asyncio.wait_for(bot.run(connect_slots), args.timeout) for bot in bots), return_exceptions=True)
+    elapsed = time.perf_counter() - began
+
+    if watcher:
+        watcher.cancel()
+        rss_samples.append(server_rss(args.server_pid))
+
+    errors = {}
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            name = type(outcome).__name__
+            errors[name] = errors.get(name, 0) + 1
+
+    games = sum(bot.won for bot in bots)
+    return {
+        "config": vars(args),
+        "bots": args.bots,
+        "elapsed": elapsed,
+        "errors": errors,
+        "games": games,
+        "games_per_sec": games / elapsed if elapsed else None,
+        "connect_latency": percentiles([bot.connect_latency for bot in bots if bot.connect_latency is not None]),
+        "time_to_start": percentiles([bot.time_to_start for bot in bots if bot.time_to_start is not None]),
+        "guess_rtt": percentiles([rtt for bot in bots for rtt in bot.rtts]),
+        "guesses": sum(len(bot.rtts) for bot in bots),
+        "server_rss_peak": max(rss_samples) if rss_samples else None,
+        "server_rss_end": rss_samples[-1] if rss_samples else None,
+    }
+
+
+def print_report(results):
+    print(f"{results['bots']} bots, {results['games']} games in {results['elapsed']:.2f}s "
+          f"({results['games_per_sec']:.1f} games/s), {results['guesses']} guesses")
+    if results["errors"]:
+        print(f"errors: {results['errors']}")
+    for name in ("connect_latency", "time_to_start", "guess_rtt"):
+        stats = results[name]
+        if stats:
+            print(f"{name:<16} p50 {stats['p50'] * 1000:8.2f}ms  p90 {stats['p90'] * 1000:8.2f}ms  "
+                  f"p99 {stats['p99'] * 1000:8.2f}ms  max {stats['max'] * 1000:8.2f}ms")
+    if results["server_rss_peak"]:
+        print(f"server RSS peak {results['server_rss_peak'] / 2 ** 20:.1f} MiB, "
+              f"end {results['server_rss_end'] / 2 ** 20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless load generator for the game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=55556)
+    parser.add_argument("--bots", type=int, default=100, help="number of bots, an even number fills every room")
+    parser.add_argument("--strategy", choices=sorted(STRATEGIES), default="binary")
+    parser.add_argument("--wire-format", choices=["json", "binary"], default="binary")
+    parser.add_argument("--connect-concurrency", type=int, default=256,
+                        help="how many connections may be opening at the same time")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds a bot may take for its whole game")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--server-pid", type=int, default=None, help="sample this process's RSS (Linux)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--tls-ca", default=None, help="connect with TLS, trusting this certificate")
+    args = parser.parse_args()
+
+    # every bot holds one file descriptor
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
+
+    results = asyncio.run(run_bench(args))
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
@@ -1,132 +1,78 @@
-import socket
+import asyncio
+import concurrent.futures
 import threading
-import json
+from client.core import GameClient
 from protocols import Protocols
-import traceback
 
-class Client:
-    def __init__(self, host = "127.0.0.1", port = 55556):
-        self.nickname = None
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.connect((host, port))
-
-        self.closed = False
-        self.started = False
-        self.opponent_name = None
-        self.winner = None
-        self.correct_number = None
-        self.game_over = False
-
-        # bounds of correct number generated by the room
-        self.lower_bound = None
-        self.upper_bound = None
-
-        # message system to display to the client window
-        # list to hold all messages
-        self.messages = []
-        # limit to display only the last 5 most recent
-        self.message_limit = 5
-        self.last_message = ""
-
-    # handle adding message to the list
-    def add_message(self, message):
-        self.messages.append(message)
-        # the limit of messages in the list is checked and the oldest is popped if necessary
-        if len(self.messages) > self.message_limit:
-            self.messages.pop(0)
-        self.last_message = message
 
+# the client of the pygame window: a GameClient (client/core.py) running on an event loop in its own thread, so the
+# window's loop never waits for the network. Everything the window reads (started, winner, messages...) is the state
+# of the GameClient, the calls that talk to the server are handed to the client's thread
+class Client:
+    def __init__(self, host = "127.0.0.1", port = 55556, wire_format = "binary", recv_size = 4096, **options):
+        self.core = GameClient(host, port, wire_format, recv_size, **options)
+        self.loop = None
+        self.thread = None
+
+    # the game state is the GameClient's
+    def __getattr__(self, name):
+        if name == "core":
+            raise AttributeError(name)
+        return getattr(self.core, name)
+
+    # connect and start receiving on the client's thread, raises OSError like socket.connect() if the server is
+    # not there
     def start(self):
-        # we want to receive all data on a separate thread for each client
-        recv_thread = threading.Thread(target=self.receive)
-        recv_thread.start()
-
-    def send(self, request, message):
-        data = {"type": request, "data": message}
-        self.server.send((json.dumps(data) + "\n").encode("UTF-8"))
-
-    def receive(self):
-        # because we use the newline char for better readability when receiving messages from the server, we need to
-        # use a buffer to handle this on the client side because we may receive more/less than 1024 bytes and will
-        # parse the data from that buffer
-        buffer = ""
-        while not self.closed:
-            try:
-                data = self.server.recv(1024).decode("UTF-8")
-                # we may need to close the connection gracefully
-                if not data:
-                    break
-                buffer += data
-                while "\n" in buffer:
-                    message, buffer = buffer.split("\n", 1)
-                    self.handle_response(json.loads(message))
-            except (ConnectionError, ConnectionResetError, BrokenPipeError):
-                    print("Lost connection to server")
-                    break
-            except json.JSONDecodeError as e:
-                print(f"Received invalid data: {e}")
-                # we continue because we can still recover if valid data arrives
-                continue
-            except UnicodeDecodeError as e:
-                print(f"Received non-UTF8 data: {e}")
-                break
-            except Exception as e:
-                print(f"Unexpected error: {e}")
-                traceback.print_exc()
-                break
-
-        # if we break out of loop we close
-        self.close_conn()
+        connected = concurrent.futures.Future()
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(connected),), name="client")
+        self.thread.start()
+        connected.result()
 
-
-    def close_conn(self):
-        self.closed = True
+    async def run(self, connected):
+        self.loop = asyncio.get_running_loop()
         try:
-            self.server.shutdown(socket.SHUT_RDWR)
-        except OSError:
-            pass
-        self.server.close()
-
-    def handle_response(self, response):
-        r_type = response.get("type")
-        data = response.get("data")
-
-        if r_type == Protocols.Response.GAME_BOUNDS:
-            self.lower_bound = data["lower"]
-            self.upper_bound = data["upper"]
-
-        if r_type == Protocols.Response.GUESS_TOO_LOW:
-            self.add_message("Your guess was too low.")
-
-        elif r_type == Protocols.Response.GUESS_TOO_HIGH:
-            self.add_message("Your guess was too high.")
-
-        elif r_type == Protocols.Response.GUESS_VALID:
-            self.add_message("Your guess was correct!")
-
-        elif r_type == Protocols.Response.WINNER:
-            self.add_message(f"Winner: {data}")
-
-        elif r_type == Protocols.Response.OPPONENT:
-            self.opponent_name = data
-            self.add_message(f"Your opponents name: {self.opponent_name}")
-
-        elif r_type == Protocols.Response.OPPONENT_EXITED:
-            self.game_over = True
-            self.add_message(f"Your opponent has exited the game!")
-
-        elif r_type == Protocols.Response.CORRECT_NUMBER:
-            self.correct_number = data
-            print(f"Correct number was: {data}")
-
-        elif r_type == Protocols.Response.START:
-            self.started = True
-            self.add_message(f"Let the game begin!")
-
+            await self.core.connect()
+        except OSError as e:
+            connected.set_exception(e)
+            return
+        connected.set_result(None)
+        # the thread ends with the connection, close() cancels the receiving task
+        await asyncio.wait([self.core.receiving])
+
+    # callback(message) is called on the client's thread for every message of this type (every message with None)
+    def on(self, r_type, callback):
+        self.core.on(r_type, callback)
 
+    def send(self, request, message):
+        self.loop.call_soon_threadsafe(self.core.send, request, message)
 
+    def login(self, nickname):
+        self.core.nickname = nickname
+        self.send(Protocols.Request.NICKNAME, nickname)
 
+    # watch a game instead of playing, see GameClient.spectate()
+    def spectate(self, player=None):
+        self.send(Protocols.Request.SPECTATE, player or "")
 
+    def guess(self, number):
+        self.send(Protocols.Request.GUESS, number)
 
+    # we quit, the server does not need to keep our place
+    def leave(self):
+        self.stop(self.core.leave)
 
+    def close_conn(self):
+        self.stop(self.core.close)
 
+    def stop(self, close, timeout=5):
+        if self.thread and self.thread.is_alive():
+            try:
+                asyncio.run_coroutine_threadsafe(close(), self.loop).result(timeout)
+            except (OSError, concurrent.futures.TimeoutError):
+                pass
+        self.join(timeout)
+
+    # wait for the client's thread to end, it ends with the connection
+    def join(self, timeout=None):
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
@@ -0,0 +1,479 @@
+# the client without a window: an asyncio connection to the server that keeps track of the game. The benchmark bots,
+# tests and the pygame window (through Client in client/client.py) are all built on it.
+#
+#     client = GameClient()
+#     await client.connect()
+#     await client.login("alice")
+#     if await client.wait_for_start():
+#         result = await client.guess(250)
+#
+# Every message from the server first updates the state, then goes to the callbacks registered with on() and to
+# everybody iterating over the client with  async for message in client
+import asyncio
+import collections
+import json
+import random
+import traceback
+from framing import FrameReader
+from protocols import (Protocols, ProtocolError, FrameError, CODECS, DEFAULT_CODEC, PROTOCOL_VERSION, COMPRESSIONS,
+                       find_codec, offer)
+
+
+# what a client knows about its game, kept up to date from the messages of the server
+class GameState:
+    # the text shown for each result of a guess batch
+    batch_results = {
+        0: "Your guess was correct!",
+        1: "Your guess was too low.",
+        2: "Your guess was too high.",
+    }
+    # the same for the guesses of a game we watch
+    watched_results = {
+        0: "correct",
+        1: "too low",
+        2: "too high",
+    }
+
+    def __init__(self):
+        self.nickname = None
+        # every message after the server acknowledged our wire format is encoded with it
+        self.codec = DEFAULT_CODEC
+        # what the server agreed to in its HELLO, an older server never sends one: version 1, guesses one by one
+        self.version = 1
+        self.max_batch = 0
+        # seconds of quiet after which the server sends us a PING, 0 if it never does
+        self.heartbeat = 0
+        self.closed = False
+        self.started = False
+        self.opponent_name = None
+        self.winner = None
+        self.correct_number = None
+        self.game_over = False
+        # True once the server let us watch a game instead of playing
+        self.spectating = False
+
+        # bounds of correct number generated by the room
+        self.lower_bound = None
+        self.upper_bound = None
+
+        # the token to resume our session with if the connection drops, and whether we are waiting for the answer
+        self.token = None
+        self.resuming = False
+
+        # message system to display to the client window
+        # list to hold all messages
+        self.messages = []
+        # limit to display only the last 5 most recent
+        self.message_limit = 5
+        self.last_message = ""
+        # True to stop printing to the terminal, for headless clients
+        self.quiet = False
+
+    # the game is over for us: somebody won, everybody else left or the connection is gone for good
+    @property
+    def finished(self):
+        return self.closed or self.game_over or self.winner is not None
+
+    # handle adding message to the list
+    def add_message(self, message):
+        self.messages.append(message)
+        # the limit of messages in the list is checked and the oldest is popped if necessary
+        if len(self.messages) > self.message_limit:
+            self.messages.pop(0)
+        self.last_message = message
+
+    def handle_response(self, response):
+        r_type = response.get("type")
+        data = response.get("data")
+
+        # every message after the acknowledgement uses the new wire format
+        if r_type == Protocols.Response.WIRE_FORMAT:
+            self.codec = CODECS[data]
+
+        elif r_type == Protocols.Response.HELLO:
+            self.codec = find_codec(data["format"], data["compression"]) or DEFAULT_CODEC
+            self.version = data["version"]
+            self.max_batch = data["batching"]
+            self.heartbeat = data.get("heartbeat", 0)
+
+        if r_type == Protocols.Response.SESSION_TOKEN:
+            self.token = data
+
+        elif r_type == Protocols.Response.RESUMED:
+            self.resuming = False
+            self.add_message("Reconnected, the game goes on!")
+
+        elif r_type == Protocols.Response.RESUME_REJECTED:
+            self.resuming = False
+            self.token = None
+            self.game_over = True
+            self.add_message("Your game could not be resumed.")
+
+        elif r_type == Protocols.Response.SPECTATING:
+            self.spectating = True
+            self.started = True
+            self.opponent_name = ", ".join(data["players"])
+            self.lower_bound = data["lower"]
+            self.upper_bound = data["upper"]
+            self.add_message(f"Watching {self.opponent_name}")
+
+        elif r_type == Protocols.Response.SPECTATE_REJECTED:
+            self.game_over = True
+            self.add_message("There is no game to watch.")
+
+        if r_type == Protocols.Response.GAME_BOUNDS:
+            self.lower_bound = data["lower"]
+            self.upper_bound = data["upper"]
+
+        if r_type == Protocols.Response.GUESS_TOO_LOW:
+            self.add_message("Your guess was too low.")
+
+        elif r_type == Protocols.Response.GUESS_TOO_HIGH:
+            self.add_message("Your guess was too high.")
+
+        elif r_type == Protocols.Response.GUESS_VALID:
+            self.add_message("Your guess was correct!")
+
+        # one result per guess of a batch, the values of GuessResult on the server
+        elif r_type == Protocols.Response.GUESS_BATCH_RESULT:
+            for result in data:
+                self.add_message(self.batch_results.get(result, "Your guess was not accepted."))
+
+        # the guesses of a player in the game we watch
+        elif r_type == Protocols.Response.ROOM_GUESSES:
+            for guess, result in zip(data["guesses"], data["results"]):
+                self.add_message(f"{data['player']} guessed {guess}: {self.watched_results.get(result, '?')}")
+
+        elif r_type == Protocols.Response.WINNER:
+            self.winner = data
+            self.add_message(f"Winner: {data}")
+
+        elif r_type == Protocols.Response.OPPONENT:
+            self.opponent_name = data
+            self.add_message(f"Your opponents name: {self.opponent_name}")
+
+        elif r_type == Protocols.Response.OPPONENT_EXITED:
+            self.game_over = True
+            self.add_message(f"Your opponent has exited the game!")
+
+        elif r_type == Protocols.Response.CORRECT_NUMBER:
+            self.correct_number = data
+            if not self.quiet:
+                print(f"Correct number was: {data}")
+
+        elif r_type == Protocols.Response.START:
+            self.started = True
+            self.add_message(f"Let the game begin!")
+
+
+class GameClient(GameState):
+    # the answers to guesses, the server answers the guesses of a client in order
+    GUESS_RESULTS = (Protocols.Response.GUESS_TOO_LOW, Protocols.Response.GUESS_TOO_HIGH,
+                     Protocols.Response.GUESS_VALID, Protocols.Response.GUESS_BATCH_RESULT)
+    # the GuessResult values of a batch result, by the answer to a single guess
+    CORRECT = 0
+    SINGLE_RESULTS = {
+        Protocols.Response.GUESS_VALID: CORRECT,
+        Protocols.Response.GUESS_TOO_LOW: 1,
+        Protocols.Response.GUESS_TOO_HIGH: 2,
+    }
+
+    def __init__(self, host="127.0.0.1", port=55556, wire_format="binary", recv_size=4096, reconnect_attempts=8,
+                 reconnect_delay=0.25, max_reconnect_delay=8, protocol_version=PROTOCOL_VERSION,
+                 compressions=COMPRESSIONS, tls=None):
+        super().__init__()
+        self.host = host
+        self.port = port
+        # a ClientContext (tls.py) to connect with TLS, None for plain TCP. The context keeps the TLS session, so a
+        # reconnect (or another client sharing the context) resumes it
+        self.tls = tls
+        # what we offer the server when sending our nickname: the wire format, and from version 2 on the compressions
+        # we understand and guess batching. We keep using JSON until the server acknowledges it (older servers never
+        # do)
+        self.wire_format = wire_format
+        self.protocol_version = protocol_version
+        self.compressions = compressions
+        # how many bytes each read from the server asks for
+        self.recv_size = recv_size
+        # if the connection drops during a game we reconnect and resume the session with the token the server gave
+        # us. The wait before each attempt doubles from reconnect_delay up to max_reconnect_delay
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.reader = None
+        self.writer = None
+        # the task reading from the server, it ends when the connection is gone for good
+        self.receiving = None
+        # cleared while the connection is lost, guesses wait for it to come back
+        self.connected = asyncio.Event()
+        # set when START arrives, or the game ends before it
+        self.started_event = asyncio.Event()
+        # set once the game is over for us
+        self.finished_event = asyncio.Event()
+        # futures of the guesses the server has not answered yet
+        self.pending = collections.deque()
+
+        # callbacks by message type, None for every message
+        self.callbacks = {}
+        # a queue for everybody iterating over the messages
+        self.subscribers = []
+
+    async def connect(self):
+        self.reader, self.writer = await self.open_connection()
+        self.connected.set()
+        self.receiving = asyncio.get_running_loop().create_task(self.receive())
+
+    def open_connection(self):
+        return asyncio.open_connection(self.host, self.port, ssl=self.tls)
+
+    async def login(self, nickname):
+        self.nickname = nickname
+        self.send(Protocols.Request.NICKNAME, nickname)
+        await self.drain()
+
+    # watch the game of the player called player instead of playing, the game that started last without a name.
+    # wait_for_start() returns False if there is no such game
+    async def spectate(self, player=None):
+        self.send(Protocols.Request.SPECTATE, player or "")
+        await self.drain()
+
+    # wait until the game starts, returns False if it ended before that
+    async def wait_for_start(self):
+        await self.started_event.wait()
+        return not self.finished
+
+    async def wait_for_end(self):
+        await self.finished_event.wait()
+
+    # returns the response type of the answer (GUESS_TOO_LOW, GUESS_TOO_HIGH or GUESS_VALID)
+    async def guess(self, number):
+        return await self.request(Protocols.Request.GUESS, number)
+
+    # returns the list of results, one GuessResult value per guess the server verified (it stops at the first correct
+    # one), None if the game ended first. Batches longer than the server accepts are split, a server that did not
+    # agree to batching gets the guesses one by one
+    async def guess_batch(self, guesses):
+        guesses = list(guesses)
+        if not self.max_batch:
+            return await self.guess_one_by_one(guesses)
+
+        results = []
+        for start in range(0, len(guesses), self.max_batch):
+            chunk = guesses[start:start + self.max_batch]
+            answer = await self.request(Protocols.Request.GUESS_BATCH, chunk)
+            if answer is None:
+                return results or None
+            results += answer
+            if len(answer) < len(chunk) or answer[-1] == self.CORRECT:
+                break
+        return results
+
+    async def guess_one_by_one(self, guesses):
+        results = []
+        for number in guesses:
+            answer = await self.guess(number)
+            if answer is None:
+                return results or None
+            results.append(self.SINGLE_RESULTS[answer])
+            if answer == Protocols.Response.GUESS_VALID:
+                break
+        return results
+
+    # send a guess and wait for its answer, None if the game ended first (or the answer got lost with the connection)
+    async def request(self, r_type, data):
+        await self.connected.wait()
+        if self.finished:
+            return None
+        result = asyncio.get_running_loop().create_future()
+        self.pending.append(result)
+        self.send(r_type, data)
+        return await result
+
+    # we quit, the server does not need to keep our place
+    async def leave(self):
+        if not self.closed:
+            self.send(Protocols.Request.LEAVE_SERVER, None)
+            await self.drain()
+        await self.close()
+
+    async def close(self):
+        self.closed = True
+        if self.writer:
+            self.writer.close()
+        if self.receiving and self.receiving is not asyncio.current_task():
+            self.receiving.cancel()
+            await asyncio.gather(self.receiving, return_exceptions=True)
+
+    # callback(message) for every message of this type from the server, r_type None for every message
+    def on(self, r_type, callback):
+        self.callbacks.setdefault(r_type, []).append(callback)
+
+    def __aiter__(self):
+        return self.events()
+
+    # every message from the server until the connection is gone for good
+    async def events(self):
+        if self.closed:
+            return
+        queue = asyncio.Queue()
+        self.subscribers.append(queue)
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.subscribers.remove(queue)
+
+    def send(self, request, message):
+        if self.writer is None or self.writer.is_closing():
+            self.add_message("Not connected to the server")
+            return
+        self.writer.write(self.encode(request, message))
+
+    async def drain(self):
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            # the receiving task finds out too and reconnects
+            pass
+
+    def encode(self, request, message):
+        # the nickname (or the token after reconnecting, or the player to watch) is always sent in JSON, it carries
+        # the wire format we would like to switch to and what else we can do
+        if request in (Protocols.Request.NICKNAME, Protocols.Request.RESUME, Protocols.Request.SPECTATE):
+            data = {"type": request, "data": message}
+            data.update(offer(self.wire_format, self.protocol_version, self.compressions))
+            return (json.dumps(data) + "\n").encode("UTF-8")
+        return self.codec.encode(request, message)
+
+    async def receive(self):
+        try:
+            # a connection lost during a game is resumed on a new one
+            while await self.receive_connection() and self.can_resume() and await self.reconnect():
+                pass
+        finally:
+            self.end()
+
+    # read from the current connection until it ends, returns True if it was lost and not closed on purpose
+    async def receive_connection(self):
+        # TCP does not hold message boundaries, each message is split with the current codec, which changes when the
+        # server acknowledges our wire format
+        frames = FrameReader(self.recv_size)
+        first = True
+        while not self.closed:
+            try:
+                data = await self.reader.read(self.recv_size)
+            except ConnectionError:
+                break
+            if not data:
+                break
+            # the server's TLS 1.3 tickets arrive with its first message
+            if first and self.tls:
+                self.tls.remember(self.host, self.writer.get_extra_info("ssl_object"))
+            first = False
+            frames.feed(data)
+            while True:
+                codec = self.codec
+                try:
+                    frame = frames.next_frame(codec)
+                    if frame is None:
+                        break
+                    self.dispatch(codec.parse(frame))
+                except FrameError as e:
+                    # the stream can not be split into messages anymore
+                    if not self.quiet:
+                        print(f"Received invalid data: {e}")
+                    return False
+                except (json.JSONDecodeError, ProtocolError) as e:
+                    # we continue because we can still recover if valid data arrives
+                    if not self.quiet:
+                        print(f"Received invalid data: {e}")
+
+        if self.closed:
+            return False
+        self.connected.clear()
+        self.resolve_pending()
+        if not self.quiet:
+            print("Lost connection to server")
+        return True
+
+    # only a game that is still going is worth coming back to
+    def can_resume(self):
+        return self.token is not None and not self.finished
+
+    # connect again and ask for our session back. The wait doubles after every failed attempt, with jitter so the
+    # clients of a restarting server do not all come back at the same moment
+    async def reconnect(self):
+        self.add_message("Connection lost, reconnecting...")
+        for attempt in range(self.reconnect_attempts):
+            delay = min(self.max_reconnect_delay, self.reconnect_delay * 2 ** attempt)
+            await asyncio.sleep(delay * random.uniform(0.5, 1))
+            if self.closed:
+                return False
+            try:
+                self.reader, self.writer = await asyncio.wait_for(self.open_connection(), timeout=5)
+            except (OSError, asyncio.TimeoutError):
+                continue
+            # the new connection starts in JSON like the first one and negotiates again, guesses wait for RESUMED
+            self.codec = DEFAULT_CODEC
+            self.version = 1
+            self.max_batch = 0
+            self.heartbeat = 0
+            self.resuming = True
+            self.send(Protocols.Request.RESUME, self.token)
+            return True
+
+        self.add_message("Could not reconnect to the server")
+        return False
+
+    def dispatch(self, response):
+        r_type = response.get("type")
+        # the server checks we are still there, nobody else needs to know
+        if r_type == Protocols.Response.PING:
+            self.send(Protocols.Request.PONG, None)
+            return
+        self.handle_response(response)
+
+        if r_type in self.GUESS_RESULTS and self.pending:
+            result = self.pending.popleft()
+            if not result.done():
+                result.set_result(response.get("data") if r_type == Protocols.Response.GUESS_BATCH_RESULT else r_type)
+        if r_type in (Protocols.Response.RESUMED, Protocols.Response.RESUME_REJECTED):
+            self.connected.set()
+        if r_type in (Protocols.Response.START, Protocols.Response.SPECTATING):
+            self.started_event.set()
+        if self.finished:
+            self.finish()
+
+        for callback in self.callbacks.get(r_type, []) + self.callbacks.get(None, []):
+            try:
+                callback(response)
+            except Exception:
+                traceback.print_exc()
+        for queue in self.subscribers:
+            queue.put_nowait(response)
+
+    # nobody waits for a game that is over
+    def finish(self):
+        self.started_event.set()
+        self.finished_event.set()
+        self.connected.set()
+        self.resolve_pending()
+
+    def resolve_pending(self):
+        while self.pending:
+            result = self.pending.popleft()
+            if not result.done():
+                result.set_result(None)
+
+    # the connection is gone for good
+    def end(self):
+        self.closed = True
+        if self.writer:
+            self.writer.close()
+        self.finish()
+        for queue in self.subscribers:
+            queue.put_nowait(None)
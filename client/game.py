@@ -1,14 +1,28 @@
+import argparse
 import pygame
 from client.client import Client
-from protocols import Protocols
+from protocols import MAX_NAME_LENGTH
+from tls import ClientContext
+from client.render import Renderer
+
+# posted by the client's thread for every message from the server, it wakes up the window to draw the new state
+SERVER_MESSAGE = pygame.USEREVENT + 1
+
 
 class Game:
+    # the window only draws the state of the client and passes on what the player types, the connection is run by
+    # the client on its own thread
     def __init__(self, client):
         self.client = client
-        client.start()
+        client.on(None, self.on_message)
 
         self.font = None
         self.message_font = None
+        self.renderer = None
+        # what the window showed last time it was drawn, see view()
+        self.shown_view = None
+        # the window is never drawn more often than this (the frame rate it always had), however fast messages arrive
+        self.max_fps = 30
         self.input_box = pygame.Rect(50, 100, 400, 32)
         self.color_active = pygame.Color("springgreen1")
         self.color_inactive = pygame.Color("slateblue1")
@@ -21,26 +35,39 @@ class Game:
     def run(self):
         pygame.init()
         screen = pygame.display.set_mode((800, 600))
+        self.renderer = Renderer(screen)
         clock = pygame.time.Clock()
         self.font = pygame.font.SysFont("monospace", 24)
         self.message_font = pygame.font.SysFont("monospace", 18)
+        # the client posts events to the window, so it starts once the window is there
+        self.client.start()
 
         # while the client is still playing, we use the event loop
         while not self.client.closed:
-            # setting a specific frame rate for consistency on all server host machines
-            clock.tick(30)
-            # loop through all events
-            for event in pygame.event.get():
-                # if the client closes the window, the socket will close. Leading to opponents closing as well
+            # sleep until the player does something or a message arrives, the timeout notices a connection that is
+            # gone for good
+            events = [pygame.event.wait(1000)] + pygame.event.get()
+            for event in events:
+                # if the client closes the window, we tell the server we left
                 if event.type == pygame.QUIT:
-                    self.client.close_conn()
+                    self.client.leave()
                     pygame.quit()
-                else:
-                    self.handle_event(event)
-
-            self.draw(screen)
+                    return
+                # the window was covered, what was on it is gone
+                if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    self.renderer.invalidate()
+                self.handle_event(event)
+
+            self.draw()
+            # messages that arrive while we wait here are drawn together in the next frame
+            clock.tick(self.max_fps)
+        self.client.join()
         pygame.quit()
 
+    # called on the client's thread, pygame.event.post() may be called from any thread
+    def on_message(self, message):
+        pygame.event.post(pygame.event.Event(SERVER_MESSAGE))
+
 
     def handle_event(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN:
@@ -54,15 +81,17 @@ class Game:
         # we send the nickname to the server, set clients nickname, login=True and reset text to empty string
         if event.key == pygame.K_RETURN:
             if not self.logged_in:
-                self.client.send(Protocols.Request.NICKNAME, self.text)
-                self.client.nickname = self.text
+                # the server asks again for an empty nickname
+                if not self.text.strip():
+                    return
+                self.client.login(self.text)
                 self.logged_in = True
                 self.text = ""
             elif self.client.started:
                 # we verify if input is an integer
                 try:
                     guess = int(self.text)
-                    self.client.send(Protocols.Request.GUESS, guess)
+                    self.client.guess(guess)
                     self.text = ""
                 except ValueError:
                     self.client.add_message("Invalid input,  please enter an integer!")
@@ -71,52 +100,41 @@ class Game:
         # if the client presses backspace or typing characters, we amend text accordingly
         if event.key == pygame.K_BACKSPACE:
             self.text = self.text[:-1]
-        else:
+        elif self.logged_in or len(self.text) < MAX_NAME_LENGTH:
             self.text += event.unicode
 
-    # handle the end of the game by displaying why the game has ended
-    def handle_end(self, screen):
-        run = True
-        while run:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    run = False
-
-            if self.client.winner:
-                text = f"{self.client.winner} has guessed the correct number!"
-            else:
-                text = "The opponent has left the game!"
-
-            # display the text in the middle of the screen
-            text_surface = self.font.render(text, 1, (0, 0, 0))
-            screen.blit(text_surface, (10, 10))
-            middle_x = (screen.get_width() / 2) - (text_surface.get_width() / 2)
-            middle_y = (screen.get_height() / 2) - (text_surface.get_height() / 2)
-            screen.blit(text_surface, (middle_x, middle_y))
-            pygame.display.update()
+    # everything the window shows depends on this, nothing is drawn while it stays the same
+    def view(self):
+        client = self.client
+        return (self.logged_in, self.text, tuple(self.color), client.started, client.winner, client.game_over,
+                client.lower_bound, client.upper_bound, client.opponent_name, tuple(client.messages))
 
-
-    def draw(self, screen):
-        screen.fill((255, 255, 255))
+    # draw the window if anything changed, returns the rectangles that were updated on the screen
+    def draw(self):
+        view = self.view()
+        if view == self.shown_view and self.renderer.shown is not None:
+            return []
+        self.shown_view = view
+        frame = self.renderer.frame()
 
         # Check for game over state FIRST
         if self.client.winner or self.client.game_over:
-            self.draw_game_over(screen)
+            self.draw_game_over(frame)
         # if the client has not started the game and is not logged in
         elif not self.client.started and not self.logged_in:
-            self.draw_login(screen)
+            self.draw_login(frame)
         # if the client is logged in but has not started the game
         elif not self.client.started:
-            self.draw_waiting(screen)
+            self.draw_waiting(frame)
         # the client must be logged in and started the game so we draw the game screen
         else:
-            self.draw_game(screen)
+            self.draw_game(frame)
 
-        # tell pycharm to update the screen we have chosen
-        pygame.display.update()
+        # only the parts of the screen that changed are drawn and updated
+        return self.renderer.show(frame)
 
 
-    def draw_game_over(self, screen):
+    def draw_game_over(self, frame):
         """Draw the game over screen"""
         if self.client.winner:
             text = f"{self.client.winner} has won the game!"
@@ -124,74 +142,65 @@ class Game:
             text = "Your opponent has left the game!"
 
         # Display centered text
-        text_surface = self.font.render(text, 1, (0, 0, 0))
-        middle_x = (screen.get_width() / 2) - (text_surface.get_width() / 2)
-        middle_y = (screen.get_height() / 2) - (text_surface.get_height() / 2)
-        screen.blit(text_surface, (middle_x, middle_y))
+        frame.text(self.font, text, (0, 0, 0), center=frame.rect.center)
 
-    def draw_waiting(self, screen):
-        # draw text letting client know we are waiting for an opponent to join
+    def draw_waiting(self, frame):
+        # draw text letting client know we are waiting for an opponent to join, in the middle of the screen
         text = "Waiting for an opponent"
-        # render our text
-        text_surface = self.font.render(text, 1, (0, 0, 0))
-        # decide where to place the text. (x,y), in this case we will place text in middle of the screen
-        middle_x = (screen.get_width()/2)-(text_surface.get_width()/2)
-        middle_y = (screen.get_height()/2)-(text_surface.get_height()/2)
-        screen.blit(text_surface, (middle_x, middle_y))
+        frame.text(self.font, text, (0, 0, 0), center=frame.rect.center)
 
 
-    def draw_login(self, screen):
+    def draw_login(self, frame):
         prompt =  "Please enter the coolest nickname you can think of"
-        # render our font
-        prompt_surface = self.font.render(prompt, 1, (0, 0, 0))
         # decide where to place the font. (x,y)
-        screen.blit(prompt_surface, (50, 50))
-        self.draw_input(screen)
+        frame.text(self.font, prompt, (0, 0, 0), (50, 50))
+        self.draw_input(frame)
 
     # needed to draw input box for both draw_login and draw_game
-    def draw_input(self, screen):
-        pygame.draw.rect(screen, self.color, self.input_box, 2)
-        txt_surface = self.font.render(self.text, 1, self.color)
-        screen.blit(txt_surface, (self.input_box.x + 5, self.input_box.y + 5))
+    def draw_input(self, frame):
+        text = frame.text(self.font, self.text, self.color, (self.input_box.x + 5, self.input_box.y + 5))
         # set the input box to be a max of 100 or if the size of the text is larger, grow with the text + 10 as a buffer
-        self.input_box.w = max(100, txt_surface.get_width() + 10)
+        self.input_box.w = max(100, text.width + 10)
+        frame.box(self.color, self.input_box, 2)
 
 
-    def draw_game(self, screen):
+    def draw_game(self, frame):
         # bounds for nuumber to be found
         low_bounded = self.client.lower_bound
         high_bounded = self.client.upper_bound
         text = f"Can you guess the number between {low_bounded} and {high_bounded}?"
-        question_surface = self.font.render(text, 1, (0, 0, 0))
-        screen.blit(question_surface, (50, 50))
-        self.draw_input(screen)
+        frame.text(self.font, text, (0, 0, 0), (50, 50))
+
+        # Draw input box
+        self.draw_input(frame)
 
         # Display opponent info
         if self.client.opponent_name:
             opponent_text = f"Opponent: {self.client.opponent_name}"
-            opponent_surface = self.message_font.render(opponent_text, 1, (100, 100, 100))
-            x_pos = screen.get_width() - opponent_surface.get_width() - 20
-            screen.blit(opponent_surface, (50, 150))
-
-        # Draw input box
-        self.draw_input(screen)
+            frame.text(self.message_font, opponent_text, (100, 100, 100), (50, 150))
 
         # Draw message feed
-        self.draw_messages(screen)
+        self.draw_messages(frame)
 
 
-    def draw_messages(self, screen):
+    def draw_messages(self, frame):
         # y-offset to display messages under input_box
         y_offset = 200
-        #opp_name_surface = self.client.opponent_name.render(self.client.opponent.name, 1, (0, 0, 0))
-        #screen.blit(opp_name_surface, (50, 100))
         for i, message in enumerate(self.client.messages):
-            msg_surface = self.message_font.render(message, 1, (50, 50, 50))
-            screen.blit(msg_surface, (50, y_offset + (i * 25)))
+            frame.text(self.message_font, message, (50, 50, 50), (50, y_offset + (i * 25)))
 
 
 if __name__ == "__main__":
-    game = Game(Client())
+    parser = argparse.ArgumentParser(description="Number guessing game client")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=55556)
+    # connect with TLS, trusting the system's certificates or the one given (a self-signed one made by tls.py)
+    parser.add_argument("--tls", action="store_true")
+    parser.add_argument("--tls-ca", default=None, help="certificate to trust, implies --tls")
+    args = parser.parse_args()
+
+    tls = ClientContext(args.tls_ca) if args.tls or args.tls_ca else None
+    game = Game(Client(args.host, args.port, tls=tls))
     game.run()
     pygame.quit()
 
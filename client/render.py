@@ -0,0 +1,109 @@
+import collections
+import pygame
+
+
+# rendered text by (font, text, colour). The window shows the same few lines over and over (the prompt, the bounds,
+# the last messages) and font.render() is most of the cost of drawing them. The least recently used surfaces are
+# dropped once there are more than size
+class TextCache:
+    def __init__(self, size=256):
+        self.size = size
+        self.surfaces = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color):
+        # pygame colours can not be hashed, their tuple can
+        key = (font, text, tuple(color))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, 1, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+
+
+# what one frame shows: every text and box with its place on the screen. Nothing is drawn while the frame is built,
+# the Renderer compares it with the frame on the screen and only draws what changed
+class Frame:
+    def __init__(self, cache, rect):
+        self.cache = cache
+        # the whole screen, to place things relative to it
+        self.rect = rect
+        # (key, rect, surface) in drawing order, surface is None for a box and the key is what makes two items equal
+        self.items = []
+
+    # place text with its top left corner at position, or its centre at center. Returns where it went
+    def text(self, font, text, color, position=None, center=None):
+        surface = self.cache.render(font, text, color)
+        if center is not None:
+            rect = surface.get_rect(center=center)
+        else:
+            rect = surface.get_rect(topleft=position)
+        self.items.append(((font, text, tuple(color), tuple(rect)), rect, surface))
+        return rect
+
+    # the outline of a rectangle, width pixels wide
+    def box(self, color, rect, width):
+        rect = pygame.Rect(rect)
+        self.items.append((("box", tuple(color), tuple(rect), width), rect, None))
+
+
+class Renderer:
+    def __init__(self, screen, background=(255, 255, 255), cache_size=256):
+        self.screen = screen
+        self.background = background
+        self.cache = TextCache(cache_size)
+        # the items of the frame on the screen, None until the first one (or after invalidate())
+        self.shown = None
+
+    def frame(self):
+        return Frame(self.cache, self.screen.get_rect())
+
+    # the next frame is drawn in full, when the window was covered or the screen was drawn on elsewhere
+    def invalidate(self):
+        self.shown = None
+
+    # put a frame on the screen. Only the places where an item appeared or went away are cleared, drawn and sent to
+    # the display. Returns those rectangles, an empty list if the frame is the one on the screen already
+    def show(self, frame):
+        if self.shown is None:
+            self.screen.fill(self.background)
+            for item in frame.items:
+                self.paint(item)
+            pygame.display.update()
+            self.shown = frame.items
+            return [self.screen.get_rect()]
+
+        old = {key for key, _, _ in self.shown}
+        new = {key for key, _, _ in frame.items}
+        dirty = [rect for key, rect, _ in self.shown if key not in new]
+        dirty += [rect for key, rect, _ in frame.items if key not in old]
+        self.shown = frame.items
+        if not dirty:
+            return dirty
+
+        for rect in dirty:
+            self.screen.fill(self.background, rect)
+        # an item that did not change but overlaps a cleared place is drawn again too
+        for item in frame.items:
+            if item[1].collidelist(dirty) != -1:
+                self.paint(item)
+        pygame.display.update(dirty)
+        return dirty
+
+    def paint(self, item):
+        key, rect, surface = item
+        if surface is None:
+            pygame.draw.rect(self.screen, key[1], rect, key[3])
+        else:
+            self.screen.blit(surface, rect)
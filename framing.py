@@ -0,0 +1,80 @@
+# receive buffer shared by the server and the client. TCP does not hold message boundaries, so the bytes we receive
+# are kept until a whole message has arrived. Instead of concatenating strings (which copies the whole buffer on
+# every read and every message) we receive straight into a preallocated bytearray with recv_into() and move a read
+# offset forward as messages are taken out. Only complete frames are ever decoded, so a multibyte UTF-8 character
+# split across two reads is no longer a problem.
+class FrameReader:
+    def __init__(self, recv_size=4096):
+        # how many bytes we ask the socket for on each read
+        self.recv_size = recv_size
+        self.buffer = bytearray(recv_size * 2)
+        # buffer[start:end] holds the bytes received but not taken out as a frame yet
+        self.start = 0
+        self.end = 0
+        # buffer[start:scanned] has already been searched for the end of a message without finding it
+        self.scanned = 0
+        # frames split ahead by the codec but not taken out yet, last one first. They all end before start
+        self.frames = []
+        # the codec that split them
+        self.codec = None
+
+    # make sure there is room for at least size more bytes after end
+    def reserve(self, size):
+        if len(self.buffer) - self.end >= size:
+            return
+
+        # first move the unread bytes back to the front, this is the only copy and it only holds a partial message
+        pending = self.end - self.start
+        if self.start:
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.scanned -= self.start
+            self.start = 0
+            self.end = pending
+
+        # a message bigger than the buffer, grow it
+        if len(self.buffer) - self.end < size:
+            self.buffer.extend(bytes(max(size, len(self.buffer))))
+
+    # receive from the socket into the free part of the buffer, returns the number of bytes read (0 = closed)
+    def recv_into(self, sock):
+        self.reserve(self.recv_size)
+        # the views have to be released before the buffer can be resized again
+        with memoryview(self.buffer) as view, view[self.end:self.end + self.recv_size] as window:
+            count = sock.recv_into(window)
+        self.end += count
+        return count
+
+    # add bytes that were read some other way, e.g. from an asyncio StreamReader
+    def feed(self, data):
+        self.reserve(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    # take the next complete frame out of the buffer with the given codec, None if it has not fully arrived yet.
+    # Every complete frame received is split off in one go, the following calls just hand them out
+    def next_frame(self, codec):
+        if self.frames:
+            if codec is self.codec:
+                return self.frames.pop()
+            # the wire format changed after the last frame handed out, what the old codec split ahead is read again
+            self.start -= sum(len(self.codec.wire(frame)) for frame in self.frames)
+            self.scanned = self.start
+            self.frames = []
+
+        frames, self.start = codec.next_frames(self.buffer, self.start, self.end, self.scanned)
+        if not frames:
+            # without a complete message everything received so far has been searched, the next read only adds to it
+            self.scanned = self.end
+            # everything was read, start again from the front so the buffer never has to be compacted
+            if self.start == self.end:
+                self.start = self.end = self.scanned = 0
+            return None
+        self.scanned = self.start
+        self.codec = codec
+        frames.reverse()
+        frame = frames.pop()
+        self.frames = frames
+        return frame
+
+    def __len__(self):
+        return self.end - self.start
@@ -0,0 +1,47 @@
+# what the tools that drive a real server share (tests/test_compat.py, server/replay.py and the benchmarks): starting
+# server/main.py on a free port, and the numbers they report about it
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+MAIN = str(ROOT / "server" / "main.py")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# starts the server on port with the given command line flags, returns the process once it accepts connections
+def start_server(port, flags=(), timeout=10):
+    server = subprocess.Popen([sys.executable, MAIN, "--port", str(port)] + list(flags))
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.01)
+    server.kill()
+    server.wait()
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+# user + system CPU seconds of a process (Linux only)
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+# the value below which fraction of the values fall, 0 without values
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
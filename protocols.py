@@ -1,6 +1,17 @@
+import json
+import struct
+import zlib
+
+# the protocol spoken by this version of the client and the server. Version 1 only negotiates the wire format (the
+# "format" key of the NICKNAME or RESUME request, acknowledged with WIRE_FORMAT). Version 2 adds the HELLO answer
+# with the compression and the guess batching both sides agreed on. Version 3 adds heartbeats: the server sends a
+# PING to a quiet client, which answers with a PONG
+PROTOCOL_VERSION = 3
+
+
 class Protocols:
-    # this file will serve as the protocol messages sent between our clients and server
-    # these messages will serve as command signals that help coordinate the logic of both sides
+    # this file will serve as the protocol messages sent between our clients and server, for both of them. These
+    # messages will serve as command signals that help coordinate the logic of both sides
 
     # the Response class provides messages, server --> client
     class Response:
@@ -14,9 +25,399 @@ class Protocols:
         WINNER = "protocol.winner"
         CORRECT_NUMBER = "protocol.correct_number"
         GAME_BOUNDS = "protocol.bounds"
+        # acknowledges the wire format the client asked for in its NICKNAME request, every message after this one is
+        # encoded with that format, in both directions
+        WIRE_FORMAT = "protocol.wire_format"
+        # results of a GUESS_BATCH, one GuessResult value per guess that was verified
+        GUESS_BATCH_RESULT = "protocol.guess_batch_result"
+        # the token a client sends in a RESUME request if its connection drops during the game
+        SESSION_TOKEN = "protocol.session_token"
+        # answers to RESUME, the client is back in its room or has to log in again
+        RESUMED = "protocol.resumed"
+        RESUME_REJECTED = "protocol.resume_rejected"
+        # answers the capabilities a client of version 2 or later sent with its NICKNAME or RESUME request, see
+        # agree(). Like WIRE_FORMAT it is sent in JSON and every message after it uses what was agreed
+        HELLO = "protocol.hello"
+        # sent to a client that has been quiet for the heartbeat interval agreed in the HELLO, it answers with a PONG
+        PING = "protocol.ping"
+        # answers SPECTATE with the room being watched: {"players", "lower", "upper"}. From then on the spectator
+        # gets a ROOM_GUESSES for every guess made in the room, and the WINNER and CORRECT_NUMBER messages at the end
+        SPECTATING = "protocol.spectating"
+        # there is no game to watch, the client is asked for its nickname again
+        SPECTATE_REJECTED = "protocol.spectate_rejected"
+        # {"player", "guesses", "results"}, the guesses a player made in one message and their GuessResult values
+        ROOM_GUESSES = "protocol.room_guesses"
 
     # the Request class provides messages, client --> server
     class Request:
         NICKNAME = "protocol.send_nickName"
         GUESS = "protocol.answer"
         LEAVE_SERVER = "protocol.leave_server"
+        # a list of guesses verified in order, the server stops at the first correct one
+        GUESS_BATCH = "protocol.answer_batch"
+        # sent instead of the nickname after reconnecting, carries the SESSION_TOKEN and the wire format like NICKNAME
+        RESUME = "protocol.resume"
+        # the answer to a PING, any message shows the client is still there but this one has nothing else to say
+        PONG = "protocol.pong"
+        # sent instead of the nickname to watch a game, with the wire format like NICKNAME. The data is the nickname
+        # of a player in the room to watch, an empty string for the game that started last
+        SPECTATE = "protocol.spectate"
+
+
+# errors raised when a message received from the network cannot be decoded
+class ProtocolError(ValueError):
+    pass
+
+
+# the stream cannot be split into messages anymore, the connection has to be closed
+class FrameError(ProtocolError):
+    pass
+
+
+# every message is a JSON object with a "type" and a "data", anything else (a list, a number) is not a message
+def as_message(message):
+    if not isinstance(message, dict):
+        raise ProtocolError(f"message is a {type(message).__name__}, not an object")
+    return message
+
+
+JSON_DECODER = json.JSONDecoder()
+
+
+# the original wire format: one JSON object per message, TCP does not hold message boundaries so every message ends
+# with a newline
+class JsonCodec:
+    name = "json"
+    compression = None
+
+    # a message still without its newline after this many bytes is never going to end (or someone is trying to make
+    # us buffer forever), same limit as the binary format
+    max_frame_size = 64 * 1024
+
+    def encode(self, r_type, data):
+        return json.dumps({"type": r_type, "data": data}).encode("UTF-8") + b"\n"
+
+    # find the next complete message in buffer[start:stop], returns (frame, end) or (None, start) if the message
+    # has not fully arrived yet. buffer[start:scanned] is known to hold no newline, so a message arriving in many
+    # reads is only searched once
+    def next_frame(self, buffer, start=0, stop=None, scanned=0):
+        if stop is None:
+            stop = len(buffer)
+        newline = buffer.find(b"\n", max(start, scanned), stop)
+        if newline < 0:
+            if stop - start > self.max_frame_size:
+                raise FrameError(f"no end of message in {stop - start} bytes, the limit is {self.max_frame_size}")
+            return None, start
+        if newline - start > self.max_frame_size:
+            raise FrameError(f"frame of {newline - start} bytes is larger than {self.max_frame_size}")
+        return buffer[start:newline], newline + 1
+
+    # every complete message in buffer[start:stop] at once, returns (frames, end). One split() copies them all
+    # instead of a slice per message
+    def next_frames(self, buffer, start=0, stop=None, scanned=0):
+        if stop is None:
+            stop = len(buffer)
+        last = buffer.rfind(b"\n", max(start, scanned), stop)
+        # a stretch longer than a frame may hide one over the limit, those are checked one at a time
+        if last < 0 or last - start > self.max_frame_size:
+            frame, end = self.next_frame(buffer, start, stop, scanned)
+            return ([frame] if frame is not None else []), end
+        return buffer[start:last].split(b"\n"), last + 1
+
+    # the frame as it was sent, with the newline next_frame() left out
+    def wire(self, frame):
+        return bytes(frame) + b"\n"
+
+    def parse(self, frame):
+        try:
+            text = frame.decode("UTF-8")
+        except UnicodeDecodeError as e:
+            raise ProtocolError(f"message is not valid UTF-8: {e}")
+        # raw_decode() skips the whitespace checks json.loads() makes with regular expressions around every message,
+        # anything it does not take as a whole (whitespace around the object, garbage) goes through json.loads()
+        try:
+            message, end = JSON_DECODER.raw_decode(text)
+        except json.JSONDecodeError:
+            end = -1
+        if end != len(text):
+            message = json.loads(text)
+        return as_message(message)
+
+
+# compact format: 1 byte opcode, varint payload length, payload. The payload layout depends on the message type so
+# most messages are only a few bytes and do not need any JSON parsing. With compression the payload of a large
+# message (a long batch of guesses, the names of a big room) is deflated and the high bit of the opcode is set
+class BinaryCodec:
+    name = "binary"
+
+    # how the data of each message type is packed
+    NONE = 0  # no data
+    INT = 1  # signed 64 bit integer
+    TEXT = 2  # UTF-8 string
+    BOUNDS = 3  # {"lower", "upper"} as two signed 64 bit integers
+    JSON = 4  # anything else, JSON encoded
+    INT_LIST = 5  # list of signed 64 bit integers
+    BYTE_LIST = 6  # list of integers between 0 and 255
+
+    # opcode 0 carries a whole JSON message, used for any type missing from the table below
+    GENERIC = 0
+    # (opcode, type, payload layout), opcodes must never be reused for another type
+    MESSAGES = [
+        (1, Protocols.Response.NICKNAME, NONE),
+        (2, Protocols.Response.GUESS_VALID, NONE),
+        (3, Protocols.Response.GUESS_TOO_LOW, NONE),
+        (4, Protocols.Response.GUESS_TOO_HIGH, NONE),
+        (5, Protocols.Response.OPPONENT, TEXT),
+        (6, Protocols.Response.OPPONENT_EXITED, NONE),
+        (7, Protocols.Response.START, NONE),
+        (8, Protocols.Response.WINNER, TEXT),
+        (9, Protocols.Response.CORRECT_NUMBER, INT),
+        (10, Protocols.Response.GAME_BOUNDS, BOUNDS),
+        (11, Protocols.Response.WIRE_FORMAT, TEXT),
+        (12, Protocols.Response.GUESS_BATCH_RESULT, BYTE_LIST),
+        (13, Protocols.Response.SESSION_TOKEN, TEXT),
+        (14, Protocols.Response.RESUMED, NONE),
+        (15, Protocols.Response.RESUME_REJECTED, NONE),
+        (16, Protocols.Response.HELLO, JSON),
+        (17, Protocols.Response.PING, NONE),
+        (18, Protocols.Response.SPECTATING, JSON),
+        (19, Protocols.Response.SPECTATE_REJECTED, NONE),
+        (20, Protocols.Response.ROOM_GUESSES, JSON),
+        (64, Protocols.Request.NICKNAME, TEXT),
+        (65, Protocols.Request.GUESS, INT),
+        (66, Protocols.Request.LEAVE_SERVER, NONE),
+        (67, Protocols.Request.GUESS_BATCH, INT_LIST),
+        (68, Protocols.Request.RESUME, TEXT),
+        (69, Protocols.Request.PONG, NONE),
+        (70, Protocols.Request.SPECTATE, TEXT),
+    ]
+
+    INT_STRUCT = struct.Struct(">q")
+    BOUNDS_STRUCT = struct.Struct(">qq")
+
+    # a length above this means the stream is corrupted (or someone is trying to make us buffer forever)
+    max_frame_size = 64 * 1024
+    # set on the opcode of a compressed message
+    COMPRESSED = 0x80
+    # smaller payloads are never worth compressing
+    compress_threshold = 256
+
+    def __init__(self, compression=None):
+        # None or "zlib"
+        self.compression = compression
+        self.opcodes = {r_type: (opcode, layout) for opcode, r_type, layout in self.MESSAGES}
+        self.types = {opcode: (r_type, layout) for opcode, r_type, layout in self.MESSAGES}
+
+    def encode(self, r_type, data):
+        opcode, layout = self.opcodes.get(r_type, (self.GENERIC, self.JSON))
+
+        if opcode == self.GENERIC:
+            payload = json.dumps({"type": r_type, "data": data}).encode("UTF-8")
+        elif layout == self.NONE:
+            payload = b""
+        elif layout == self.INT:
+            payload = self.INT_STRUCT.pack(data)
+        elif layout == self.TEXT:
+            payload = data.encode("UTF-8")
+        elif layout == self.BOUNDS:
+            payload = self.BOUNDS_STRUCT.pack(data["lower"], data["upper"])
+        elif layout == self.INT_LIST:
+            payload = struct.pack(f">{len(data)}q", *data)
+        elif layout == self.BYTE_LIST:
+            payload = bytes(data)
+        else:
+            payload = json.dumps(data).encode("UTF-8")
+
+        if self.compression and len(payload) >= self.compress_threshold:
+            compressed = zlib.compress(payload, 1)
+            if len(compressed) < len(payload):
+                opcode |= self.COMPRESSED
+                payload = compressed
+
+        return bytes((opcode,)) + encode_varint(len(payload)) + payload
+
+    # the length comes first, scanned is only needed by JsonCodec
+    def next_frame(self, buffer, start=0, stop=None, scanned=0):
+        if stop is None:
+            stop = len(buffer)
+        length, payload_start = decode_varint(buffer, start + 1, stop)
+        if length is None:
+            return None, start
+        if length > self.max_frame_size:
+            raise FrameError(f"frame of {length} bytes is larger than {self.max_frame_size}")
+
+        end = payload_start + length
+        if end > stop:
+            return None, start
+        return buffer[start:end], end
+
+    # every complete message in buffer[start:stop], returns (frames, end). A frame that cannot be read is only
+    # reported once the ones before it have been taken
+    def next_frames(self, buffer, start=0, stop=None, scanned=0):
+        frames = []
+        while True:
+            try:
+                frame, end = self.next_frame(buffer, start, stop)
+            except FrameError:
+                if frames:
+                    return frames, start
+                raise
+            if frame is None:
+                return frames, start
+            frames.append(frame)
+            start = end
+
+    def wire(self, frame):
+        return bytes(frame)
+
+    def parse(self, frame):
+        opcode = frame[0]
+        _, payload_start = decode_varint(frame, 1, len(frame))
+        payload = frame[payload_start:]
+
+        if opcode & self.COMPRESSED:
+            if not self.compression:
+                raise ProtocolError("compressed message without compression")
+            opcode &= ~self.COMPRESSED
+            payload = self.decompress(payload)
+
+        if opcode == self.GENERIC:
+            return as_message(self.parse_json(payload, "message"))
+        if opcode not in self.types:
+            raise ProtocolError(f"unknown opcode {opcode}")
+
+        r_type, layout = self.types[opcode]
+        try:
+            if layout == self.NONE:
+                data = None
+            elif layout == self.INT:
+                data = self.INT_STRUCT.unpack(payload)[0]
+            elif layout == self.TEXT:
+                data = payload.decode("UTF-8")
+            elif layout == self.BOUNDS:
+                lower, upper = self.BOUNDS_STRUCT.unpack(payload)
+                data = {"lower": lower, "upper": upper}
+            elif layout == self.INT_LIST:
+                data = list(struct.unpack(f">{len(payload) // 8}q", payload))
+            elif layout == self.BYTE_LIST:
+                data = list(payload)
+            else:
+                data = self.parse_json(payload, r_type)
+        except (struct.error, UnicodeDecodeError) as e:
+            raise ProtocolError(f"bad payload for {r_type}: {e}")
+
+        return {"type": r_type, "data": data}
+
+    # json.loads() of bytes raises UnicodeDecodeError or JSONDecodeError, the caller only expects a ProtocolError
+    def parse_json(self, payload, what):
+        try:
+            return json.loads(payload)
+        except ValueError as e:
+            raise ProtocolError(f"bad JSON payload for {what}: {e}")
+
+    # inflate a payload, it may not grow beyond the size of a frame
+    def decompress(self, payload):
+        inflater = zlib.decompressobj()
+        try:
+            data = inflater.decompress(payload, self.max_frame_size)
+        except zlib.error as e:
+            raise ProtocolError(f"bad compressed payload: {e}")
+        if inflater.unconsumed_tail or not inflater.eof:
+            raise ProtocolError(f"compressed payload is larger than {self.max_frame_size} bytes or truncated")
+        return data
+
+
+# unsigned LEB128, 7 bits per byte with the high bit set on every byte except the last
+def encode_varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+# returns (value, position after the varint) or (None, start) if the varint has not fully arrived before stop
+def decode_varint(buffer, start, stop):
+    value = 0
+    shift = 0
+    position = start
+    while position < stop:
+        byte = buffer[position]
+        value |= (byte & 0x7F) << shift
+        position += 1
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+        # no frame length needs more than 5 bytes, anything longer is garbage
+        if shift > 28:
+            raise FrameError("varint frame length is too long")
+    return None, start
+
+
+# every wire format we can speak, by the name used in the negotiation
+CODECS = {codec.name: codec for codec in (JsonCodec(), BinaryCodec())}
+# every connection starts with JSON until both sides agree on something else
+DEFAULT_CODEC = CODECS["json"]
+# the compressions we understand, by preference. Only the binary format can be compressed
+COMPRESSIONS = ("zlib",)
+COMPRESSED_CODECS = {("binary", "zlib"): BinaryCodec("zlib")}
+# the most guesses the server verifies from one GUESS_BATCH
+MAX_GUESS_BATCH = 1024
+# seconds a client may be quiet before the server sends it a PING
+HEARTBEAT_INTERVAL = 15
+# the longest nickname the server takes, in characters
+MAX_NAME_LENGTH = 32
+
+
+# a nickname the server takes: a string of 1 to MAX_NAME_LENGTH printable characters
+def valid_name(name):
+    return isinstance(name, str) and 0 < len(name) <= MAX_NAME_LENGTH and name.isprintable()
+
+
+# a guess is an integer, True and False are not guesses even though Python counts them as integers
+def valid_guess(guess):
+    return isinstance(guess, int) and not isinstance(guess, bool)
+
+
+# the codec for a wire format and compression agreed in the handshake, None if we do not know it
+def find_codec(wire_format, compression=None):
+    if compression:
+        return COMPRESSED_CODECS.get((wire_format, compression))
+    return CODECS.get(wire_format)
+
+
+# the keys a client adds to its NICKNAME or RESUME request to say what it can do. Older servers only read "format"
+def offer(wire_format, version=PROTOCOL_VERSION, compressions=COMPRESSIONS, batching=True):
+    hello = {"format": wire_format}
+    if version >= 2:
+        hello.update({"version": version, "compression": list(compressions), "batching": batching})
+    return hello
+
+
+# what the server agrees to for a NICKNAME or RESUME request, None for a client of version 1 (or a server pinned to
+# version 1), which only gets its wire format acknowledged. batching is the most guesses a GUESS_BATCH may hold, 0
+# if the client has to send them one by one. From version 3 on, heartbeat is the seconds of quiet after which the
+# server sends a PING (0 for never)
+def agree(request, version=PROTOCOL_VERSION, max_batch=MAX_GUESS_BATCH, heartbeat=HEARTBEAT_INTERVAL):
+    client_version = request.get("version")
+    if not isinstance(client_version, int) or client_version < 2 or version < 2:
+        return None
+
+    wire_format = request.get("format")
+    if not isinstance(wire_format, str) or wire_format not in CODECS:
+        wire_format = DEFAULT_CODEC.name
+    offered = request.get("compression")
+    compression = None
+    if isinstance(offered, list):
+        compression = next((name for name in COMPRESSIONS
+                            if name in offered and (wire_format, name) in COMPRESSED_CODECS), None)
+    hello = {
+        "version": min(client_version, version),
+        "format": wire_format,
+        "compression": compression,
+        "batching": max_batch if request.get("batching") else 0,
+    }
+    if hello["version"] >= 3:
+        hello["heartbeat"] = heartbeat
+    return hello
@@ -1,4 +1,4 @@
-from main import Server
+from server.main import Server
 
 if __name__ == "__main__":
     server = Server()
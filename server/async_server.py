@@ -0,0 +1,468 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+import asyncio  # one event loop serves every client instead of one thread per client
+import json
+import logging
+import time
+import resource  # to raise the open file limit, each connected player holds one file descriptor
+import signal
+import threading
+from server.main import Server, log
+from server.outbound import AsyncOutbox
+from server.restart import announce_ready, receive_player
+from protocols import Protocols, ProtocolError
+from tls import HANDSHAKE_TIMEOUT
+from framing import FrameReader
+
+
+# the frames of a player who was paired while a frame was being read, that frame first
+async def finish_reading(reading, frames):
+    frame = await reading
+    if frame is None:
+        return
+    yield frame
+    async for frame in frames:
+        yield frame
+
+
+class AsyncServer(Server):
+    # the game logic (create_room, handle_received_msg, broadcast) is shared with the threaded Server, only
+    # the socket I/O is replaced by asyncio streams. The client of each session is the StreamWriter of its connection.
+    # The settings are the ones of Server.__init__, passed on as they were given, only backlog is our own
+    def __init__(self, *args, backlog=4096, **kwargs):
+        super().__init__(*args, **kwargs)
+        # how many connections the OS may queue before we accept() them, large bursts of players need a deep queue
+        self.backlog = backlog
+        # set to end serve(), draining first if self.draining
+        self.stopping = None
+        # players being handed to the server taking over
+        self.handing_off = set()
+        # the readers of the TLS connections whose handshake has not reached handle() yet (see accept_tls())
+        self.handshaking = set()
+
+    async def handle_connection(self, session, frames):
+        while True:
+            # same handshake as the threaded server, ask for the nickname until we get one
+            self.send(Protocols.Response.NICKNAME, None, session)
+            frame = await anext(frames, None)
+
+            # the client left before sending a nickname
+            if frame is None:
+                return False
+
+            codec, frame = frame
+            message = codec.parse(frame)
+
+            # a client that lost its connection during a game comes back with the token of its session
+            if message.get("type") == Protocols.Request.RESUME:
+                old = self.find_resumable(session, message)
+                if old:
+                    await self.wait_detached(old)
+                if self.resume(session, old):
+                    return True
+                continue
+
+            if message.get("type") == Protocols.Request.SPECTATE:
+                if self.spectate(session, message):
+                    return True
+                continue
+
+            if not self.login(session, message):
+                continue
+
+            self.join_lobby(session)
+            return True
+
+    def new_event(self):
+        return asyncio.Event()
+
+    def call_later(self, delay, function, *args):
+        return asyncio.get_running_loop().call_later(delay, function, *args)
+
+    # the handler of the old connection runs on this loop too, it needs the loop to notice the connection closing
+    async def wait_detached(self, session, timeout=5):
+        event = session.released = self.new_event()
+        if session.expiry is None and session.room:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        session.released = None
+
+    # the event costs nothing while we wait, the loop keeps serving everybody else. What the client sends in the
+    # meantime is read like on the threaded engine (see Server.wait_for_room), a read that is under way when the
+    # player is paired is finished by play()
+    async def wait_for_room(self, session, frames):
+        event = session.ready
+        if event:
+            started = time.perf_counter()
+            paired = asyncio.ensure_future(event.wait())
+            reading = None
+            while True:
+                reading = reading or asyncio.ensure_future(anext(frames, None))
+                await asyncio.wait((paired, reading), return_when=asyncio.FIRST_COMPLETED)
+                if paired.done():
+                    break
+                read, reading = reading.result, None
+                if not self.read_waiting(session, read):
+                    break
+            paired.cancel()
+            self.metrics.wait_for_room_seconds.observe(time.perf_counter() - started)
+            if reading is not None:
+                if session.room is not None:
+                    frames = finish_reading(reading, frames)
+                # the connection was handed over or closed, what was read from it does not matter anymore
+                elif not reading.cancel():
+                    reading.exception()
+        session.ready = None
+        if session.room is None and (event or self.draining):
+            return None
+        self.start_game(session)
+        return frames
+
+    async def handle(self, reader, client):
+        log.info(f"Connected with {client.get_extra_info('peername')}")
+        self.metrics.connections_total.inc()
+        tls = client.get_extra_info("ssl_object")
+        if tls is not None:
+            self.handshaking.discard(reader)
+            self.metrics.tls_handshakes.labels("resumed" if tls.session_reused else "full").inc()
+        # asyncio accepts the connections for us, over the accept rate the handshake waits instead
+        await self.wait_accept()
+        session = self.add_connection(client)
+        try:
+            frames = self.read_frames(reader, session)
+            if await self.handshake(session, frames):
+                await self.play(session, frames)
+        finally:
+            self.remove_connection(session)
+
+    # the protocol of a new TLS connection, the same as asyncio.start_server() makes. asyncio says nothing when a
+    # handshake fails or takes too long, the connection is just closed without handle() being called. So the reader
+    # waits in handshaking until handle() takes it, one still there once the handshake's deadline has passed failed
+    def accept_tls(self):
+        reader = asyncio.StreamReader()
+        self.handshaking.add(reader)
+        asyncio.get_running_loop().call_later(HANDSHAKE_TIMEOUT + 1, self.check_handshake, reader)
+        return asyncio.StreamReaderProtocol(reader, self.handle)
+
+    def check_handshake(self, reader):
+        if reader in self.handshaking:
+            self.handshaking.discard(reader)
+            log.info("TLS handshake failed or timed out")
+            self.metrics.tls_handshakes.labels("failed").inc()
+
+    async def handshake(self, session, frames):
+        started = time.perf_counter()
+        try:
+            if not await self.handle_connection(session, frames):
+                self.disconnect_client(session)
+                return False
+        except (ConnectionError, json.JSONDecodeError, ProtocolError) as e:
+            log.warning(f"Client {session.name} failed the handshake: {e}")
+            self.disconnect_client(session)
+            return False
+        except Exception as e:
+            # the connection is closed whatever went wrong, the client is not left waiting for an answer
+            log.exception(f"Unexpected error in the handshake of session {session.id}: {e}")
+            self.disconnect_client(session)
+            return False
+        finally:
+            self.metrics.handshake_seconds.observe(time.perf_counter() - started)
+        return True
+
+    async def play(self, session, frames):
+        # only a client heard from since it was paired is waited for, see Server.play
+        heard = session.ready is None
+        frames = await self.wait_for_room(session, frames)
+        if frames is None:
+            return
+
+        # track json error msg attempts to decide continue/break for connection
+        consecutive_json_errors = 0
+        max_json_errors = 5
+        # the connection dropped without the player leaving, they may come back
+        lost = False
+
+        # main game loop
+        while True:
+            try:
+                frame = await anext(frames, None)
+
+                # if the client disconnected or an error has occurred, break loop
+                if frame is None:
+                    lost = True
+                    break
+                heard = True
+
+                codec, frame = frame
+                message = codec.parse(frame)
+                # the player quits, there is nothing to keep for them
+                if message.get("type") == Protocols.Request.LEAVE_SERVER:
+                    self.count_received(message)
+                    break
+                self.handle_received_msg(message, session)
+
+                # reset json errors if we receive valid data
+                consecutive_json_errors = 0
+            except (ConnectionError, ConnectionResetError, BrokenPipeError) as e:
+                log.info(f"Client {session.name} disconnected: {e}")
+                lost = True
+                break
+            except (json.JSONDecodeError, ProtocolError) as e:
+                consecutive_json_errors += 1
+                log.warning(f"Invalid message from client ({consecutive_json_errors}/{max_json_errors}): {e}")
+
+                if consecutive_json_errors >= max_json_errors:
+                    log.warning(f"Client {session.name} sending too many bad messages, disconnecting")
+                    break
+                continue
+            except Exception as e:
+                log.exception(f"Unexpected error handling client: {e}")
+                break
+
+        if lost and heard:
+            self.drop(session)
+        else:
+            self.disconnect_client(session)
+
+    async def wait_accept(self):
+        delay = self.throttle(self.accept_limit, "connections")
+        if delay:
+            await asyncio.sleep(delay)
+
+    # same as Server.read_frames, reading from the StreamReader instead of the socket
+    async def read_frames(self, reader, session):
+        frames = FrameReader(self.recv_size)
+        while True:
+            codec = session.codec
+            frame = frames.next_frame(codec)
+            if frame is not None:
+                delay = self.throttle(self.message_limit_of(session), "messages")
+                if delay:
+                    await asyncio.sleep(delay)
+                if self.capture:
+                    self.capture.received(session, codec.wire(frame))
+                yield codec, frame
+                continue
+
+            # the replies go out now, and we wait for the client to read them if too many are buffered
+            outbox = session.outbox
+            if outbox:
+                await outbox.wait_writable()
+
+            data = await reader.read(self.recv_size)
+            if not data:
+                if self.capture:
+                    self.capture.ended(session)
+                return
+            if self.reaper is not None:
+                session.seen = time.monotonic()
+            self.metrics.bytes_received.inc(len(data))
+            frames.feed(data)
+            delay = self.throttle(self.byte_limit_of(session), "bytes", len(data))
+            if delay:
+                await asyncio.sleep(delay)
+
+    def new_outbox(self, session):
+        return AsyncOutbox(session, self.transmit, self.evict_client, self.high_water, self.low_water,
+                           self.max_backlog)
+
+    # drop what is buffered, the handler sees the connection closing and cleans up
+    def abort_client(self, client):
+        client.transport.abort()
+
+    def close_client(self, client):
+        # close() flushes whatever is still buffered before closing the transport
+        client.close()
+
+    def transmit(self, session, message):
+        # write() only buffers the data, the event loop sends it once the socket is writable
+        started = time.perf_counter()
+        session.client.write(message)
+        self.metrics.send_seconds.observe(time.perf_counter() - started)
+        self.metrics.bytes_sent.inc(len(message))
+
+    # the handoff waits for the transport to send what is queued, the player's handler is woken up once it is done
+    def release(self, session):
+        task = asyncio.get_running_loop().create_task(self.release_later(session, session.ready))
+        self.handing_off.add(task)
+        task.add_done_callback(self.handing_off.discard)
+
+    async def release_later(self, session, event):
+        if not await self.pass_on(session):
+            self.disconnect_client(session)
+        if event:
+            event.set()
+
+    # same as Server.pass_on, the socket changes hands once the transport has written everything
+    async def pass_on(self, session):
+        if self.successor is None or self.tls:
+            return False
+        outbox, session.outbox = session.outbox, None
+        if outbox:
+            outbox.close()
+        client = session.client
+        await self.wait_sent(client)
+        try:
+            self.successor.send_player(self.player_info(session), client.get_extra_info("socket"))
+        except OSError as e:
+            log.warning(f"Could not hand {session.name} to the new server: {e}")
+            return False
+        self.sessions.remove(session)
+        # only our copy of the socket is closed
+        client.transport.abort()
+        log.info(f"Handed {session.name} to the new server")
+        return True
+
+    # the transport has sent everything it buffered. With a low water mark of 0, drain() only returns once the buffer
+    # is empty, or raises once the connection is gone
+    async def wait_sent(self, client):
+        client.transport.set_write_buffer_limits(0)
+        try:
+            await client.drain()
+        except OSError:
+            pass
+
+    def stop_accepting(self):
+        self.draining = True
+        if self.stopping:
+            self.stopping.set()
+
+    async def restart(self):
+        if self.draining or self.successor:
+            return
+        log.info("Starting a new server to take over")
+        successor = await asyncio.get_running_loop().run_in_executor(None, self.start_successor)
+        if successor is None:
+            return
+        self.successor = successor
+        self.stop_accepting()
+
+    async def drain(self):
+        self.stop_metrics()
+        log.info(f"Draining, {len(self.open_rooms())} rooms left" + (", the new server takes the new players"
+                                                              if self.successor else ""))
+        deadline = time.monotonic() + self.drain_timeout
+        while True:
+            for session in self.matchmaker.take_all():
+                self.release(session)
+            if not self.live_rooms() or time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(0.1)
+        if self.live_rooms():
+            log.warning(f"Closing {self.live_rooms()} rooms that did not end within {self.drain_timeout}s")
+        if self.handing_off:
+            await asyncio.wait(self.handing_off)
+        if self.successor:
+            self.successor.close()
+
+    # players handed over by the server we replace
+    def on_predecessor_readable(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                player = receive_player(self.predecessor)
+            except BlockingIOError:
+                return
+            except ValueError as e:
+                log.warning(f"Dropped a player the old server handed over: {e}")
+                continue
+            except OSError as e:
+                log.warning(f"Could not receive players from the old server: {e}")
+                player = None
+            if player is None:
+                loop.remove_reader(self.predecessor.fileno())
+                self.predecessor.close()
+                return
+            loop.create_task(self.handle_adopted(*player))
+
+    async def handle_adopted(self, sock, info):
+        reader, client = await asyncio.open_connection(sock=sock)
+        session = self.adopt_player(client, info)
+        try:
+            self.join_lobby(session)
+            await self.play(session, self.read_frames(reader, session))
+        finally:
+            self.remove_connection(session)
+
+    # the reaper runs on the loop like everything else, a pass over the due sessions never waits
+    async def run_reaper(self):
+        while True:
+            await asyncio.sleep(self.reaper.wait(time.monotonic()))
+            self.reap(time.monotonic())
+
+    async def run_lobby(self, interval=0.25):
+        while True:
+            await asyncio.sleep(interval)
+            for group in self.matchmaker.match():
+                self.create_room(group)
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        reaper = loop.create_task(self.run_reaper()) if self.reaper is not None else None
+        lobby = loop.create_task(self.run_lobby()) if self.matchmaking == "rating" else None
+        # the profiler samples the loop's thread from its own, stopping it writes a file so it is not done on the loop
+        if self.profile:
+            self.profiler.start()
+        loop.add_signal_handler(signal.SIGUSR1, lambda: threading.Thread(target=self.profiler.toggle,
+                                                                         daemon=True).start())
+        if self.predecessor is not None:
+            self.predecessor.setblocking(False)
+            loop.add_reader(self.predecessor.fileno(), self.on_predecessor_readable)
+        # the TLS handshake is done by asyncio before handle() is called, with the context every connection shares
+        if self.tls:
+            server = await loop.create_server(self.accept_tls, sock=self.server, backlog=self.backlog, ssl=self.tls,
+                                              ssl_handshake_timeout=HANDSHAKE_TIMEOUT)
+        else:
+            server = await asyncio.start_server(self.handle, sock=self.server, backlog=self.backlog)
+        announce_ready()
+        # Ctrl+C or SIGTERM (the cluster supervisor stopping its workers) end serve() instead of interrupting
+        # whatever the loop is running. On its own the server drains on SIGTERM and restarts on SIGUSR2
+        self.stopping = asyncio.Event()
+        loop.add_signal_handler(signal.SIGINT, self.stopping.set)
+        if self.graceful_signals:
+            loop.add_signal_handler(signal.SIGTERM, self.stop_accepting)
+            loop.add_signal_handler(signal.SIGUSR2, lambda: loop.create_task(self.restart()))
+        else:
+            loop.add_signal_handler(signal.SIGTERM, self.stopping.set)
+        await self.stopping.wait()
+        # closes the listening socket, only our copy of it during a restart
+        server.close()
+        if self.draining:
+            await self.drain()
+        if reaper:
+            reaper.cancel()
+        if lobby:
+            lobby.cancel()
+
+        # end every connection, so the handlers finish by themselves instead of being cancelled by asyncio.run().
+        # Players waiting for a room are woken up to find their connection closed
+        for session in list(self.sessions.sessions.values()):
+            self.abort_client(session.client)
+            if session.ready:
+                session.ready.set()
+        handlers = asyncio.all_tasks() - {asyncio.current_task()}
+        if handlers:
+            await asyncio.wait(handlers, timeout=1)
+
+    def receive(self):
+        # idle players only cost a file descriptor each, so make sure the OS lets us open as many as allowed
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        try:
+            if soft < hard:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError) as e:
+            log.warning(f"Could not raise the open file limit: {e}")
+
+        asyncio.run(self.serve())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    server = AsyncServer()
+    server.receive()
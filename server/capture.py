@@ -0,0 +1,137 @@
+# capture mode (--capture capture.log): every message a client sends and every message the server writes to it is
+# logged with the time and the connection it belongs to, so the traffic can be played back into a fresh server with
+# server/replay.py. Together with --seed, which makes the numbers of every room repeatable, a problem seen with real
+# players can be run again, as often as needed.
+#
+# The log is binary and compact: a header with the server's settings, then one record per message, a 17 byte header
+# and the message exactly as it was on the wire. Like the results database, the handlers never wait for the disk:
+# a record is appended to a list in memory and a writer thread writes whatever piled up
+import json
+import logging
+import struct
+import threading
+import time
+
+MAGIC = b"GAMECAP1"
+HEADER = struct.Struct("<I")
+# seconds since the capture started, session id, what happened, length of the message that follows
+RECORD = struct.Struct("<dIBI")
+
+# what a record is about
+OPENED = 0
+RECEIVED = 1
+SENT = 2
+CLOSED = 3
+# the sessions paired into a room, their ids as 32 bit integers
+PAIRED = 4
+SESSION_IDS = "<{}I"
+
+log = logging.getLogger("server")
+
+
+class CaptureLog:
+    # settings is what the replay needs to start a server like ours (bounds, seed, timeouts), stored in the header
+    def __init__(self, path, settings, flush_interval=0.1, max_pending=64 * 2 ** 20):
+        self.path = path
+        self.flush_interval = flush_interval
+        # if the disk can not keep up, records beyond this many bytes waiting are dropped instead of growing the list
+        # forever. The capture can then not be replayed exactly, the writer says so in the log
+        self.max_pending = max_pending
+        self.file = open(path, "wb")
+        header = json.dumps(settings).encode("UTF-8")
+        self.file.write(MAGIC + HEADER.pack(len(header)) + header)
+        self.started = time.monotonic()
+
+        self.pending = []
+        self.pending_size = 0
+        # records dropped since the start, and since the writer last logged it
+        self.dropped = 0
+        self.unreported = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="capture", daemon=True)
+        self.thread.start()
+
+    # the time is taken under the lock, so the records of different connections are in the order they happened.
+    # Returns False if the record was dropped
+    def record(self, kind, session_id, data=b""):
+        with self.condition:
+            if self.closed:
+                return False
+            size = RECORD.size + len(data)
+            if self.pending_size + size > self.max_pending:
+                self.dropped += 1
+                self.unreported += 1
+                return False
+            self.pending_size += size
+            self.pending.append(RECORD.pack(time.monotonic() - self.started, session_id, kind, len(data)))
+            if data:
+                self.pending.append(bytes(data))
+        return True
+
+    def opened(self, session):
+        return self.record(OPENED, session.id)
+
+    def received(self, session, data):
+        return self.record(RECEIVED, session.id, data)
+
+    def sent(self, session, data):
+        return self.record(SENT, session.id, data)
+
+    # the client closed the connection
+    def ended(self, session):
+        return self.record(CLOSED, session.id)
+
+    # the players of a room play against each other, the replay keeps their messages in the captured order
+    def paired(self, players):
+        return self.record(PAIRED, 0, struct.pack(SESSION_IDS.format(len(players)), *(player.id for player in players)))
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.closed:
+                    self.condition.wait(self.flush_interval)
+                batch, self.pending = self.pending, []
+                self.pending_size = 0
+                dropped, self.unreported = self.unreported, 0
+                closed = self.closed
+
+            if batch:
+                self.file.write(b"".join(batch))
+            if dropped:
+                log.warning(f"Dropped {dropped} records of the capture, the disk can not keep up. {self.path} can not "
+                            f"be replayed exactly")
+            if closed:
+                self.file.close()
+                return
+
+    # write everything that is queued and close the file
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+
+# returns (settings, records), records yields (seconds, session id, kind, data) in the order they were captured
+def read_capture(path):
+    capture = open(path, "rb")
+    if capture.read(len(MAGIC)) != MAGIC:
+        capture.close()
+        raise ValueError(f"{path} is not a capture log")
+    size, = HEADER.unpack(capture.read(HEADER.size))
+    settings = json.loads(capture.read(size).decode("UTF-8"))
+
+    def records():
+        with capture:
+            while True:
+                header = capture.read(RECORD.size)
+                # a capture cut short (the server was killed) ends with the last whole record
+                if len(header) < RECORD.size:
+                    return
+                when, session_id, kind, length = RECORD.unpack(header)
+                data = capture.read(length)
+                if len(data) < length:
+                    return
+                yield when, session_id, kind, data
+    return settings, records()
@@ -0,0 +1,429 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# multi-process mode: a supervisor forks N workers that all listen on the same port with SO_REUSEPORT, so the
+# kernel spreads the players over every core. Players connected to different workers still have to meet, so after
+# the nickname handshake every worker hands the player's socket (the file descriptor itself, over a Unix socket) to
+# the broker running in the supervisor. The broker pairs the players and hands both sockets to one worker, which
+# then runs the room exactly like a single process server would.
+import asyncio
+import os
+import selectors
+import signal
+import socket
+import threading
+import time
+from server.main import Server, log
+from server.async_server import AsyncServer
+from server.matchmaking import MATCHMAKERS
+from server.rating import Ratings
+from server.restart import PLAYER_INFO_SIZE, encode, decode
+from server.metrics import Registry, serve_metrics
+from protocols import Protocols, DEFAULT_CODEC, find_codec
+
+# a room's sockets are handed to a worker in one message, Linux passes at most this many file descriptors at once
+MAX_ROOM_SIZE = 253
+# biggest message sent between the broker and a worker, a room carries what we know about every player
+CHANNEL_BUFFER = MAX_ROOM_SIZE * PLAYER_INFO_SIZE
+
+
+# what the broker and the workers share, mixed into Server and AsyncServer
+class ClusterWorker:
+    # the supervisor stops the workers, they are not drained or restarted one by one
+    graceful_signals = False
+
+    # the broker does the matchmaking, so a worker never waits for an opponent itself
+    def join_lobby(self, session):
+        pass
+
+    # the broker keeps the ratings, ours would only know the games played on this worker
+    def player_info(self, session):
+        info = super().player_info(session)
+        del info["rating"]
+        return info
+
+    # the end of every game goes to the broker, a message without sockets
+    def rate(self, winner, names):
+        if self.matchmaking != "rating":
+            return
+        try:
+            self.broker.send(encode({"winner": winner, "players": names}))
+        except OSError as e:
+            log.warning(f"Could not send the result of a game to the broker: {e}")
+
+    # give the player to the broker, our copy of the socket is closed but the connection stays open. The session is
+    # only forgotten, disconnect_client() would shut the connection down for the broker too. If the broker does not
+    # get the socket, the connection ends when we close our copy
+    def handoff(self, session, sock):
+        info = self.player_info(session)
+        try:
+            socket.send_fds(self.broker, [encode(info)], [sock.fileno()])
+        except OSError as e:
+            log.warning(f"Could not hand {session.name} to the broker: {e}")
+
+    # a room from the broker, returns the players sockets and what we know about them (longest waiting first). A room
+    # that can not be read is closed and comes back empty
+    def receive_room(self):
+        message, fds, flags, _ = socket.recv_fds(self.broker, CHANNEL_BUFFER, self.matchmaker.room_size)
+        sockets = [socket.socket(fileno=fd) for fd in fds]
+        try:
+            players = decode(message, flags)
+        except ValueError as e:
+            log.warning(f"Dropped a room of {len(sockets)} players from the broker: {e}")
+            for sock in sockets:
+                sock.close()
+            return [], []
+        return sockets, players
+
+    # the sockets of the room have been turned into clients, give them sessions and create the room
+    def adopt_room(self, clients, players):
+        sessions = [self.adopt_player(client, player) for client, player in zip(clients, players)]
+        self.create_room(tuple(sessions))
+        return sessions
+
+
+class ClusterServer(ClusterWorker, Server):
+    def __init__(self, broker, *args, **kwargs):
+        super().__init__(*args, reuse_port=True, **kwargs)
+        # our end of the channel to the broker
+        self.broker = broker
+
+    def handle(self, client):
+        session = self.add_connection(client)
+        try:
+            frames = self.read_frames(session)
+            ready = self.handshake(session, frames)
+            # a player that resumed their session is back in a room of this worker, a spectator watches one of our
+            # rooms (the rooms of the other workers can not be seen from here)
+            if ready and (session.room or session.watching):
+                self.play(session, frames)
+                ready = False
+        finally:
+            outbox = self.remove_connection(session)
+
+        if ready:
+            # the socket changes hands, so whatever is queued for it has to be sent first
+            if outbox:
+                outbox.join()
+            self.handoff(session, client)
+            client.close()
+
+    # a player of a room from the broker, played on this worker until they leave
+    def play_room(self, session):
+        try:
+            self.play(session, self.read_frames(session))
+        finally:
+            self.remove_connection(session)
+
+    def listen_to_broker(self):
+        while True:
+            try:
+                clients, players = self.receive_room()
+            except OSError as e:
+                log.warning(f"Could not receive a room from the broker: {e}")
+                continue
+            if not clients:
+                continue
+            for session in self.adopt_room(clients, players):
+                thread = threading.Thread(target=self.play_room, args=(session,))
+                thread.start()
+
+    def receive(self):
+        threading.Thread(target=self.listen_to_broker, daemon=True).start()
+        super().receive()
+
+
+class AsyncClusterServer(ClusterWorker, AsyncServer):
+    def __init__(self, broker, *args, **kwargs):
+        super().__init__(*args, reuse_port=True, **kwargs)
+        self.broker = broker
+        self.broker.setblocking(False)
+
+    async def handle(self, reader, client):
+        log.info(f"Connected with {client.get_extra_info('peername')}")
+        self.metrics.connections_total.inc()
+        await self.wait_accept()
+        session = self.add_connection(client)
+        try:
+            frames = self.read_frames(reader, session)
+            ready = await self.handshake(session, frames)
+            if ready and (session.room or session.watching):
+                await self.play(session, frames)
+                ready = False
+        finally:
+            # writes what is still queued into the transport
+            self.remove_connection(session)
+        if not ready:
+            return
+
+        # the socket changes hands, so whatever we wrote to it has to be sent first
+        await self.wait_sent(client)
+        self.handoff(session, client.get_extra_info("socket"))
+        client.transport.abort()
+
+    def on_broker_readable(self):
+        while True:
+            try:
+                sockets, players = self.receive_room()
+            except BlockingIOError:
+                return
+            except OSError as e:
+                log.warning(f"Could not receive a room from the broker: {e}")
+                return
+            if not sockets:
+                continue
+            asyncio.get_running_loop().create_task(self.start_room(sockets, players))
+
+    async def start_room(self, sockets, players):
+        streams = [await asyncio.open_connection(sock=sock) for sock in sockets]
+        clients = [writer for _, writer in streams]
+        sessions = self.adopt_room(clients, players)
+        for (reader, _), session in zip(streams, sessions):
+            asyncio.get_running_loop().create_task(self.play_room(reader, session))
+
+    async def play_room(self, reader, session):
+        try:
+            await self.play(session, self.read_frames(reader, session))
+        finally:
+            self.remove_connection(session)
+
+    async def serve(self):
+        asyncio.get_running_loop().add_reader(self.broker.fileno(), self.on_broker_readable)
+        await super().serve()
+
+
+# a player waiting in the broker
+class WaitingPlayer:
+    def __init__(self, sock, info):
+        self.sock = sock
+        self.info = info
+
+
+class Broker:
+    # how often the windows of the rating matchmaker are looked at again
+    lobby_interval = 0.25
+
+    def __init__(self, channels, room_size=2, matchmaking="fifo"):
+        # one channel per worker
+        self.channels = channels
+        self.matchmaking = matchmaking
+        # the ratings of every player of the cluster, the workers report the end of each game they run
+        self.ratings = Ratings()
+        if matchmaking == "rating":
+            self.matchmaker = MATCHMAKERS[matchmaking](room_size, rating=lambda player: self.ratings.get(
+                player.info["name"]))
+        else:
+            self.matchmaker = MATCHMAKERS[matchmaking](room_size)
+        self.selector = selectors.DefaultSelector()
+        # rooms are given to the workers in turn
+        self.next_worker = 0
+
+        # the players waiting for an opponent are only known here, the workers report everything else
+        self.metrics = Registry()
+        self.metrics.gauge("game_waiting_players", "Players waiting for an opponent",
+                           function=lambda: len(self.matchmaker))
+        self.rooms_total = self.metrics.counter("game_rooms_total", "Rooms handed to the workers")
+
+    def run(self):
+        for channel in self.channels:
+            # a worker that stopped reading must not stop the broker, a full channel fails instead of blocking
+            channel.setblocking(False)
+            self.selector.register(channel, selectors.EVENT_READ, None)
+
+        timeout = self.lobby_interval if self.matchmaking == "rating" else None
+        lobby = time.monotonic()
+        while True:
+            for key, _ in self.selector.select(timeout):
+                if key.data is None:
+                    # one bad message only costs its own player, the broker keeps pairing everybody else
+                    try:
+                        self.receive(key.fileobj)
+                    except OSError as e:
+                        log.warning(f"Could not receive from a worker: {e}")
+                else:
+                    self.check_waiting(key.data)
+            # a busy broker is woken up by every player, the lobby is still only looked at every interval
+            if timeout and time.monotonic() - lobby >= timeout:
+                lobby = time.monotonic()
+                for group in self.matchmaker.match(lobby):
+                    self.start_room(group)
+
+    # a player with their socket, or the result of a game without one
+    def receive(self, channel):
+        message, fds, flags, _ = socket.recv_fds(channel, CHANNEL_BUFFER, 1)
+        sock = socket.socket(fileno=fds[0]) if fds else None
+        try:
+            info = decode(message, flags)
+        except ValueError as e:
+            log.warning(f"Dropped a message from a worker: {e}")
+            if sock:
+                sock.close()
+            return
+        if sock is None:
+            self.rate(info)
+        else:
+            self.receive_player(WaitingPlayer(sock, info))
+
+    def rate(self, result):
+        try:
+            self.ratings.record(result["winner"], result["players"])
+        except (KeyError, TypeError) as e:
+            log.warning(f"Dropped the result of a game from a worker: {e!r}")
+
+    def receive_player(self, player):
+        # watch the socket while the player waits, so we notice if they leave
+        self.selector.register(player.sock, selectors.EVENT_READ, player)
+        for group in self.matchmaker.join(player):
+            self.start_room(group)
+
+    # a waiting player's socket became readable, either they left or they sent something early
+    def check_waiting(self, player):
+        self.selector.unregister(player.sock)
+        try:
+            closed = not player.sock.recv(1, socket.MSG_PEEK)
+        except OSError:
+            closed = True
+
+        if closed:
+            self.matchmaker.leave(player)
+            player.sock.close()
+
+    def start_room(self, group):
+        self.rooms_total.inc()
+        for player in group:
+            # players that sent something early are not watched anymore
+            try:
+                self.selector.unregister(player.sock)
+            except KeyError:
+                pass
+        message = encode([player.info for player in group])
+        fds = [player.sock.fileno() for player in group]
+
+        # a worker that died, or whose channel is full, does not get the room, the next one is tried
+        for _ in range(len(self.channels)):
+            index = self.next_worker
+            self.next_worker = (self.next_worker + 1) % len(self.channels)
+            try:
+                socket.send_fds(self.channels[index], [message], fds)
+                break
+            except OSError as e:
+                log.warning(f"Could not hand a room to worker {index}: {e}")
+        else:
+            # no worker can play it, the players are told their game is over instead of waiting forever
+            for player in group:
+                self.turn_away(player)
+
+        # the worker has its own copy of the sockets now
+        for player in group:
+            player.sock.close()
+
+    # OPPONENT_EXITED ends the game for the client, it is sent without waiting and the connection is closed
+    def turn_away(self, player):
+        codec = find_codec(player.info.get("format"), player.info.get("compression")) or DEFAULT_CODEC
+        try:
+            player.sock.setblocking(False)
+            player.sock.send(codec.encode(Protocols.Response.OPPONENT_EXITED, None))
+            player.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class Cluster:
+    def __init__(self, workers, engine="threaded", host="127.0.0.1", port=55556, **options):
+        self.workers = workers
+        self.engine = engine
+        self.host = host
+        self.port = port
+        # the broker serves its metrics on this port, worker i on the port i + 1 after it
+        self.metrics_port = options.pop("metrics_port", None)
+        # passed on to the server of every worker. The kernel spreads the new connections evenly, so each worker
+        # accepts its share of the accept rate
+        if options.get("accept_rate"):
+            options["accept_rate"] /= workers
+            options["accept_burst"] = max(1, options.get("accept_burst", 1000) // workers)
+        self.options = options
+        self.room_size = options.get("room_size", 2)
+        if self.room_size > MAX_ROOM_SIZE:
+            raise ValueError(f"rooms of more than {MAX_ROOM_SIZE} players can not be handed to a worker")
+        self.pids = []
+
+    def receive(self):
+        # a hot restart hands one server's players to another, there is no such thing for a whole cluster. Left to its
+        # default, SIGUSR2 would kill the supervisor (or a worker) and leave the others behind. The workers inherit
+        # this handler
+        signal.signal(signal.SIGUSR2, lambda signum, frame: log.warning("SIGUSR2 ignored, a cluster can not be "
+                                                                          "restarted hot, restart it with SIGTERM"))
+        channels = []
+        for index in range(self.workers):
+            # datagrams keep the message boundaries, and a Unix socket can carry file descriptors
+            broker_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+            pid = os.fork()
+            if pid == 0:
+                broker_end.close()
+                for channel in channels:
+                    channel.close()
+                self.run_worker(worker_end, index)
+
+            worker_end.close()
+            channels.append(broker_end)
+            self.pids.append(pid)
+
+        log.info(f"Started {self.workers} workers on {self.host}:{self.port}")
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        # every worker profiles itself, see server/profiler.py
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.signal_workers(signal.SIGUSR1))
+        broker = Broker(channels, self.room_size, self.options.get("matchmaking", "fifo"))
+        # only after forking, a thread does not survive fork()
+        if self.metrics_port is not None:
+            serve_metrics(broker.metrics, self.host, self.metrics_port)
+        try:
+            broker.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def run_worker(self, channel, index):
+        # stop() sends SIGTERM, turn it into KeyboardInterrupt so the server is closed properly
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        server = None
+        try:
+            server_class = AsyncClusterServer if self.engine == "async" else ClusterServer
+            metrics_port = None if self.metrics_port is None else self.metrics_port + index + 1
+            # every worker numbers its own rooms, with a seed of its own they do not all hide the same numbers
+            options = self.options
+            if options.get("seed") is not None:
+                options = dict(options, seed=f"{options['seed']}.{index}")
+            server = server_class(channel, self.host, self.port, metrics_port=metrics_port, **options)
+            server.receive()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Ctrl+C reaches the workers before the supervisor's SIGTERM, which must not interrupt the close
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            if server:
+                server.close()
+            # never return into the supervisor's code, and do not wait for the handler threads
+            os._exit(0)
+
+    # every worker closes its own server
+    def close(self):
+        pass
+
+    def signal_workers(self, signum):
+        for pid in self.pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def stop(self):
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
@@ -7,286 +7,1428 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 import socket  # create socket object, the endpoints for communication via TCP connection
 import json  # to encode/decode data transmitted through network. Sockets can only transmit bytes and so we need to
 # convert/revert the data into json text and back into python dictionaries
-from server.room import Room, GuessResult
+from server.room import Room, GuessResult, validate_settings, MAX_HIDDEN_NUMBERS
+from server.matchmaking import MATCHMAKERS
+from server.rating import Ratings
+from server.session import SessionRegistry
 import threading  # multiple users utilizing the server
-from protocols import Protocols
+from protocols import (Protocols, ProtocolError, CODECS, DEFAULT_CODEC, PROTOCOL_VERSION, MAX_GUESS_BATCH,
+                       HEARTBEAT_INTERVAL, agree, find_codec, valid_name, valid_guess)
+from framing import FrameReader
+from server.metrics import ServerMetrics, serve_metrics
+from server.outbound import Outbox
+from server.results import ResultStore, GameResult, PlayerResult
+from server.ratelimit import new_bucket
+from server.reaper import Reaper
+from server.restart import Successor, inherited_listener, inherited_channel, announce_ready, receive_player
+from server.capture import CaptureLog
+from server.profiler import SamplingProfiler
+from tls import TlsSocket, server_context, HANDSHAKE_TIMEOUT
+import itertools
+import logging
+import os
+import random
+import selectors
+import signal
+import ssl
 import time
-import traceback
+import argparse
+
+# the server reports through logging instead of print(), --log-level decides how much of it is written out. Every
+# message received is logged at DEBUG, so under load the console does not slow the game down
+log = logging.getLogger("server")
 
 class Server:
+    # SIGTERM drains the server and SIGUSR2 restarts it. The cluster's workers are stopped by their supervisor instead
+    graceful_signals = True
+
     # using this host IP to do local testing, the client and server will be hosted on my machine for testing
-    def __init__(self, host="127.0.0.1", port=55556):
+    def __init__(self, host="127.0.0.1", port=55556, start_delay=1, recv_size=4096, reuse_port=False,
+                 metrics_port=None, high_water=64 * 1024, low_water=16 * 1024, max_backlog=1024 * 1024,
+                 room_size=2, lower_bound=0, upper_bound=500, hidden_numbers=1, results_db=None, resume_grace=30,
+                 message_rate=100, message_burst=200, byte_rate=64 * 1024, byte_burst=256 * 1024, accept_rate=1000,
+                 accept_burst=1000, protocol_version=PROTOCOL_VERSION, max_batch=MAX_GUESS_BATCH, tls_cert=None,
+                 tls_key=None, login_timeout=10, idle_timeout=60, heartbeat=HEARTBEAT_INTERVAL, drain_timeout=300,
+                 seed=None, capture=None, matchmaking="fifo", profile=None, profile_interval=0.01,
+                 profile_idle=False):
+        validate_settings(room_size, lower_bound, upper_bound, hidden_numbers)
         self.host = host
         self.port = port
+        # seconds between sending the game bounds and the START message
+        self.start_delay = start_delay
+        # how many bytes each read from a client asks for
+        self.recv_size = recv_size
+        # limits of the outbound queues, see server/outbound.py
+        self.high_water = high_water
+        self.low_water = low_water
+        self.max_backlog = max_backlog
+        # every room gets room_size players and hidden_numbers numbers to find between the bounds
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+        self.hidden_numbers = hidden_numbers
+        # with a seed, room n draws its numbers from its own random.Random seeded with (seed, n), the same rooms get
+        # the same numbers every time. A capture always has one, or it could not be replayed
+        if seed is None and capture:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.room_numbers = itertools.count()
+        # seconds a player that lost its connection during a game keeps its place in the room, 0 ends it right away
+        self.resume_grace = resume_grace
+        # every client may send message_rate messages (each guess of a batch counts) and byte_rate bytes a second,
+        # with bursts of up to message_burst and byte_burst. A rate of 0 is no limit
+        self.message_rate = message_rate
+        self.message_burst = message_burst
+        self.byte_rate = byte_rate
+        self.byte_burst = byte_burst
+        # new connections accepted per second, for every client of the server together
+        self.accept_limit = new_bucket(accept_rate, accept_burst)
+        # the newest protocol version we speak, a lower one keeps a new feature off while it is rolled out
+        self.protocol_version = protocol_version
+        # the most guesses verified from one GUESS_BATCH, 0 to only accept guesses one by one
+        self.max_batch = max_batch
+        # with a certificate every connection is TLS, all of them share this context (see tls.py)
+        self.tls = server_context(tls_cert, tls_key) if tls_cert else None
+        # seconds a client has to log in, and may stay quiet once it has, before it is disconnected. A client of
+        # protocol version 3 is sent a PING after heartbeat seconds of quiet, so only a client that is gone (or hung)
+        # stays quiet that long. 0 turns each of them off, see server/reaper.py
+        self.login_timeout = login_timeout
+        self.idle_timeout = idle_timeout
+        self.heartbeat = heartbeat
+        self.reaper = Reaper() if login_timeout or idle_timeout or heartbeat else None
+        # once draining, no new player is accepted and the games being played have this many seconds to end
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        # the server taking over from us during a restart, see server/restart.py
+        self.successor = None
+        # the pipe that wakes up the accept loop when we stop accepting
+        self.wakeup = None
+        # the connections of the players waiting for a room, their handler is woken up when the client sends something
+        # (see watch()). Only the threaded engine watches them, the selector is made by receive()
+        self.watched = None
+        self.watch_lock = threading.Lock()
+
+        # a restart hands us the listening socket of the server we replace, nothing is bound again
+        self.server = inherited_listener()
+        # the players the server we replace was still pairing come through this socket
+        self.predecessor = inherited_channel()
+        if self.server is not None:
+            log.info(f"Took over listening on {self.host}:{self.port}" + (" with TLS" if self.tls else ""))
+        else:
+            self.listen(reuse_port)
+
+        # every connected player, the socket, nickname, codec and room are all kept on their session
+        self.sessions = SessionRegistry()
+        # the Elo rating of every nickname, updated at the end of every game
+        self.ratings = Ratings()
+        # the players that are awaiting an opponent: "fifo" pairs them in order of arrival, "rating" with the players
+        # rated closest to them (see server/matchmaking.py)
+        self.matchmaking = matchmaking
+        if matchmaking == "rating":
+            self.matchmaker = MATCHMAKERS[matchmaking](room_size, rating=self.rating_of)
+        else:
+            self.matchmaker = MATCHMAKERS[matchmaking](room_size)
+        # the room created last, for a spectator that did not name a player. The rooms being played are found through
+        # their players (see open_rooms()), a set of them took almost as much memory per player as the session
+        self.last_room = None
+        # the room of every player in one, for the spectators who name a player. Filled by create_room() and emptied
+        # as the players leave, a player's name is only taken out if it still points at the room they left
+        self.rooms_by_name = {}
+        self.names_lock = threading.Lock()
+        # OPPONENT_EXITED has no data, it is encoded once per codec for every room that ends without a winner
+        self.exit_messages = {}
+
+        self.metrics = ServerMetrics()
+        self.metrics.gauge("game_waiting_players", "Players waiting for an opponent",
+                           function=lambda: len(self.matchmaker))
+        self.metrics.gauge("game_rooms_active", "Rooms being played", function=lambda: len(self.open_rooms()))
+        self.metrics.gauge("game_spectators", "Connections watching a game",
+                           function=lambda: sum(len(room.spectators or ()) for room in self.open_rooms()))
+        # the request types we know, anything else a client sends is counted as "unknown" so a client can not make
+        # up new labels
+        self.request_types = {value for name, value in vars(Protocols.Request).items() if not name.startswith("_")}
+        # finished games are written to this SQLite database in the background, nothing is recorded without one
+        self.results = None
+        if results_db:
+            self.results = ResultStore(results_db)
+            self.metrics.gauge("game_results_pending", "Finished games waiting to be written",
+                               function=lambda: len(self.results))
+            log.info(f"Recording results in {results_db}")
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = serve_metrics(self.metrics, self.host, metrics_port)
+            log.info(f"Metrics on http://{self.host}:{metrics_port}/metrics")
+        # every message in and out is logged for server/replay.py, see server/capture.py. The server taking over during
+        # a restart writes its own file next to ours
+        self.capture = None
+        if capture:
+            if self.predecessor is not None:
+                capture = f"{capture}.{os.getpid()}"
+            self.capture = CaptureLog(capture, self.capture_settings())
+            log.info(f"Capturing the traffic in {capture}, seed {self.seed}")
+            self.metrics.gauge("game_capture_dropped_records", "Records left out of the capture because the disk fell "
+                               "behind", function=lambda: self.capture.dropped)
+        # samples the stacks of every thread, from the start with a profile prefix or once SIGUSR1 comes (see
+        # server/profiler.py)
+        self.profile = profile
+        self.profiler = SamplingProfiler(profile or "profile", profile_interval, profile_idle)
+
+    # what server/replay.py needs to start a server that plays the captured traffic the same way
+    def capture_settings(self):
+        return {"seed": self.seed, "room_size": self.matchmaker.room_size, "lower_bound": self.lower_bound,
+                "upper_bound": self.upper_bound, "hidden_numbers": self.hidden_numbers, "start_delay": self.start_delay,
+                "resume_grace": self.resume_grace, "protocol_version": self.protocol_version,
+                "max_batch": self.max_batch, "login_timeout": self.login_timeout, "idle_timeout": self.idle_timeout,
+                "heartbeat": self.heartbeat, "matchmaking": self.matchmaking, "started": time.time()}
+
+    def listen(self, reuse_port):
         # the server will hold an AF_INET = IPv4 addresses , SOCK_STREAM =
-        # TCP (which defines the transport protocol type) socket
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # TCP (which defines the transport protocol type) socket. Naming the protocol lets asyncio turn off Nagle's
+        # algorithm on the connections it accepts
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
 
         # allow immediate reuse of port after crash/disconnect. After a crash/disconnect macOS holds the port
         # in TIME_WAIT for 90 seconds so this allows the server to use the port even if the TIME_WAIT exists
         self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # several worker processes bind the same port, the kernel spreads the new connections between them
+        if reuse_port:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
         self.server.bind((self.host, self.port))
         self.server.listen()
-        print(f"Listening on {self.host}:{self.port}")
-
-        # dictionaries to hold game info
-        # map of players names
-        self.client_name = {}
-        # maps each client to the room object they belong to
-        self.rooms = {}
-        # maps each client socket to their opponent's client socket (bidirectional pairing)
-        self.opponent = {}
-        # below will be used to store the address of a client that is awaiting an opponent
-        self.waiting_for_opponent = None
-
-    def handle_connection(self, client):
+        log.info(f"Listening on {self.host}:{self.port}" + (" with TLS" if self.tls else ""))
+
+    def handle_connection(self, session, frames):
         # using While true for multithreaded server allows each client to have its own loop to continue
         # processing messages
         while True:
             # we first send a message to get the clients NICKNAME. Is this the first handshake made by the server
-            # ??????????????????????????
-            self.send(Protocols.Response.NICKNAME, None, client)
-            message = json.loads(client.recv(1024).decode("UTF-8"))
-            r_type = message.get("type")
-            nickname = message.get("data")
+            self.send(Protocols.Response.NICKNAME, None, session)
+            frame = next(frames, None)
 
-            # verify that the client sent the correct message type containing their nickname and if so assign
-            # the name to the client socket object
-            if r_type == Protocols.Request.NICKNAME:
-                self.client_name[client] = nickname
+            # the client left before sending a nickname
+            if frame is None:
+                return False
 
-            # else we continue to repeatedly ask for the correct info
-            else:
+            codec, frame = frame
+            message = codec.parse(frame)
+
+            # a client that lost its connection during a game comes back with the token of its session
+            if message.get("type") == Protocols.Request.RESUME:
+                old = self.find_resumable(session, message)
+                if old:
+                    self.wait_detached(old)
+                if self.resume(session, old):
+                    return True
+                continue
+
+            # somebody who only wants to watch a game
+            if message.get("type") == Protocols.Request.SPECTATE:
+                if self.spectate(session, message):
+                    return True
                 continue
 
-            # check to see if we are waiting for an opponent, if no one is waiting for a pair, we will be the first
-            # to wait for another player, and so we wait for a room
-            if not self.waiting_for_opponent:
-                self.waiting_for_opponent = client
-                print("Waiting for a room")
+            # else we continue to repeatedly ask for the correct info
+            if not self.login(session, message):
+                continue
 
-            # else we are the second player, and so we create the room to join the first player already waiting
-            else:
-                self.create_room(client)
+            self.join_lobby(session)
 
             # we have handled the connection so we break from While loop
-            break
+            return True
+
+    # verify that the client sent the correct message type containing their nickname and if so assign
+    # the name to the player's session
+    def login(self, session, message):
+        self.count_received(message)
+        if message.get("type") != Protocols.Request.NICKNAME:
+            return False
+        # the name is shown to everybody in the room and travels with the player to other processes, the client is
+        # asked again for a name that is not a short string
+        if not valid_name(message.get("data")):
+            log.info(f"Rejected an invalid nickname from session {session.id}")
+            return False
+
+        session.name = message.get("data")
+        session.ready = self.new_event()
+        self.negotiate(session, message)
+        return True
+
+    # the NICKNAME or RESUME request says what the client can do (see offer() in protocols.py). A client of version 2
+    # gets a HELLO with what we agreed to, an older one only gets the wire format it asked for acknowledged. The
+    # answer is still sent in JSON and every message after it uses the new format
+    def negotiate(self, session, message):
+        hello = agree(message, self.protocol_version, self.max_batch, self.heartbeat)
+        if hello is not None:
+            self.send(Protocols.Response.HELLO, hello, session)
+            session.codec = find_codec(hello["format"], hello["compression"])
+            session.heartbeat = hello.get("heartbeat", 0)
+            return
 
+        wire_format = message.get("format")
+        if isinstance(wire_format, str) and wire_format in CODECS and CODECS[wire_format] is not DEFAULT_CODEC:
+            self.send(Protocols.Response.WIRE_FORMAT, wire_format, session)
+            session.codec = CODECS[wire_format]
 
+    # the session the client had before its connection dropped, None if there is nothing to resume
+    def find_resumable(self, session, message):
+        self.count_received(message)
+        self.negotiate(session, message)
+        token = message.get("data")
+        old = self.sessions.find(token) if isinstance(token, str) else None
+        if old is None or old is session or old.room is None:
+            return None
+        # we may not have noticed yet that the old connection is dead (a phone that switched networks), closing it
+        # makes its handler detach the session
+        if old.expiry is None and old.outbox:
+            self.abort_client(old.client)
+        return old
 
-    # store the two clients that are playing the game
-    def create_room(self, client):
-        print("Creating a room")
-        # create a room with the two players
-        room = Room(client, self.waiting_for_opponent)
+    # give the handler of the old connection a moment to let go of the session. The event is in place before the
+    # session is looked at, the handler sets it after letting go (see let_go()), so neither side misses the other
+    def wait_detached(self, session, timeout=5):
+        event = session.released = self.new_event()
+        if session.expiry is None and session.room:
+            event.wait(timeout)
+        session.released = None
 
-        # now we need to store each client's opponent in the dictionary, the client and the person who was waiting
-        # for their opponent
-        self.opponent[client] = self.waiting_for_opponent
-        self.opponent[self.waiting_for_opponent] = client
+    # the session was detached or left its room, wakes up the client that waits to resume it
+    def let_go(self, session):
+        event = session.released
+        if event:
+            event.set()
 
-        # notify each player of their opponents nickname
-        self.send(Protocols.Response.OPPONENT, self.client_name[client], self.waiting_for_opponent)
-        self.send(Protocols.Response.OPPONENT, self.client_name[self.waiting_for_opponent], client)
+    # the new connection takes over the place of the old session in its room, returns False (and tells the client
+    # to log in again) if the session is gone
+    def resume(self, session, old):
+        if old is None or not self.sessions.take(old):
+            self.send(Protocols.Response.RESUME_REJECTED, None, session)
+            return False
+        self.sessions.remove(old)
+        room = old.room
+        # everybody else left while the player was away
+        if room is None:
+            self.send(Protocols.Response.RESUME_REJECTED, None, session)
+            return False
 
-        # now we store these players in the room dictionary
-        self.rooms[client] = room
-        self.rooms[self.waiting_for_opponent] = room
+        session.name = old.name
+        session.guesses = old.guesses
+        session.room, old.room = room, None
+        room.replace(old, session)
+        self.metrics.sessions_resumed.inc()
+        log.info(f"{session.name} resumed their session")
 
-        # now that we have paired the person that was waiting for a room into one,
-        self.waiting_for_opponent = None
+        # play() sends the bounds, the numbers and START again, like to a player that just joined the room
+        self.send(Protocols.Response.RESUMED, None, session)
+        self.issue_token(session)
+        self.send(Protocols.Response.OPPONENT, self.opponent_names(session, room.players), session)
+        if room.game_over:
+            self.send(Protocols.Response.WINNER, room.leader.name, session)
+        return True
 
+    # the spectator watches the room of the player it named, or the game that started last. Returns False (and tells
+    # the client to log in again) if there is no such game being played
+    def spectate(self, session, message):
+        self.count_received(message)
+        self.negotiate(session, message)
+        room = self.find_room(message.get("data"))
+        if room is None:
+            self.send(Protocols.Response.SPECTATE_REJECTED, None, session)
+            return False
 
-    # client waiting for an opponent
-    def wait_for_room(self, client):
+        session.name = "spectator"
+        session.watching = room
+        room.watch(session)
+        self.send(Protocols.Response.SPECTATING, {"players": [str(player.name) for player in room.players],
+                                                   "lower": room.lower_bound, "upper": room.upper_bound}, session)
+        log.info(f"A spectator is watching {self.opponent_names(None, room.players)}")
+        return True
+
+    # the room of the player called name, the newest room without a name. None if its game is already over
+    def find_room(self, name):
+        if name:
+            room = self.rooms_by_name.get(name) if isinstance(name, str) else None
+        else:
+            room = self.last_room
+        if room is None or room.game_over or not room.is_open():
+            return None
+        return room
+
+    # the rooms being played, every one has at least one player still in it
+    def open_rooms(self):
+        return {session.room for session in list(self.sessions.sessions.values()) if session.room is not None}
+
+    # the client needs a token to resume its session, only players in a room get one
+    def issue_token(self, session):
+        if self.resume_grace:
+            self.send(Protocols.Response.SESSION_TOKEN, self.sessions.issue_token(session), session)
+
+    # put the player in the matchmaking queue and create a room for every group that is now complete
+    def join_lobby(self, session):
+        # nobody is paired anymore while we drain
+        if self.draining:
+            self.release(session)
+            return
+        groups = self.matchmaker.join(session)
+        if not groups:
+            log.info("Waiting for a room")
+
+        for group in groups:
+            self.create_room(group)
+
+    def rating_of(self, session):
+        return self.ratings.get(session.name)
+
+    # the rating windows of the waiting players widen as they wait, the lobby is looked at again every interval
+    def run_lobby(self, interval=0.25):
         while True:
-            room = self.rooms.get(client)
-            opponent = self.opponent.get(client)
-
-            # if we have a room and opponent, we start the game
-            if room and opponent:
-                # send the correct generated number and start protocols
-                bounds = {"lower": room.lower_bound, "upper": room.upper_bound}
-                self.send(Protocols.Response.GAME_BOUNDS, bounds, client)
-                self.send(Protocols.Response.CORRECT_NUMBER, room.correct_number, client)
-                time.sleep(1)
-                self.send(Protocols.Response.START, None, client)
-                break
+            time.sleep(interval)
+            for group in self.matchmaker.match():
+                self.create_room(group)
+
+    # a player we will not pair because we are draining: the server taking over gets them with their connection, or
+    # they are disconnected if there is none. Their handler is woken up and lets go of the session
+    def release(self, session):
+        event = session.ready
+        if not self.pass_on(session):
+            self.disconnect_client(session)
+        if event:
+            event.set()
+
+    # hand a logged in player to the server taking over, returns False if they can not be handed over. A TLS
+    # connection can not change process, its encryption state stays here
+    def pass_on(self, session):
+        if self.successor is None or self.tls:
+            return False
+        # whatever is queued has to be sent before the socket changes hands
+        outbox, session.outbox = session.outbox, None
+        if outbox:
+            outbox.close()
+            outbox.join(1)
+        try:
+            self.successor.send_player(self.player_info(session), session.client)
+        except OSError as e:
+            log.warning(f"Could not hand {session.name} to the new server: {e}")
+            return False
+        # the session is only forgotten, our copy of the socket is closed but the connection stays open
+        self.sessions.remove(session)
+        self.unwatch(session)
+        session.client.close()
+        log.info(f"Handed {session.name} to the new server")
+        return True
+
+    # what another server needs to know about a player that logged in here, see adopt_player()
+    def player_info(self, session):
+        return {"name": session.name, "format": session.codec.name, "compression": session.codec.compression,
+                "heartbeat": session.heartbeat, "rating": self.rating_of(session)}
+
+    # a player that logged in on another server (a cluster worker, or the server we replace) and was handed to us with
+    # their connection. They are put in a room like a player that just logged in
+    def adopt_player(self, client, info):
+        session = self.add_connection(client)
+        session.name = info["name"]
+        session.codec = find_codec(info["format"], info.get("compression")) or DEFAULT_CODEC
+        session.heartbeat = info.get("heartbeat", 0)
+        if "rating" in info:
+            self.ratings.learn(session.name, info["rating"])
+        session.ready = self.new_event()
+        return session
+
+    # store the players that are playing the game, the one that waited longest first
+    def create_room(self, players):
+        log.info("Creating a room")
+        self.metrics.rooms_total.inc()
+        room = Room(players, self.lower_bound, self.upper_bound, self.hidden_numbers, self.room_rng())
+        self.last_room = room
+        if self.capture:
+            self.capture.paired(players)
+        for player in players:
+            player.room = room
+            player.guesses = 0
+        with self.names_lock:
+            for player in players:
+                self.rooms_by_name[player.name] = room
+
+        # notify each player of their opponents nicknames
+        for player in players:
+            self.issue_token(player)
+            self.send(Protocols.Response.OPPONENT, self.opponent_names(player, players), player)
+
+        # wake up every player, they are blocked in wait_for_room()
+        for player in players:
+            event = player.ready
+            if event:
+                event.set()
+
+    # the random numbers of the next room, None (the random module) without a seed. Rooms are numbered in the order
+    # they are created, next() on a count is atomic
+    def room_rng(self):
+        number = next(self.room_numbers)
+        if self.seed is None:
+            return None
+        return random.Random(f"{self.seed}/{number}")
+
+    # the names of everybody else in the room, only the first few in a big room so the message stays small
+    def opponent_names(self, player, players, limit=16):
+        names = [str(other.name) for other in players[:limit + 1] if other is not player][:limit]
+        if len(players) - 1 > len(names):
+            names.append(f"{len(players) - 1 - len(names)} more")
+        return ", ".join(names)
+
+    # the object create_room uses to wake up a waiting player, the async engine swaps in asyncio.Event
+    def new_event(self):
+        return threading.Event()
+
+    # player waiting for an opponent, the thread sleeps on the event until create_room sets it. The watcher sets it
+    # too when the client sends something, which is read before going back to sleep: a PONG keeps a quiet player
+    # from being reaped, and a player whose connection ends is taken out of the lobby. Returns the frames to play
+    # with, None if the player left, was reaped or was released (see release()), their handler has nothing left to do
+    def wait_for_room(self, session, frames):
+        event = session.ready
+        if event:
+            started = time.perf_counter()
+            while self.wait_or_read(session, event, frames):
+                pass
+            self.metrics.wait_for_room_seconds.observe(time.perf_counter() - started)
+        session.ready = None
+        if session.room is None and (event or self.draining):
+            return None
+        self.start_game(session)
+        return frames
+
+    # sleep until the player is paired or their client sends something, returns True while they still wait
+    def wait_or_read(self, session, event, frames):
+        self.watch(session)
+        event.wait()
+        self.unwatch(session)
+        # create_room sets the room and release() or reap_client() take the event before setting it, the event is
+        # only cleared once we know the watcher woke us up, and then looked at again in case they came in between
+        if session.room is not None or session.ready is not event:
+            return False
+        event.clear()
+        if session.room is not None or session.ready is not event:
+            return False
+        return self.read_waiting(session, lambda: next(frames, None))
+
+    # the client of a waiting player sent something, read() returns it. Returns False if the player left, they are
+    # disconnected like a player that leaves before the game starts
+    def read_waiting(self, session, read):
+        try:
+            frame = read()
+            if frame is not None:
+                codec, frame = frame
+                message = codec.parse(frame)
+                if message.get("type") != Protocols.Request.LEAVE_SERVER:
+                    # a PONG, or a GUESS sent early, there is no room to play it in yet
+                    self.handle_received_msg(message, session)
+                    return True
+                self.count_received(message)
+        except (json.JSONDecodeError, ProtocolError) as e:
+            log.warning(f"Invalid message from client {session.name} waiting for a room: {e}")
+            return True
+        except OSError as e:
+            log.info(f"Client {session.name} disconnected: {e}")
+        log.info(f"{session.name} left before being paired")
+        self.disconnect_client(session)
+        return False
+
+    # the connection of a waiting player is looked at by the watcher until it becomes readable, like the broker does
+    # with the players it pairs. Nothing is watched without a watcher
+    def watch(self, session):
+        if self.watched is not None:
+            with self.watch_lock:
+                # disconnect_client() takes the outbox before it unwatches and closes the socket
+                if session.outbox is not None:
+                    self.watched.register(session.client, selectors.EVENT_READ, session)
+
+    # must be called before the socket is closed, its number may be given to the next connection
+    def unwatch(self, session):
+        if self.watched is not None:
+            with self.watch_lock:
+                try:
+                    self.watched.unregister(session.client)
+                except (KeyError, ValueError):
+                    pass
+
+    # the watcher's own thread. A second at most between two selects, a selector that is not an epoll only sees the
+    # connections registered since the last one when it selects again
+    def run_watcher(self):
+        while True:
+            self.wake_readable(1)
+
+    # wake up the handler of every waiting player whose client sent something (or closed the connection) within
+    # timeout seconds
+    def wake_readable(self, timeout):
+        for key, _ in self.watched.select(timeout):
+            session = key.data
+            self.unwatch(session)
+            event = session.ready
+            if event:
+                event.set()
+
+    # send the correct generated number and start protocols
+    def start_game(self, session):
+        room = session.room
+        if not room:
+            return
+        bounds = {"lower": room.lower_bound, "upper": room.upper_bound}
+        self.send(Protocols.Response.GAME_BOUNDS, bounds, session)
+        for number in room.correct_numbers:
+            self.send(Protocols.Response.CORRECT_NUMBER, number, session)
+
+        # the countdown runs on a timer so the handler thread can already go back to reading from the client
+        self.call_later(self.start_delay, self.send_start, session)
+
+    # run function(*args) in delay seconds, returns something with a cancel() method. The async engine uses the
+    # event loop instead of a thread
+    def call_later(self, delay, function, *args):
+        timer = threading.Timer(delay, function, args=args)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def send_start(self, session):
+        # the player may have left during the countdown
+        if session.room:
+            self.send(Protocols.Response.START, None, session)
 
 
 
     # determines logic and placement for new clients joining the server
     def handle(self, client):
-        self.handle_connection(client)
-        self.wait_for_room(client)
+        # the TLS handshake counts towards the login deadline
+        accepted = time.monotonic()
+        client = self.secure(client)
+        if client is None:
+            return
+        session = self.add_connection(client, accepted)
+        try:
+            frames = self.read_frames(session)
+            if self.handshake(session, frames):
+                self.play(session, frames)
+        finally:
+            self.remove_connection(session)
+
+    # the TLS handshake, on the client's own thread so a slow one holds up nobody else. Returns what the session
+    # reads from and writes to, None if the handshake failed
+    def secure(self, client):
+        if self.tls is None:
+            return client
+        connection = TlsSocket(client, self.tls)
+        try:
+            connection.handshake(HANDSHAKE_TIMEOUT)
+        except (OSError, ssl.SSLError) as e:
+            log.info(f"TLS handshake failed: {e}")
+            self.metrics.tls_handshakes.labels("failed").inc()
+            client.close()
+            return None
+        self.metrics.tls_handshakes.labels("resumed" if connection.session_reused else "full").inc()
+        return connection
+
+    # every connection gets a session and its outbound queue before anything is sent to it. opened is when the
+    # connection was accepted, the deadlines of the reaper count from it
+    def add_connection(self, client, opened=None):
+        self.metrics.connections.inc()
+        session = self.sessions.create(client, DEFAULT_CODEC)
+        session.outbox = self.new_outbox(session)
+        if self.capture:
+            self.capture.opened(session)
+        # only the reaper reads when the connection was opened and last heard from
+        if self.reaper is not None:
+            session.opened = session.seen = opened or time.monotonic()
+            self.reaper.schedule(session, session.opened + min(t for t in (self.login_timeout, self.idle_timeout,
+                                                                          self.heartbeat) if t))
+        return session
+
+    # the handler is done with the player, returns their outbound queue (None if it is already closed). A detached
+    # session stays in the registry until it is resumed or expires
+    def remove_connection(self, session):
+        self.metrics.connections.dec()
+        if session.expiry is None:
+            self.sessions.remove(session)
+        outbox, session.outbox = session.outbox, None
+        if outbox:
+            outbox.close()
+        return outbox
+
+    # the queue a player's messages are written from, the async engine swaps in AsyncOutbox
+    def new_outbox(self, session):
+        return Outbox(session, self.transmit, self.evict_client, self.high_water, self.low_water, self.max_backlog)
+
+    # the client does not read what we send, closing the connection wakes up its handler which then cleans up as if
+    # the client had left
+    def evict_client(self, session, reason):
+        log.warning(f"Evicting {session.name}: {reason}")
+        self.metrics.evictions.inc()
+        self.abort_client(session.client)
+
+    # end the connection without waiting for what is still queued, its handler sees it closing and cleans up
+    def abort_client(self, client):
+        try:
+            client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # one of the session's deadlines has come (see server/reaper.py). A client that did not log in in time or stayed
+    # quiet for too long is disconnected, a quiet client that agreed to heartbeats is sent a PING. Returns when to
+    # look at the session again, None once there is nothing left to watch
+    def check_deadline(self, session, now):
+        # the connection is gone, or lost and waiting to be resumed on another one
+        if session.outbox is None:
+            return None
+        deadlines = []
+        if session.name is None and self.login_timeout:
+            login = session.opened + self.login_timeout
+            if now >= login:
+                self.reap_client(session, "login", f"did not log in within {self.login_timeout}s")
+                return None
+            deadlines.append(login)
+        heartbeat = session.heartbeat if session.name is not None else 0
+        if not self.idle_timeout and not heartbeat:
+            return min(deadlines, default=None)
+
+        # a player waiting for a room counts too, their handler still reads what they send (see wait_for_room())
+        if self.idle_timeout:
+            idle = session.seen + self.idle_timeout
+            if now >= idle:
+                self.reap_client(session, "idle", f"sent nothing for {self.idle_timeout}s")
+                return None
+            deadlines.append(idle)
+        if heartbeat:
+            ping = session.seen + heartbeat
+            # quiet for a whole interval, another PING every interval until the client answers
+            if now >= ping:
+                self.send(Protocols.Response.PING, None, session)
+                ping = now + heartbeat
+            deadlines.append(ping)
+        return min(deadlines)
+
+    # the handler sees the connection closing and cleans up as if the client had left. A player waiting for a room
+    # is taken out of the lobby at once, like a released one, their handler is woken up and lets go
+    def reap_client(self, session, reason, detail):
+        log.info(f"Closing the connection of {session.name or f'session {session.id}'}: {detail}")
+        self.metrics.reaped.labels(reason).inc()
+        event = session.ready
+        if event is None:
+            self.abort_client(session.client)
+            return
+        self.disconnect_client(session)
+        event.set()
+
+    # look at every session whose deadline has come by now
+    def reap(self, now):
+        for session in self.reaper.due(now):
+            when = self.check_deadline(session, now)
+            if when is not None:
+                self.reaper.schedule(session, when)
+
+    # the reaper's own thread, it sleeps until the next deadline
+    def run_reaper(self):
+        while True:
+            time.sleep(self.reaper.wait(time.monotonic()))
+            self.reap(time.monotonic())
+
+    # get the nickname and put the player in the lobby, returns False if the player has been disconnected
+    def handshake(self, session, frames):
+        started = time.perf_counter()
+        try:
+            if not self.handle_connection(session, frames):
+                self.disconnect_client(session)
+                return False
+        except (ConnectionError, json.JSONDecodeError, ProtocolError) as e:
+            log.warning(f"Client {session.name} failed the handshake: {e}")
+            self.disconnect_client(session)
+            return False
+        except Exception as e:
+            # the connection is closed whatever went wrong, the client is not left waiting for an answer
+            log.exception(f"Unexpected error in the handshake of session {session.id}: {e}")
+            self.disconnect_client(session)
+            return False
+        finally:
+            self.metrics.handshake_seconds.observe(time.perf_counter() - started)
+        return True
+
+    # wait for the room and run the main game loop until the player leaves
+    def play(self, session, frames):
+        # whether the client was heard from since it was paired, a client that resumed came back with its token. The
+        # place of one that is gone before that is not kept: it may never have got its token, the others would wait
+        # for nothing
+        heard = session.ready is None
+        frames = self.wait_for_room(session, frames)
+        if frames is None:
+            return
 
         # track json error msg attempts to decide continue/break for connection
         consecutive_json_errors = 0
         max_json_errors = 5
-
-        # buffer to correctly handle and account for all msg data
-        buffer = ""
+        # the connection dropped without the player leaving, they may come back
+        lost = False
 
         # main game loop
         while True:
             try:
-                data = client.recv(1024).decode("UTF-8")
+                frame = next(frames, None)
+
+                # if the client disconnected or an error has occurred, break loop
+                if frame is None:
+                    lost = True
+                    break
+                heard = True
 
-                # if the data the client sent was empty, disconnected or an error has occurred, break loop
-                if not data:
+                codec, frame = frame
+                message = codec.parse(frame)
+                # the player quits, there is nothing to keep for them
+                if message.get("type") == Protocols.Request.LEAVE_SERVER:
+                    self.count_received(message)
                     break
-                buffer += data
-
-                # now we process all complete messages in the buffer, split() splits on the 1st occurrence of '\n'
-                # which results in two separate strings, msg_str contains data up until the newline char and
-                # the remainder stays in buffer
-                while '\n' in buffer:
-                    msg_str, buffer = buffer.split('\n', 1)
-                    message = json.loads(msg_str)
-                    self.handle_received_msg(message, client)
-
-                    # reset json errors if we receive valid data
-                    consecutive_json_errors = 0
+                self.handle_received_msg(message, session)
+
+                # reset json errors if we receive valid data
+                consecutive_json_errors = 0
             except (ConnectionError, ConnectionResetError, BrokenPipeError) as e:
-                print(f"Client {self.client_name.get(client, 'unknown')} disconnected: {e}")
+                log.info(f"Client {session.name} disconnected: {e}")
+                lost = True
                 break
-            except json.JSONDecodeError as e:
+            except (json.JSONDecodeError, ProtocolError) as e:
 
                 # if we receive bad data, increment flag
                 consecutive_json_errors += 1
-                print(f"Invalid JSON from client ({consecutive_json_errors}/{max_json_errors}): {e}")
+                log.warning(f"Invalid message from client ({consecutive_json_errors}/{max_json_errors}): {e}")
 
                 # if we have reached sentinel value of too many attempts, disconnect
                 if consecutive_json_errors >= max_json_errors:
-                    print(
-                        f"Client {self.client_name.get(client, 'unknown')} sending too many bad messages, disconnecting")
+                    log.warning(f"Client {session.name} sending too many bad messages, disconnecting")
                     break
 
                 # continue to attempt receiving the correct data
                 continue
             except Exception as e:
                 # catch unexpected errors but log them
-                print(f"Unexpected error handling client: {e}")
-                traceback.print_exc()
+                log.exception(f"Unexpected error handling client: {e}")
                 break
 
-        self.send_to_opponent(Protocols.Response.OPPONENT_EXITED, None, client)
-        self.disconnect_client(client)
+        if lost and heard:
+            self.drop(session)
+        else:
+            self.disconnect_client(session)
 
-    # we need to clean up the room if a client is leaving the game
-    def disconnect_client(self, client):
-        opponent = self.opponent.get(client)
-        # if we have an opponent and a mapping to their client, we delete their mapping
-        if opponent in self.opponent:
-            del self.opponent[opponent]
+    # yields (codec, frame) for every complete message the client sends. Each frame is split with the codec agreed
+    # for the player at the moment we reach it, so nothing is lost when the wire format changes after the handshake
+    def read_frames(self, session):
+        reader = FrameReader(self.recv_size)
+        while True:
+            codec = session.codec
+            frame = reader.next_frame(codec)
+            if frame is not None:
+                delay = self.throttle(self.message_limit_of(session), "messages")
+                if delay:
+                    time.sleep(delay)
+                if self.capture:
+                    self.capture.received(session, codec.wire(frame))
+                yield codec, frame
+                continue
+
+            # every message of the last read has been handled, if the client is not reading the replies we stop
+            # reading its requests until it catches up
+            outbox = session.outbox
+            if outbox:
+                outbox.wait_writable()
+
+            # if the client sent nothing it has disconnected
+            count = reader.recv_into(session.client)
+            if not count:
+                if self.capture:
+                    self.capture.ended(session)
+                return
+            if self.reaper is not None:
+                session.seen = time.monotonic()
+            self.metrics.bytes_received.inc(count)
+            delay = self.throttle(self.byte_limit_of(session), "bytes", count)
+            if delay:
+                time.sleep(delay)
+
+    # the token buckets of a client, created the first time it sends something: a new bucket is full, like one
+    # created with the connection that was never taken from. None without a limit
+    def message_limit_of(self, session):
+        bucket = session.message_limit
+        if bucket is None and self.message_rate:
+            bucket = session.message_limit = new_bucket(self.message_rate, self.message_burst)
+        return bucket
 
-        # then delete mapping the other direction
-        if client in self.opponent:
-            del self.opponent[client]
+    def byte_limit_of(self, session):
+        bucket = session.byte_limit
+        if bucket is None and self.byte_rate:
+            bucket = session.byte_limit = new_bucket(self.byte_rate, self.byte_burst)
+        return bucket
 
-        # delete the nicknames of client and opponent
-        if client in self.client_name:
-            del self.client_name[client]
+    # take amount from a rate limit, returns the seconds the caller has to wait before going on
+    def throttle(self, bucket, limit, amount=1):
+        if bucket is None:
+            return 0
+        delay = bucket.take(amount)
+        if delay:
+            self.metrics.rate_limited.labels(limit).inc()
+        return delay
 
-        if opponent in self.client_name:
-            del self.client_name[opponent]
+    # the connection of a player in a game is gone, their place in the room is kept for resume_grace seconds
+    def drop(self, session):
+        room = session.room
+        if not self.resume_grace or not session.token_count or room is None or room.game_over:
+            self.disconnect_client(session)
+            return
+
+        outbox, session.outbox = session.outbox, None
+        if outbox:
+            outbox.close()
+        self.close_client(session.client)
+        self.sessions.detach(session, self.call_later(self.resume_grace, self.expire, session))
+        self.let_go(session)
+        log.info(f"{session.name} lost the connection, keeping their place for {self.resume_grace}s")
+
+    # the player did not come back in time, they leave the room like everybody else
+    def expire(self, session):
+        if not self.sessions.take(session):
+            return
+        self.sessions.remove(session)
+        self.metrics.sessions_expired.inc()
+        log.info(f"{session.name} did not come back")
+        self.disconnect_client(session)
 
-        # also delete both players from the room object
-        if client in self.rooms:
-            del self.rooms[client]
+    # we need to clean up the room if a player is leaving the game
+    def disconnect_client(self, session):
+        room = session.room
+        if room:
+            self.leave_room(session, room)
+        else:
+            # a player that leaves before being paired must not be handed to the next player. A player in a room has
+            # already been taken out of the lobby
+            self.matchmaker.leave(session)
+        watching = session.watching
+        if watching:
+            session.watching = None
+            watching.unwatch(session)
 
-        if opponent in self.rooms:
-            del self.rooms[opponent]
+        session.ready = None
+        outbox, session.outbox = session.outbox, None
+        if outbox:
+            outbox.close()
 
-        # try to close the socket gracefully by ending read and write between client/server
-        # this way we give data the opportunity to transmit before closing the socket
+        self.unwatch(session)
+        self.close_client(session.client)
+        self.let_go(session)
+
+    # the others keep playing unless the player leaves somebody alone in the room
+    def leave_room(self, session, room):
+        session.room = None
+        self.forget_name(session, room)
+        remaining = room.remove(session)
+        if len(remaining) < 2:
+            # a player leaves much more often than a message goes to a whole room, the last player is written to
+            # directly instead of through broadcast() and its metrics
+            for player in remaining:
+                codec = player.codec
+                message = self.exit_messages.get(codec)
+                if message is None:
+                    message = self.exit_messages[codec] = codec.encode(Protocols.Response.OPPONENT_EXITED, None)
+                self.write(player, message)
+            # the spectators of a game that ended without a winner are told like the last player
+            if room.spectators and not room.game_over:
+                self.broadcast(Protocols.Response.OPPONENT_EXITED, None, room.watchers())
+            self.close_room(room)
+
+    # nobody is left in the room, see Room.is_open()
+    def close_room(self, room):
+        if self.last_room is room:
+            self.last_room = None
+        for player in room.players:
+            player.room = None
+            self.forget_name(player, room)
+            self.let_go(player)
+
+    # the player is not in room anymore, a spectator naming them no longer finds it
+    def forget_name(self, player, room):
+        with self.names_lock:
+            if self.rooms_by_name.get(player.name) is room:
+                del self.rooms_by_name[player.name]
+
+    # try to close the socket gracefully by ending read and write between client/server
+    # this way we give data the opportunity to transmit before closing the socket
+    def close_client(self, client):
         try:
             client.shutdown(socket.SHUT_RDWR)
         except Exception as e:
-            print(f"Shutdown error: {e}")
+            log.debug(f"Shutdown error: {e}")
             pass
 
         client.close()
 
     # handle messages received from clients depending on which type of msg was received
-    def handle_received_msg(self, message, client):
-        # print all messages to the server
-        print(message)
+    def handle_received_msg(self, message, session):
+        # every message is logged, only written out with --log-level debug
+        log.debug("%s", message)
+        self.count_received(message)
         r_type = message.get("type")
         data = message.get("data")
-        room = self.rooms[client]
+        # everybody else left (or was evicted) and the room was closed
+        room = session.room
+        if room is None:
+            return
+
+        if r_type == Protocols.Request.GUESS_BATCH:
+            started = time.perf_counter()
+            self.handle_guess_batch(data, room, session)
+            self.metrics.guess_seconds.observe(time.perf_counter() - started)
+            return
 
         if r_type != Protocols.Request.GUESS:
             return
 
-        result = room.verify_guess(data)
+        started = time.perf_counter()
+        self.handle_guess(data, room, session)
+        self.metrics.guess_seconds.observe(time.perf_counter() - started)
+
+    def count_received(self, message):
+        r_type = message.get("type")
+        if r_type not in self.request_types:
+            r_type = "unknown"
+        self.metrics.messages_received.labels(r_type).inc()
+
+    def handle_guess(self, guess, room, session):
+        if not valid_guess(guess):
+            raise ProtocolError(f"guess is a {type(guess).__name__}, not an integer")
+        session.guesses += 1
+        started = time.perf_counter()
+        result = room.verify_guess(guess, session)
+        self.metrics.verify_guess_seconds.observe(time.perf_counter() - started)
 
         # the game is over, we do not accept anymore guesses
         if  result == GuessResult.GAME_OVER:
             return
+        if room.spectators:
+            self.show_guesses(room, session, [guess], [result])
 
         # the guess was too low
         if result == GuessResult.TOO_LOW:
-            self.send(Protocols.Response.GUESS_TOO_LOW, None, client)
+            self.send(Protocols.Response.GUESS_TOO_LOW, None, session)
 
         # the guess was too high
         elif result == GuessResult.TOO_HIGH:
-            self.send(Protocols.Response.GUESS_TOO_HIGH, None, client)
+            self.send(Protocols.Response.GUESS_TOO_HIGH, None, session)
 
         # the guess was the correct number
         elif result == GuessResult.CORRECT:
-            # get the winner and opponents name
-            winners_name = self.client_name.get(client)
+            self.send(Protocols.Response.GUESS_VALID, None, session)
+            # there may be more numbers to find
+            if room.finisher is session:
+                self.announce_winner(room, session)
+
+    # many guesses in one message, they are verified in order until one is correct and all the results are sent
+    # back in a single message
+    def handle_guess_batch(self, guesses, room, session):
+        if not self.max_batch:
+            return
+        if not isinstance(guesses, list):
+            raise ProtocolError(f"guess batch is a {type(guesses).__name__}, not a list")
+        # what is beyond the batch size we agreed to is not verified, the client sees fewer results than guesses
+        guesses = guesses[:self.max_batch]
+        if not all(map(valid_guess, guesses)):
+            raise ProtocolError("guess batch holds something else than integers")
+        started = time.perf_counter()
+        results = room.verify_guesses(guesses, session)
+        self.metrics.verify_guess_seconds.observe(time.perf_counter() - started)
+        session.guesses += len(results)
+        # every guess counts against the message limit, the frame itself already took one. The client pays for them
+        # before its next message is read
+        bucket = self.message_limit_of(session)
+        if bucket and len(results) > 1:
+            bucket.take(len(results) - 1)
+
+        # the game is over, we do not accept anymore guesses
+        if not results or results[0] == GuessResult.GAME_OVER:
+            return
 
-           # reveal winner and correct number
-            self.send(Protocols.Response.GUESS_VALID, None, client)
-            self.send(Protocols.Response.WINNER, winners_name, client)
-            self.send_to_opponent(Protocols.Response.WINNER, winners_name, client)
-            self.send_to_opponent(Protocols.Response.CORRECT_NUMBER, room.correct_number, client)
+        self.send(Protocols.Response.GUESS_BATCH_RESULT, results, session)
+        if room.spectators:
+            self.show_guesses(room, session, guesses[:len(results)], results)
+        if results[-1] == GuessResult.CORRECT and room.finisher is session:
+            self.announce_winner(room, session)
 
-            # we need to update the database
+    # session found the last number, the winner is whoever found the most numbers first
+    def announce_winner(self, room, session):
+        # get the winners name
+        winners_name = room.leader.name
 
-    # consider adding a send_to_both helper function###########
-    def send(self, r_type, data, client):
-        try:
-            message = {"type": r_type, "data": data}
-            # because TCP does not hold message boundaries, we add a newline delimiter
-            message = json.dumps(message).encode("UTF-8") + b"\n"
-            client.send(message)
-        except Exception as e:
-            print(f"Error sending message to the client: {e}")
-            self.disconnect_client(client)
+        # reveal winner and correct numbers to the whole room
+        self.broadcast(Protocols.Response.WINNER, winners_name, room.players)
+        for number in room.correct_numbers:
+            self.broadcast(Protocols.Response.CORRECT_NUMBER, number, room.players, exclude=session)
+        # the spectators see the same end of the game, they never got the numbers
+        if room.spectators:
+            audience = room.watchers()
+            self.broadcast(Protocols.Response.WINNER, winners_name, audience)
+            for number in room.correct_numbers:
+                self.broadcast(Protocols.Response.CORRECT_NUMBER, number, audience)
 
+        self.rate(room.leader.name, [player.name for player in room.players])
+        self.record_result(room)
 
-    # to send messages to a clients opponent, EX: opponent has left game, won or lost
-    def send_to_opponent(self, r_type, data, client):
-        opponent = self.opponent.get(client)
+    # winner beat everybody else in names, their ratings change
+    def rate(self, winner, names):
+        self.ratings.record(winner, names)
 
-        if not opponent:
+    # what a player guessed and how close it was, for everybody watching the room
+    def show_guesses(self, room, session, guesses, results):
+        self.broadcast(Protocols.Response.ROOM_GUESSES, {"player": str(session.name), "guesses": guesses,
+                                                          "results": results}, room.watchers())
+
+    # queue the finished game for the results database, the writer thread does the rest
+    def record_result(self, room):
+        if self.results is None:
             return
-        self.send(r_type, data, opponent)
+        scores = room.scores or {}
+        players = tuple(PlayerResult(str(player.name), player.guesses, scores.get(player, 0), player is room.leader)
+                        for player in room.players)
+        result = GameResult(time.time(), time.monotonic() - room.started, room.lower_bound, room.upper_bound,
+                            room.correct_numbers, str(room.leader.name), players)
+        if self.results.record(result):
+            self.metrics.results_recorded.inc()
+        else:
+            self.metrics.results_dropped.inc()
+
+    # send the same message to many players, it is encoded once per wire format instead of once per player. Every
+    # outbox gets the same bytes object, nothing is copied for a thousand spectators
+    def broadcast(self, r_type, data, players, exclude=None):
+        started = time.perf_counter()
+        encoded = {}
+        count = 0
+        for player in players:
+            if player is exclude:
+                continue
+            codec = player.codec
+            message = encoded.get(codec)
+            if message is None:
+                message = encoded[codec] = codec.encode(r_type, data)
+            self.write(player, message)
+            count += 1
+        if count:
+            self.metrics.messages_sent.labels(r_type).inc(count)
+        self.metrics.send_phase_seconds.observe(time.perf_counter() - started)
+
+    def send(self, r_type, data, session):
+        started = time.perf_counter()
+        try:
+            # the codec frames the message so the client can find where it ends
+            message = session.codec.encode(r_type, data)
+            self.metrics.messages_sent.labels(r_type).inc()
+            self.write(session, message)
+        except Exception as e:
+            log.warning(f"Error sending message to the client: {e}")
+            self.disconnect_client(session)
+        self.metrics.send_phase_seconds.observe(time.perf_counter() - started)
+
+    def write(self, session, message):
+        # only queued, the player's writer sends it. A player without a queue has been disconnected
+        outbox = session.outbox
+        if outbox:
+            # logged first, the reply can not be read by the client (and answered) before it is in the capture
+            if self.capture:
+                self.capture.sent(session, message)
+            outbox.put(message)
+
+    # called by the writer of the player's queue, sendall() because send() may only write part of the data
+    def transmit(self, session, data):
+        started = time.perf_counter()
+        session.client.sendall(data)
+        self.metrics.send_seconds.observe(time.perf_counter() - started)
+        self.metrics.bytes_sent.inc(len(data))
 
     # because we have one thread listening for new clients, we use this method to allow new client requests to
     # connect to the server by being passed to handle()
     def receive(self):
-        while True:
+        if self.reaper is not None:
+            threading.Thread(target=self.run_reaper, name="reaper", daemon=True).start()
+        if self.matchmaking == "rating":
+            threading.Thread(target=self.run_lobby, name="lobby", daemon=True).start()
+        self.watched = selectors.DefaultSelector()
+        threading.Thread(target=self.run_watcher, name="watcher", daemon=True).start()
+        if self.profile:
+            self.profiler.start()
+        # the profiler is toggled from its own thread, stopping it writes a file
+        signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(target=self.profiler.toggle,
+                                                                           daemon=True).start())
+        if self.predecessor is not None:
+            threading.Thread(target=self.adopt_players, name="handoff", daemon=True).start()
+        if self.graceful_signals:
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.stop_accepting())
+            signal.signal(signal.SIGUSR2, lambda signum, frame: threading.Thread(target=self.restart,
+                                                                                 daemon=True).start())
+
+        # during a restart two servers accept from the same socket, the other one may take the connection we were
+        # woken up for. So the socket does not block, and we wait for it (or for stop_accepting()) with a selector
+        self.wakeup = os.pipe()
+        self.server.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(self.server, selectors.EVENT_READ)
+        selector.register(self.wakeup[0], selectors.EVENT_READ)
+        announce_ready()
+        while not self.draining:
+            # over the accept rate, the new connections wait in the listen queue
+            delay = self.throttle(self.accept_limit, "connections")
+            if delay:
+                time.sleep(delay)
             # wait until we get a connection before proceeding
-            client, address = self.server.accept()
-            # print address that has connected
-            print(f"Connected with {address}")
+            selector.select()
+            if self.draining:
+                break
+            try:
+                client, address = self.server.accept()
+            except BlockingIOError:
+                continue
+            # replies are small and must go out at once, not wait for the client to acknowledge the previous one.
+            # Without this the first message after a TLS handshake waited 40 ms for a delayed ACK
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # log address that has connected
+            log.info(f"Connected with {address}")
+            self.metrics.connections_total.inc()
             # new thread object, pass the handle function and the client as the parameter. We set up a new thread for
             # each new client connecting so that we can continue listening for new clients to accept()
-            thread = threading.Thread(target=self.handle, args=(client,))
+            # daemon threads, a handler that is still running never keeps the process from exiting
+            thread = threading.Thread(target=self.handle, args=(client,), daemon=True)
             thread.start()
+        selector.close()
+        self.drain()
+
+    # no new connections from now on, receive() returns once the games being played have ended. Safe to call from a
+    # signal handler
+    def stop_accepting(self):
+        self.draining = True
+        if self.wakeup:
+            os.write(self.wakeup[1], b"x")
+
+    # start a new server that takes over the listening socket, and drain once it accepts connections
+    def restart(self):
+        if self.draining or self.successor:
+            return
+        log.info("Starting a new server to take over")
+        successor = self.start_successor()
+        if successor is None:
+            return
+        self.successor = successor
+        self.stop_accepting()
+
+    # the new server, None (and we keep serving) if it did not start
+    def start_successor(self):
+        try:
+            successor = Successor(self.server)
+        except OSError as e:
+            log.error(f"Could not start the new server: {e}")
+            return None
+        if not successor.wait_ready():
+            log.error("The new server did not start, we keep serving")
+            return None
+        return successor
+
+    # let the games being played end, for at most drain_timeout seconds, then close every connection left. Players
+    # still waiting for a room are released, see release()
+    def drain(self):
+        self.server.close()
+        self.stop_metrics()
+        log.info(f"Draining, {len(self.open_rooms())} rooms left" + (", the new server takes the new players"
+                                                              if self.successor else ""))
+        deadline = time.monotonic() + self.drain_timeout
+        while True:
+            # a player that logged in just as we started draining may still have joined the queue
+            for session in self.matchmaker.take_all():
+                self.release(session)
+            if not self.live_rooms() or time.monotonic() >= deadline:
+                break
+            time.sleep(0.1)
+        if self.live_rooms():
+            log.warning(f"Closing {self.live_rooms()} rooms that did not end within {self.drain_timeout}s")
+        self.end_connections()
+        if self.successor:
+            self.successor.close()
+
+    # rooms whose game is not over yet
+    def live_rooms(self):
+        return sum(1 for room in self.open_rooms() if not room.game_over)
+
+    # the new server serves the metrics on the same port from now on
+    def stop_metrics(self):
+        if self.successor and self.metrics_server:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+
+    # what is queued for every player is sent, then the connection is closed
+    def end_connections(self):
+        for session in list(self.sessions.sessions.values()):
+            outbox = session.outbox
+            if outbox:
+                outbox.close()
+                outbox.join(1)
+            self.abort_client(session.client)
+
+    # players handed over by the server we replace, each gets a handler like a new connection that just logged in
+    def adopt_players(self):
+        while True:
+            try:
+                player = receive_player(self.predecessor)
+            except ValueError as e:
+                log.warning(f"Dropped a player the old server handed over: {e}")
+                continue
+            except OSError as e:
+                log.warning(f"Could not receive players from the old server: {e}")
+                break
+            if player is None:
+                break
+            threading.Thread(target=self.handle_adopted, args=player, daemon=True).start()
+        self.predecessor.close()
+
+    def handle_adopted(self, client, info):
+        session = self.adopt_player(client, info)
+        try:
+            self.join_lobby(session)
+            self.play(session, self.read_frames(session))
+        finally:
+            self.remove_connection(session)
+
+    # the server is stopping, write the results that are still queued
+    def close(self):
+        self.profiler.stop()
+        if self.results:
+            self.results.close()
+        if self.capture:
+            self.capture.close()
 
 
 
 
 # safeguard needed to prevent the server from starting if script is imported, adds modularity to the class
 if __name__ == "__main__":
-    server = Server()
-    server.receive()
+    parser = argparse.ArgumentParser(description="Number guessing game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=55556)
+    # threaded = one thread per client, async = every client served from a single asyncio event loop
+    parser.add_argument("--engine", choices=["threaded", "async"], default="threaded")
+    parser.add_argument("--start-delay", type=float, default=1, help="seconds of countdown before START")
+    parser.add_argument("--recv-size", type=int, default=4096, help="bytes asked for on each read from a client")
+    # fork this many worker processes sharing the port, 0 runs everything in this process
+    parser.add_argument("--workers", type=int, default=0)
+    # serve the metrics on http://host:port/metrics, with --workers the broker uses this port and the workers the
+    # ones after it
+    parser.add_argument("--metrics-port", type=int, default=None)
+    # debug also logs every message received, warning only logs what went wrong
+    parser.add_argument("--log-level", choices=["debug", "info", "warning", "error"], default="info")
+    # a client that lets this many bytes pile up in its outbound queue is disconnected
+    parser.add_argument("--max-backlog", type=int, default=1024 * 1024)
+    parser.add_argument("--room-size", type=int, default=2, help="players in each room")
+    # any 64 bit range, e.g. --lower-bound -9223372036854775808 --upper-bound 9223372036854775807
+    parser.add_argument("--lower-bound", type=int, default=0)
+    parser.add_argument("--upper-bound", type=int, default=500)
+    parser.add_argument("--hidden-numbers", type=int, default=1, help=f"numbers to find in each room, at most {MAX_HIDDEN_NUMBERS}")
+    # SQLite database finished games are recorded in, e.g. --results-db results.db
+    parser.add_argument("--results-db", default=None)
+    # limits for each client and for accepting new connections, 0 for no limit. A client over its limit is read more
+    # slowly, it is not disconnected
+    parser.add_argument("--message-rate", type=float, default=100, help="messages per second from each client")
+    parser.add_argument("--message-burst", type=int, default=200)
+    parser.add_argument("--byte-rate", type=float, default=64 * 1024, help="bytes per second from each client")
+    parser.add_argument("--byte-burst", type=int, default=256 * 1024)
+    parser.add_argument("--accept-rate", type=float, default=1000, help="new connections per second")
+    parser.add_argument("--accept-burst", type=int, default=1000)
+    # a player whose connection drops keeps their place in the room this long, 0 ends their game right away
+    parser.add_argument("--resume-grace", type=float, default=30, help="seconds to wait for a client to reconnect")
+    # the newest protocol version offered to clients, 1 turns off what the HELLO negotiates (compression, batching)
+    parser.add_argument("--protocol-version", type=int, choices=range(1, PROTOCOL_VERSION + 1),
+                        default=PROTOCOL_VERSION)
+    parser.add_argument("--max-batch", type=int, default=MAX_GUESS_BATCH,
+                        help="most guesses in one GUESS_BATCH, 0 turns batching off")
+    # SIGTERM stops accepting and gives the games being played this long to end
+    parser.add_argument("--drain-timeout", type=float, default=300)
+    # serve every connection over TLS with this certificate (PEM, the key may be in the same file)
+    parser.add_argument("--tls-cert", default=None)
+    parser.add_argument("--tls-key", default=None)
+    # a client that does not log in, or sends nothing, for this many seconds is disconnected. Clients of protocol
+    # version 3 get a PING after --heartbeat-interval seconds of quiet. 0 turns each of them off
+    parser.add_argument("--login-timeout", type=float, default=10)
+    parser.add_argument("--idle-timeout", type=float, default=60)
+    parser.add_argument("--heartbeat-interval", type=float, default=HEARTBEAT_INTERVAL)
+    # the numbers of every room are drawn from a random.Random seeded with the seed and the room's number
+    parser.add_argument("--seed", type=int, default=None)
+    # log every message in and out to this file, play it back with server/replay.py
+    parser.add_argument("--capture", default=None)
+    # fifo pairs the players in order of arrival, rating pairs players of about the same Elo rating
+    parser.add_argument("--matchmaking", choices=["fifo", "rating"], default="fifo")
+    # sample the stacks of every thread from the start and write them to PREFIX.<pid>.<n>.folded when the server
+    # stops, or on SIGUSR1. Without it SIGUSR1 starts sampling and the next one writes profile.<pid>.<n>.folded
+    parser.add_argument("--profile", metavar="PREFIX", default=None)
+    parser.add_argument("--profile-interval", type=float, default=0.01, help="seconds between two samples")
+    # also count the threads waiting for their client, a wall clock profile
+    parser.add_argument("--profile-idle", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(message)s")
+
+    # passed on to whichever server we start
+    options = {
+        "start_delay": args.start_delay,
+        "recv_size": args.recv_size,
+        "metrics_port": args.metrics_port,
+        "max_backlog": args.max_backlog,
+        "room_size": args.room_size,
+        "lower_bound": args.lower_bound,
+        "upper_bound": args.upper_bound,
+        "hidden_numbers": args.hidden_numbers,
+        "results_db": args.results_db,
+        "resume_grace": args.resume_grace,
+        "message_rate": args.message_rate,
+        "message_burst": args.message_burst,
+        "byte_rate": args.byte_rate,
+        "byte_burst": args.byte_burst,
+        "accept_rate": args.accept_rate,
+        "accept_burst": args.accept_burst,
+        "protocol_version": args.protocol_version,
+        "max_batch": args.max_batch,
+        "tls_cert": args.tls_cert,
+        "tls_key": args.tls_key,
+        "login_timeout": args.login_timeout,
+        "idle_timeout": args.idle_timeout,
+        "heartbeat": args.heartbeat_interval,
+        "drain_timeout": args.drain_timeout,
+        "seed": args.seed,
+        "capture": args.capture,
+        "matchmaking": args.matchmaking,
+        "profile": args.profile,
+        "profile_interval": args.profile_interval,
+        "profile_idle": args.profile_idle,
+    }
+    try:
+        validate_settings(args.room_size, args.lower_bound, args.upper_bound, args.hidden_numbers)
+    except ValueError as e:
+        parser.error(str(e))
+    # a TLS connection can not be handed from one process to another like a socket
+    if args.tls_cert and args.workers:
+        parser.error("--tls-cert can not be used with --workers")
+    # the workers would all write to the same file
+    if args.capture and args.workers:
+        parser.error("--capture can not be used with --workers")
+    if args.tls_key and not args.tls_cert:
+        parser.error("--tls-key needs --tls-cert")
+    # the PING has to go out before the client is given up on
+    if args.idle_timeout and args.heartbeat_interval >= args.idle_timeout:
+        parser.error("--heartbeat-interval has to be shorter than --idle-timeout")
+    if args.workers:
+        from server.cluster import Cluster
+        server = Cluster(args.workers, args.engine, args.host, args.port, **options)
+    elif args.engine == "async":
+        from server.async_server import AsyncServer
+        server = AsyncServer(args.host, args.port, **options)
+    else:
+        server = Server(args.host, args.port, **options)
+    try:
+        server.receive()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
 
 
 # See PyCharm help at https://www.jetbrains.com/help/pycharm/
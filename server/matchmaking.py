@@ -0,0 +1,328 @@
+import bisect
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+
+class Matchmaker:
+    # FIFO queue of players waiting for an opponent. Every handler thread goes through the same lock, so two players
+    # joining at the same time can never take the same waiting player, and nobody is lost when the slot is overwritten
+    def __init__(self, room_size=2):
+        # how many players are put in one room
+        self.room_size = room_size
+        # players in order of arrival, players that left are only skipped once they reach the front
+        self.queue = deque()
+        # players that are really still waiting, so leave() does not need to search the queue
+        self.waiting = set()
+        self.lock = threading.Lock()
+
+    # add one player to the queue, returns every group of players that is now complete (oldest player first)
+    def join(self, client):
+        return self.join_many((client,))
+
+    # add many players at once, all the groups are formed while holding the lock only once
+    def join_many(self, clients):
+        with self.lock:
+            for client in clients:
+                self.queue.append(client)
+                self.waiting.add(client)
+            return self.take_groups()
+
+    # a player disconnected before being paired
+    def leave(self, client):
+        with self.lock:
+            self.waiting.discard(client)
+
+    # everybody still waiting in order of arrival, the queue is left empty. The server is shutting down and will not
+    # pair them anymore
+    def take_all(self):
+        with self.lock:
+            players = [client for client in self.queue if client in self.waiting]
+            self.queue.clear()
+            self.waiting.clear()
+            return players
+
+    # the FIFO queue pairs whoever is there as soon as they join, waiting longer changes nothing
+    def match(self, now=None):
+        return []
+
+    def take_groups(self):
+        groups = []
+        group = []
+        while self.queue and len(self.queue) + len(group) >= self.room_size:
+            client = self.queue.popleft()
+            # skip players that left while they were waiting
+            if client not in self.waiting:
+                continue
+            group.append(client)
+
+            if len(group) == self.room_size:
+                for player in group:
+                    self.waiting.discard(player)
+                groups.append(tuple(group))
+                group = []
+
+        # not enough players for another room, put the ones we took back at the front in the same order
+        self.queue.extendleft(reversed(group))
+        return groups
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def __contains__(self, client):
+        return client in self.waiting
+
+
+# the (rating, arrival) keys of the waiting players in order, cut in buckets of up to 2 * load keys. The bucket of a
+# key is found with a binary search of the last key of every bucket, and adding or removing a key only moves the keys
+# of its bucket, so both cost O(log n + load) where one sorted list of everybody moved half the lobby
+class SortedKeys:
+    def __init__(self, load=256):
+        self.load = load
+        self.buckets = []
+        # the largest key of each bucket
+        self.maxes = []
+        self.size = 0
+
+    def add(self, key):
+        buckets, maxes = self.buckets, self.maxes
+        self.size += 1
+        if not buckets:
+            buckets.append([key])
+            maxes.append(key)
+            return
+        index = bisect.bisect_left(maxes, key)
+        if index == len(maxes):
+            # larger than everybody, goes at the end of the last bucket
+            index -= 1
+            buckets[index].append(key)
+            maxes[index] = key
+        else:
+            bisect.insort(buckets[index], key)
+        bucket = buckets[index]
+        if len(bucket) > 2 * self.load:
+            buckets[index:index + 1] = bucket[:self.load], bucket[self.load:]
+            maxes[index:index + 1] = bucket[self.load - 1], bucket[-1]
+
+    # key must be there
+    def remove(self, key):
+        index = bisect.bisect_left(self.maxes, key)
+        bucket = self.buckets[index]
+        position = bisect.bisect_left(bucket, key)
+        del bucket[position]
+        self.size -= 1
+        if not bucket:
+            del self.buckets[index]
+            del self.maxes[index]
+        elif position == len(bucket):
+            self.maxes[index] = bucket[-1]
+
+    # up to count keys on each side of key, the closest first: (the smaller ones, the larger ones)
+    def around(self, key, count):
+        buckets = self.buckets
+        index = bisect.bisect_left(self.maxes, key)
+        below = []
+        bucket, position = index, bisect.bisect_left(buckets[index], key) if index < len(buckets) else 0
+        while len(below) < count:
+            if not position:
+                bucket -= 1
+                if bucket < 0:
+                    break
+                position = len(buckets[bucket])
+            position -= 1
+            below.append(buckets[bucket][position])
+        above = []
+        bucket, position = index, bisect.bisect_right(buckets[index], key) if index < len(buckets) else 0
+        while len(above) < count and bucket < len(buckets):
+            above += buckets[bucket][position:position + count - len(above)]
+            bucket, position = bucket + 1, 0
+        return below, above
+
+    def clear(self):
+        self.buckets.clear()
+        self.maxes.clear()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.buckets)
+
+
+# players waiting for opponents of about their own skill. The lobby keeps the (rating, arrival) keys in order, so the
+# players rated closest to a new one are its neighbours, found with a binary search. A group is only formed if the
+# ratings in it are no further apart than the window of its most patient player, which starts at window and widens
+# by widen every second they wait, up to max_window. Nobody waits forever for a perfect opponent
+class RatedMatchmaker:
+    def __init__(self, room_size=2, rating=None, window=50, widen=25, max_window=800, clock=time.monotonic):
+        self.room_size = room_size
+        # rating(player) is read once, when the player joins
+        self.rating = rating or (lambda player: 0)
+        self.window = window
+        self.widen = widen
+        self.max_window = max_window
+        self.clock = clock
+        # the sorted keys of the waiting players, and the player of each key
+        self.keys = SortedKeys()
+        self.players = {}
+        # the key and the time each waiting player joined, in order of arrival
+        self.waiting = {}
+        self.arrivals = itertools.count()
+        # heap of (time, key): when the window has widened enough for the player of key to be paired with the players
+        # around them now. A key is only in due with the time in due_at, older entries are skipped when they come up
+        self.due = []
+        self.due_at = {}
+        self.lock = threading.Lock()
+
+    def join(self, client):
+        return self.join_many((client,))
+
+    # a new player is paired right away if somebody close enough is waiting
+    def join_many(self, clients):
+        now = self.clock()
+        groups = []
+        with self.lock:
+            for client in clients:
+                if client in self.waiting:
+                    continue
+                key = (self.rating(client), next(self.arrivals))
+                self.keys.add(key)
+                self.players[key] = client
+                self.waiting[client] = (key, now)
+                group = self.find_group(key, now)
+                if group:
+                    groups.append(group)
+                else:
+                    # the new player may be closer to their neighbours than who they were waiting for
+                    self.schedule(key)
+                    self.schedule_around(key)
+        return groups
+
+    def leave(self, client):
+        with self.lock:
+            entry = self.waiting.pop(client, None)
+            if entry is not None:
+                self.remove(entry[0])
+                self.schedule_around(entry[0])
+
+    def take_all(self):
+        with self.lock:
+            players = list(self.waiting)
+            self.keys.clear()
+            self.players.clear()
+            self.waiting.clear()
+            self.due.clear()
+            self.due_at.clear()
+            return players
+
+    # the windows have widened since the last call, pair the players whose time has come. Called every fraction of
+    # a second, returns the groups formed, oldest player first. Only the players that are due are looked at, not the
+    # whole lobby
+    def match(self, now=None):
+        # windows that never widen were all looked at when the players joined
+        if not self.widen:
+            return []
+        now = self.clock() if now is None else now
+        groups = []
+        with self.lock:
+            missed = []
+            while self.due and self.due[0][0] <= now:
+                when, key = heapq.heappop(self.due)
+                if self.due_at.get(key) != when:
+                    continue
+                del self.due_at[key]
+                group = self.find_group(key, now)
+                if group:
+                    groups.append(group)
+                else:
+                    missed.append(key)
+            # only rounding gets a player here, they are looked at again on the next call
+            for key in missed:
+                if key in self.players:
+                    self.schedule(key)
+        return groups
+
+    def window_of(self, client, now):
+        joined = self.waiting[client][1]
+        return min(self.max_window, self.window + self.widen * (now - joined))
+
+    # the key and the keys rated closest to it that make a group with it, and the spread of their ratings. None if
+    # there are not enough players
+    def closest(self, key):
+        if len(self.keys) < self.room_size:
+            return None
+        below, above = self.keys.around(key, self.room_size - 1)
+        # the neighbours on both sides, the closer one first
+        members = [key]
+        lower = upper = 0
+        while len(members) < self.room_size:
+            if upper >= len(above) or lower < len(below) and key[0] - below[lower][0] <= above[upper][0] - key[0]:
+                members.append(below[lower])
+                lower += 1
+            else:
+                members.append(above[upper])
+                upper += 1
+        spread = (above[upper - 1][0] if upper else key[0]) - (below[lower - 1][0] if lower else key[0])
+        return members, spread
+
+    # the player of key and the players rated closest to them, taken out of the lobby if they are close enough to
+    # play together. None if they are not
+    def find_group(self, key, now):
+        closest = self.closest(key)
+        if closest is None:
+            return None
+        members, spread = closest
+        # the longest waiting player first, like the FIFO queue
+        members.sort(key=lambda member: member[1])
+        group = tuple(self.players[member] for member in members)
+        if spread > max(self.window_of(client, now) for client in group):
+            return None
+
+        for member, client in zip(members, group):
+            del self.waiting[client]
+            self.remove(member)
+        for member in members:
+            self.schedule_around(member)
+        return group
+
+    # puts key in due for when find_group() will pair it with the players around it now. A player whose group is
+    # further apart than max_window is not due at all, only somebody joining can change that
+    def schedule(self, key):
+        closest = self.closest(key)
+        when = None
+        if closest is not None and self.widen:
+            members, spread = closest
+            if spread <= self.max_window:
+                # the window of the group is that of the player who joined first
+                joined = min(self.waiting[self.players[member]][1] for member in members)
+                when = joined + max(0, spread - self.window) / self.widen
+        if when is None:
+            self.due_at.pop(key, None)
+        elif self.due_at.get(key) != when:
+            self.due_at[key] = when
+            heapq.heappush(self.due, (when, key))
+
+    # somebody came or went at key, which changes the group of the players up to room_size - 1 places away
+    def schedule_around(self, key):
+        if self.keys:
+            below, above = self.keys.around(key, self.room_size - 1)
+            for neighbour in below + above:
+                self.schedule(neighbour)
+
+    def remove(self, key):
+        self.keys.remove(key)
+        del self.players[key]
+        self.due_at.pop(key, None)
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def __contains__(self, client):
+        return client in self.waiting
+
+
+# the matchmakers the server can be started with, see --matchmaking
+MATCHMAKERS = {"fifo": Matchmaker, "rating": RatedMatchmaker}
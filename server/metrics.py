@@ -0,0 +1,234 @@
+# counters, gauges and histograms the server updates while it runs, exposed in the Prometheus text format on a
+# local HTTP /metrics endpoint. Every metric has its own lock, the threaded server updates them from every handler
+# thread while the HTTP server reads them from another one
+import abc
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper bounds in seconds of the latency histogram buckets, from 10µs to 1s
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0)
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+# what every kind of metric shares: its name, help and labelled children, and rendering itself
+class Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        # name of the label the children are told apart by, e.g. the message type. None for a single value
+        self.label = label
+        self.children = {}
+        self.lock = threading.Lock()
+
+    # the metric for one value of the label, created the first time it is used
+    def labels(self, value):
+        child = self.children.get(value)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(value, self.new_child())
+        return child
+
+    def new_child(self):
+        return type(self)(self.name, self.help)
+
+    # (suffix, labels, value) of every sample of this metric
+    @abc.abstractmethod
+    def samples(self, labels=()):
+        pass
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self.label:
+            with self.lock:
+                children = sorted(self.children.items())
+        else:
+            children = [(None, self)]
+        for value, child in children:
+            labels = ((self.label, value),) if self.label else ()
+            for suffix, sample_labels, sample in child.samples(labels):
+                lines.append(f"{self.name}{suffix}{format_labels(sample_labels)} {format_value(sample)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, label=None):
+        super().__init__(name, help, label)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, labels=()):
+        return [("", labels, self.value)]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, label=None, function=None):
+        super().__init__(name, help, label)
+        self.value = 0
+        # a gauge can also be read from the server state when it is scraped, instead of being kept up to date
+        self.function = function
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, labels=()):
+        value = self.function() if self.function else self.value
+        return [("", labels, value)]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, label)
+        self.buckets = tuple(buckets)
+        # one count per bucket plus the +Inf bucket, not cumulative until rendered
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def new_child(self):
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, labels=()):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+
+        samples = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket
+            samples.append(("_bucket", labels + (("le", format_value(float(bound))),), cumulative))
+        samples.append(("_sum", labels, total))
+        samples.append(("_count", labels, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, label=None):
+        return self.register(Counter(name, help, label))
+
+    def gauge(self, name, help, label=None, function=None):
+        return self.register(Gauge(name, help, label, function))
+
+    def histogram(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, label, buckets))
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+# everything the game server measures
+class ServerMetrics(Registry):
+    def __init__(self):
+        super().__init__()
+        self.connections = self.gauge("game_connections_active", "Connections currently open")
+        self.connections_total = self.counter("game_connections_total", "Connections accepted")
+        self.messages_received = self.counter("game_messages_received_total", "Messages received by type", "type")
+        self.messages_sent = self.counter("game_messages_sent_total", "Messages sent by type", "type")
+        self.bytes_received = self.counter("game_bytes_received_total", "Bytes received from clients")
+        self.bytes_sent = self.counter("game_bytes_sent_total", "Bytes sent to clients")
+        self.guess_seconds = self.histogram("game_guess_seconds", "Time to verify a guess and queue the replies")
+        self.send_seconds = self.histogram("game_send_seconds", "Time to hand a write to the socket")
+        self.rooms_total = self.counter("game_rooms_total", "Rooms created")
+        self.evictions = self.counter("game_slow_consumers_evicted_total",
+                                      "Connections closed because they did not read what was sent to them")
+        self.rate_limited = self.counter("game_rate_limited_total",
+                                         "Times a client (or the accept loop) was held back by a rate limit", "limit")
+        self.sessions_resumed = self.counter("game_sessions_resumed_total",
+                                             "Sessions taken back by a client after losing its connection")
+        self.sessions_expired = self.counter("game_sessions_expired_total",
+                                             "Sessions ended because the client did not come back in time")
+        self.results_recorded = self.counter("game_results_recorded_total", "Finished games queued for the database")
+        self.results_dropped = self.counter("game_results_dropped_total",
+                                            "Finished games not recorded because the database fell behind")
+        self.tls_handshakes = self.counter("game_tls_handshakes_total",
+                                           "TLS handshakes by result: full, resumed or failed", "result")
+        self.reaped = self.counter("game_connections_reaped_total",
+                                   "Connections closed by a deadline: login or idle", "reason")
+        # where the time of a player goes, so a slowdown can be pinned on one part of the server
+        self.phase_seconds = self.histogram("game_phase_seconds",
+                                            "Time spent in each phase: handshake, wait_for_room, verify_guess, send",
+                                            "phase")
+        self.handshake_seconds = self.phase_seconds.labels("handshake")
+        self.wait_for_room_seconds = self.phase_seconds.labels("wait_for_room")
+        self.verify_guess_seconds = self.phase_seconds.labels("verify_guess")
+        self.send_phase_seconds = self.phase_seconds.labels("send")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("UTF-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # scrapes are not worth a line in the server output
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # during a restart (server/restart.py) the new server serves its metrics on the port before the old one lets go
+    allow_reuse_port = True
+
+
+# serve the registry on http://host:port/metrics from a daemon thread, returns the HTTP server
+def serve_metrics(registry, host="127.0.0.1", port=9100):
+    httpd = MetricsServer((host, port), MetricsHandler)
+    httpd.registry = registry
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
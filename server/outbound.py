@@ -0,0 +1,147 @@
+# outbound queues. Whoever sends a message to a client (its own handler, the opponent's handler, a timer) only adds
+# it to the client's queue, the bytes are written by the queue's own writer. So a player that stops reading only
+# stalls its own writer and never the thread of the player who made the guess.
+#
+# high_water/low_water: once more than high_water bytes are waiting, the client's own handler stops reading its
+# requests until the queue is back under low_water, a client can not make us queue replies faster than it reads them.
+# max_backlog: messages from other players can not be held back that way, a client that lets more than max_backlog
+# bytes pile up is a slow consumer and on_evict() is called to get rid of it.
+import asyncio
+import threading
+
+
+class Outbox:
+    # queue of the threaded server, drained by a writer thread per connection
+    def __init__(self, session, transmit, on_evict, high_water=64 * 1024, low_water=16 * 1024,
+                 max_backlog=1024 * 1024):
+        self.session = session
+        # transmit(session, data) writes all of data to the player's socket
+        self.transmit = transmit
+        self.on_evict = on_evict
+        self.high_water = high_water
+        self.low_water = low_water
+        self.max_backlog = max_backlog
+
+        self.chunks = []
+        # bytes queued or being written
+        self.pending = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, data):
+        with self.condition:
+            if self.closed:
+                return
+            self.chunks.append(data)
+            self.pending += len(data)
+            if self.pending <= self.max_backlog:
+                self.condition.notify_all()
+                return
+        self.evict(f"{self.pending} bytes waiting to be sent")
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.chunks and not self.closed:
+                    self.condition.wait()
+                # closed and everything has been sent
+                if not self.chunks:
+                    return
+                # whatever was queued while we were writing goes out in a single write
+                chunks, self.chunks = self.chunks, []
+
+            data = b"".join(chunks)
+            try:
+                self.transmit(self.session, data)
+            except OSError:
+                # the connection is broken, the client's handler finds out on its next read
+                self.close()
+                return
+
+            with self.condition:
+                self.pending -= len(data)
+                if self.pending <= self.low_water:
+                    self.condition.notify_all()
+
+    # called by the client's handler before it reads more requests
+    def wait_writable(self):
+        with self.condition:
+            if self.pending <= self.high_water:
+                return
+            while self.pending > self.low_water and not self.closed:
+                self.condition.wait()
+
+    # no more messages, the writer stops once what is queued has been sent
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    # wait until the writer has stopped
+    def join(self, timeout=None):
+        self.thread.join(timeout)
+
+    def evict(self, reason):
+        with self.condition:
+            # already closed, a write failing now is just the socket going away
+            if self.closed:
+                return
+            self.closed = True
+            self.chunks = []
+            self.condition.notify_all()
+        self.on_evict(self.session, reason)
+
+
+# queue of the async server. Everything queued during one pass of the event loop is joined into a single write,
+# the transport's own buffer and watermarks do the rest
+class AsyncOutbox:
+    def __init__(self, session, transmit, on_evict, high_water=64 * 1024, low_water=16 * 1024,
+                 max_backlog=1024 * 1024):
+        self.session = session
+        # the StreamWriter of the connection
+        self.client = session.client
+        self.transmit = transmit
+        self.on_evict = on_evict
+        self.max_backlog = max_backlog
+        # drain() waits while more than high_water bytes are buffered, until they are under low_water
+        self.client.transport.set_write_buffer_limits(high_water, low_water)
+
+        self.chunks = []
+        self.closed = False
+
+    def put(self, data):
+        if self.closed:
+            return
+        if not self.chunks:
+            asyncio.get_running_loop().call_soon(self.flush)
+        self.chunks.append(data)
+
+    def flush(self):
+        if not self.chunks:
+            return
+        data = b"".join(self.chunks)
+        self.chunks = []
+        # the connection is gone, there is nobody left to write to
+        if self.client.is_closing():
+            return
+        self.transmit(self.session, data)
+
+        backlog = self.client.transport.get_write_buffer_size()
+        if backlog > self.max_backlog:
+            self.closed = True
+            self.on_evict(self.session, f"{backlog} bytes waiting to be sent")
+
+    # called by the client's handler before it reads more requests
+    async def wait_writable(self):
+        self.flush()
+        await self.client.drain()
+
+    # write what is queued now, nothing is accepted afterwards
+    def close(self):
+        self.flush()
+        self.closed = True
+
+    def join(self, timeout=None):
+        pass
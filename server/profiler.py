@@ -0,0 +1,167 @@
+# sampling profiler: a thread looks at the stack of every other thread of the server (every handler thread of the
+# threaded engine, the event loop of the async one) every interval and counts how often each stack is seen. The counts
+# are written out as collapsed stacks, one "outermost;...;innermost count" line per stack, which flamegraph.pl,
+# speedscope or inferno turn into a flame graph. Start it with --profile, or at any time with
+#
+#     kill -USR1 <pid of the server>
+#
+# and send SIGUSR1 again to stop and write the file. The threaded server has thousands of threads that wait for their
+# client or for something to send, a thread whose innermost function is one of the IDLE ones is left out unless idle
+# is True (for a wall clock profile). A thread waiting for a lock is counted, in the function that takes the lock.
+import collections
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+
+log = logging.getLogger("server")
+
+# functions a thread waits for something to do in, how they are named in the stacks
+IDLE = frozenset((
+    "threading.py:Condition.wait",
+    "framing.py:FrameReader.recv_into",
+    "selectors.py:EpollSelector.select",
+    "selectors.py:_PollLikeSelector.select",
+    "selectors.py:KqueueSelector.select",
+    "selectors.py:SelectSelector.select",
+    "socket.py:socket.accept",
+    "restart.py:receive_player",
+    "main.py:Server.run_reaper",
+    "main.py:Server.run_lobby",
+))
+
+
+class SamplingProfiler:
+    # a sample may take at most this part of the time. Looking at thousands of threads takes milliseconds, they are
+    # sampled less often than interval instead of slowing the server down
+    max_overhead = 0.05
+
+    # every dump is written to f"{prefix}.{pid}.{n}.folded"
+    def __init__(self, prefix="profile", interval=0.01, idle=False):
+        self.prefix = prefix
+        self.interval = interval
+        self.idle = idle
+        # how often each stack was seen, by the tuple of its function names (outermost first)
+        self.stacks = collections.Counter()
+        self.samples = 0
+        # thread samples left out because the thread was idle, and the seconds spent sampling
+        self.skipped = 0
+        self.spent = 0
+        # the name of each code object, made once
+        self.names = {}
+        # (frame, instruction, stack) of every thread at the last sample. A thread that is still blocked where it was
+        # has the same frame at the same instruction, its stack is not walked again
+        self.last = {}
+        self.dumps = itertools.count(1)
+        self.thread = None
+        self.stopping = threading.Event()
+        # start() and stop() come from a signal handler thread, the server closing or a benchmark
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.stacks.clear()
+            self.samples = self.skipped = self.spent = 0
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+            self.thread.start()
+        log.info(f"Profiling every {self.interval * 1000:g} ms")
+
+    # stop sampling and write what was collected, returns the file written (None if we were not running)
+    def stop(self):
+        with self.lock:
+            if self.thread is None:
+                return None
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+            self.last = {}
+            return self.dump()
+
+    # SIGUSR1: start, or stop and write the file
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def run(self):
+        own = threading.get_ident()
+        wait = self.interval
+        while not self.stopping.wait(wait):
+            started = time.perf_counter()
+            self.sample(own)
+            spent = time.perf_counter() - started
+            self.spent += spent
+            wait = max(self.interval, spent / self.max_overhead)
+
+    def sample(self, own):
+        last = {}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            instruction = frame.f_lasti
+            previous = self.last.get(ident)
+            if previous is not None and previous[0] is frame and previous[1] == instruction:
+                stack = previous[2]
+                last[ident] = previous
+            else:
+                stack = self.walk(frame)
+                last[ident] = (frame, instruction, stack)
+            if not self.idle and stack[-1] in IDLE:
+                self.skipped += 1
+                continue
+            self.stacks[stack] += 1
+        self.last = last
+        self.samples += 1
+
+    def walk(self, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            name = self.names.get(code)
+            if name is None:
+                name = self.names[code] = self.name(code)
+            names.append(name)
+            frame = frame.f_back
+        names.reverse()
+        return tuple(names)
+
+    # file:function, so every line of a function is counted together
+    def name(self, code):
+        return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+    # (function, samples it was running in, samples it was on the stack in) of the busiest functions
+    def top(self, limit=10):
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                total[name] += count
+        return [(name, count, total[name]) for name, count in own.most_common(limit)]
+
+    def dump(self):
+        path = f"{self.prefix}.{os.getpid()}.{next(self.dumps)}.folded"
+        try:
+            with open(path, "w") as out:
+                for stack, count in self.stacks.most_common():
+                    out.write(f"{';'.join(stack)} {count}\n")
+        except OSError as e:
+            log.error(f"Could not write the profile to {path}: {e}")
+            return None
+        counted = sum(self.stacks.values())
+        log.info(f"Wrote {self.samples} samples ({self.spent / max(self.samples, 1) * 1000:.2f} ms each) of "
+                 f"{len(self.stacks)} stacks to {path}, {counted} busy and {self.skipped} idle threads seen. "
+                 f"Busiest functions:")
+        for name, count, total in self.top(5):
+            log.info(f"  {name:<50} {count:>8} self {total:>8} total")
+        return path
@@ -0,0 +1,33 @@
+# token buckets. A bucket holds up to burst tokens and gains rate tokens per second, every message (or byte, or
+# accepted connection) takes some. A client that goes over its limit is not disconnected, it is simply read more
+# slowly: take() returns how long to wait before reading on, and while we wait the client's requests pile up in
+# the kernel until TCP makes it wait too
+import time
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    # take amount tokens, returns the seconds to wait until the bucket is out of debt (0 if it had enough). More than
+    # is there can be taken, like a batch of guesses, the wait is then as long as it takes to earn them back
+    def take(self, amount=1):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+# a bucket, or None if rate is 0 (no limit)
+def new_bucket(rate, burst):
+    if not rate:
+        return None
+    return TokenBucket(rate, burst or rate)
@@ -0,0 +1,46 @@
+import threading
+
+# every nickname starts here
+INITIAL_RATING = 1500
+# how far one game can move a rating
+K_FACTOR = 32
+
+
+# the chance that a player rated rating beats one rated opponent
+def expected_score(rating, opponent):
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+
+# Elo rating of every nickname the server has seen play. The winner of a room beat everybody else in it, each of
+# those counts as one game between the two. Kept in memory, a server starting up rates everybody INITIAL_RATING
+class Ratings:
+    def __init__(self, initial=INITIAL_RATING, k_factor=K_FACTOR):
+        self.initial = initial
+        self.k_factor = k_factor
+        self.ratings = {}
+        # two rooms can end at the same moment in the threaded server
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        return self.ratings.get(name, self.initial)
+
+    # a rating from elsewhere (the server we replace), only taken if we do not know the player
+    def learn(self, name, rating):
+        with self.lock:
+            self.ratings.setdefault(name, rating)
+
+    # winner beat every other name in names, the new ratings are computed from the ratings before the game
+    def record(self, winner, names):
+        with self.lock:
+            before = {name: self.ratings.get(name, self.initial) for name in names}
+            won = 0
+            for name in names:
+                if name == winner:
+                    continue
+                change = self.k_factor * (1 - expected_score(before[winner], before[name]))
+                self.ratings[name] = before[name] - change
+                won += change
+            self.ratings[winner] = before[winner] + won
+
+    def __len__(self):
+        return len(self.ratings)
@@ -0,0 +1,44 @@
+# deadlines of the open connections: a client has login_timeout seconds to log in, and once it has, a client that
+# stays quiet for the heartbeat interval it agreed to gets a PING and one that stays quiet for idle_timeout is
+# disconnected. So a client that never logs in, or whose connection is half open (the other end went away without
+# closing it), does not hold a thread, a socket and a session forever.
+#
+# The next time to look at each session is kept in a heap, finding the ones that are due costs O(log n) each
+# however many connections are open, and nothing when none is. An entry is never moved: the server only notes when it
+# last heard from a client (one attribute, no lock) and when the old deadline comes, it decides what to do and pushes
+# the session again with its next deadline. A session that is gone is dropped when its entry comes up
+import heapq
+import threading
+
+# the longest the reaper sleeps, a deadline is met to within this many seconds
+MAX_WAIT = 1
+
+
+class Reaper:
+    def __init__(self):
+        # (when, session id, session), the id keeps two sessions due at the same time from being compared
+        self.heap = []
+        # the handler threads schedule new sessions while the reaper's thread takes the due ones
+        self.lock = threading.Lock()
+
+    def schedule(self, session, when):
+        with self.lock:
+            heapq.heappush(self.heap, (when, session.id, session))
+
+    # the sessions whose deadline has come by now, earliest first. They are not scheduled anymore
+    def due(self, now):
+        sessions = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                sessions.append(heapq.heappop(self.heap)[2])
+        return sessions
+
+    # seconds until the next deadline, at most MAX_WAIT so a new session is looked at in time
+    def wait(self, now):
+        with self.lock:
+            if not self.heap:
+                return MAX_WAIT
+            return min(MAX_WAIT, max(0, self.heap[0][0] - now))
+
+    def __len__(self):
+        return len(self.heap)
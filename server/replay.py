@@ -0,0 +1,340 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# play a capture (server/capture.py) back into a fresh server: one connection for every captured connection, each
+# sending what its client sent. The server is started with the captured settings and seed, so every room hides the
+# same numbers and the captured guesses play out the same way. Run it with:
+#
+#     python3 server/replay.py capture.log                # at the speed it was captured
+#     python3 server/replay.py capture.log --speed 0      # as fast as the server answers
+#
+# A message is never sent before the server's replies it followed in the capture have arrived, to its own connection
+# and to the other players of its room, so the guesses of a room reach the server in the captured order even on the
+# threaded engine. The first message of each connection (the login) waits for the logins before it, so players are
+# paired into the same rooms even when the replay runs faster than the capture. Every connection's replies are
+# compared with the captured ones
+import argparse
+import asyncio
+import signal
+import struct
+import time
+from framing import FrameReader
+from protocols import Protocols, CODECS, DEFAULT_CODEC, find_codec
+from server.capture import read_capture, OPENED, RECEIVED, SENT, CLOSED, PAIRED, SESSION_IDS
+import launcher
+
+
+# the captured settings a server is started with, by the flag of server/main.py
+FLAGS = {
+    "seed": "--seed",
+    "room_size": "--room-size",
+    "lower_bound": "--lower-bound",
+    "upper_bound": "--upper-bound",
+    "hidden_numbers": "--hidden-numbers",
+    "start_delay": "--start-delay",
+    "resume_grace": "--resume-grace",
+    "protocol_version": "--protocol-version",
+    "max_batch": "--max-batch",
+    "login_timeout": "--login-timeout",
+    "idle_timeout": "--idle-timeout",
+    "heartbeat": "--heartbeat-interval",
+    "matchmaking": "--matchmaking",
+}
+# settings in seconds, they run faster with the replay. As fast as possible turns them off
+TIMINGS = ("start_delay", "login_timeout", "idle_timeout", "heartbeat")
+# messages sent by a timer, when they come depends on how fast the replay goes. They are left out on both sides
+TIMED = (Protocols.Response.PING, Protocols.Response.START)
+
+
+# the server's messages to one connection, split and parsed like the client does: JSON until the HELLO (or
+# WIRE_FORMAT) answer, the format agreed in it after that
+class MessageStream:
+    def __init__(self):
+        self.frames = FrameReader()
+        self.codec = DEFAULT_CODEC
+
+    # the types of the messages that are complete now
+    def feed(self, data):
+        self.frames.feed(data)
+        types = []
+        while True:
+            codec = self.codec
+            frame = self.frames.next_frame(codec)
+            if frame is None:
+                return types
+            message = codec.parse(frame)
+            r_type = message.get("type")
+            if r_type == Protocols.Response.HELLO:
+                data = message.get("data")
+                self.codec = find_codec(data["format"], data["compression"]) or DEFAULT_CODEC
+            elif r_type == Protocols.Response.WIRE_FORMAT:
+                self.codec = CODECS[message.get("data")]
+            types.append(r_type)
+
+
+# one captured connection, and how its replay goes
+class Connection:
+    def __init__(self, session_id, opened):
+        self.id = session_id
+        self.opened = opened
+        self.closed = None
+        # the other players of its room
+        self.mates = ()
+        # (seconds, message, gates): a gate (connection, count) holds the message back until that connection has
+        # received count messages. The first gate is the connection's own
+        self.frames = []
+        # the gates of closing the connection
+        self.closing = None
+        # the gates of the last message, until the server answered it
+        self.unanswered = None
+        # the gates of the first message, the login, and how many messages the client had once it was logged in
+        self.login = None
+        self.logged_in = None
+        # the login before this one, with the count it had by then
+        self.after = None
+        # the types of the messages the server sent it, but for the TIMED ones
+        self.expected = []
+        self.stream = MessageStream()
+
+        # the replay
+        self.received = []
+        self.changed = None
+        self.done = False
+        # (count, when) while we wait for the reply to the last message we sent
+        self.awaiting = None
+
+    # what this connection and the rest of its room have been sent by now in the capture
+    def gates(self):
+        return [(self, len(self.expected))] + [(mate, len(mate.expected)) for mate in self.mates]
+
+
+def load(path):
+    settings, records = read_capture(path)
+    connections = {}
+    last_login = None
+    # the players in the order they joined the lobby, which is the order the rooms list them in
+    joined = []
+    duration = 0
+    for when, session_id, kind, data in records:
+        duration = when
+        if kind == OPENED:
+            connections[session_id] = Connection(session_id, when)
+            continue
+        if kind == PAIRED:
+            room = [connections[player] for player in struct.unpack(SESSION_IDS.format(len(data) // 4), data)
+                    if player in connections]
+            for connection in room:
+                connection.mates = tuple(mate for mate in room if mate is not connection)
+            joined += room
+            continue
+        connection = connections.get(session_id)
+        if connection is None:
+            continue
+        if kind == SENT:
+            # two players of a room guessing at the same time: which guess the server took first shows in the order
+            # of the answers, so the room's gates are the ones at the time of the answer
+            if connection.unanswered is not None:
+                connection.unanswered[1:] = connection.gates()[1:]
+                connection.unanswered = None
+            for r_type in connection.stream.feed(data):
+                if r_type not in TIMED:
+                    connection.expected.append(r_type)
+                # the server puts the player in the lobby right after this answer
+                if r_type in (Protocols.Response.HELLO, Protocols.Response.WIRE_FORMAT) and connection.login:
+                    connection.logged_in = len(connection.expected)
+        elif kind == RECEIVED:
+            gates = connection.gates()
+            if not connection.frames:
+                if last_login is not None:
+                    connection.after = (last_login, len(last_login.expected))
+                last_login = connection
+                connection.login = gates
+                connection.unanswered = None
+            else:
+                connection.unanswered = gates
+            connection.frames.append((when, data, gates))
+        elif kind == CLOSED:
+            connection.closed = when
+            connection.closing = connection.gates()
+            connection.unanswered = None
+
+    # a player logs in once the one who joined the lobby before them is logged in, so the rooms are made of the same
+    # players. A player who was never paired waits for the login before their own
+    previous = None
+    for connection in joined:
+        if connection.login is not None:
+            if previous is not None:
+                connection.login.append((previous, previous.logged_in or previous.login[0][1]))
+            previous = connection
+    paired = set(joined)
+    for connection in connections.values():
+        if connection.login is not None and connection.after and connection not in paired:
+            connection.login.append(connection.after)
+    return settings, list(connections.values()), duration
+
+
+class Tally:
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.stalls = 0
+        self.refused = 0
+        # seconds from sending a message to the first message of its reply
+        self.latencies = []
+
+
+# sleep until the captured time, scaled by speed. 0 is as fast as possible, no sleeping at all
+async def wait_until(began, when, speed):
+    if speed:
+        delay = began + when / speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# wait until every gate is open, or for stall_timeout seconds if the replay went a different way than the capture
+async def pass_gates(gates, stall_timeout, tally):
+    for connection, count in gates:
+        deadline = time.perf_counter() + stall_timeout
+        while len(connection.received) < count and not connection.done:
+            connection.changed.clear()
+            try:
+                await asyncio.wait_for(connection.changed.wait(), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                tally.stalls += 1
+                return
+
+
+async def receive(connection, reader, tally):
+    stream = MessageStream()
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            connection.received += [r_type for r_type in stream.feed(data) if r_type not in TIMED]
+            if connection.awaiting and len(connection.received) >= connection.awaiting[0]:
+                tally.latencies.append(time.perf_counter() - connection.awaiting[1])
+                connection.awaiting = None
+            connection.changed.set()
+    except OSError:
+        pass
+    finally:
+        connection.done = True
+        connection.changed.set()
+
+
+async def replay_connection(connection, host, port, began, speed, stall_timeout, connect_slots, tally):
+    await wait_until(began, connection.opened, speed)
+    try:
+        # a full listen queue drops the connection and the client only tries again a second later, which would hold
+        # up every login after it
+        async with connect_slots:
+            reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        tally.refused += 1
+        connection.done = True
+        connection.changed.set()
+        return
+    receiving = asyncio.get_running_loop().create_task(receive(connection, reader, tally))
+    try:
+        for index, (when, data, gates) in enumerate(connection.frames):
+            await wait_until(began, when, speed)
+            await pass_gates(gates, stall_timeout, tally)
+            # the server closed the connection
+            if connection.done:
+                break
+            writer.write(data)
+            tally.frames += 1
+            tally.bytes += len(data)
+            # the messages the server sent in answer, before the next message (or the end) of the capture
+            answered = connection.frames[index + 1][2][0][1] if index + 1 < len(connection.frames) \
+                else len(connection.expected)
+            if answered > gates[0][1]:
+                connection.awaiting = (gates[0][1] + 1, time.perf_counter())
+            await writer.drain()
+
+        # everything the server sent arrives before the connection is closed
+        await pass_gates(connection.closing or [(connection, len(connection.expected))], stall_timeout, tally)
+        if connection.closed is not None and not connection.done:
+            await wait_until(began, connection.closed, speed)
+    except OSError:
+        pass
+    finally:
+        writer.close()
+        await asyncio.wait([receiving], timeout=stall_timeout)
+
+
+async def replay(connections, host, port, speed, stall_timeout, connect_concurrency=256):
+    tally = Tally()
+    for connection in connections:
+        connection.changed = asyncio.Event()
+    # connections are opened in the captured order, the semaphore lets them in first come first served
+    connect_slots = asyncio.Semaphore(connect_concurrency)
+    began = time.perf_counter()
+    await asyncio.gather(*(replay_connection(connection, host, port, began, speed, stall_timeout, connect_slots,
+                                             tally)
+                           for connection in connections))
+    return tally, time.perf_counter() - began
+
+
+# a fresh server with the captured settings, without rate limits so the replay is only held back by the server
+def start_server(settings, engine, port, speed):
+    flags = ["--engine", engine, "--accept-rate", "0", "--message-rate", "0", "--byte-rate", "0", "--log-level",
+             "warning"]
+    for name, flag in FLAGS.items():
+        value = settings.get(name)
+        if value is None:
+            continue
+        if name in TIMINGS:
+            value = value / speed if speed else 0
+        flags += [flag, str(value)]
+    return launcher.start_server(port, flags)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play a captured traffic log back into a fresh server")
+    parser.add_argument("capture")
+    parser.add_argument("--speed", type=float, default=1, help="1 replays in real time, 0 as fast as possible")
+    parser.add_argument("--engine", choices=["threaded", "async"], default="threaded")
+    # replay into a server that is already running instead of starting one, it should run with the captured --seed
+    parser.add_argument("--server", default=None, help="host:port of a running server")
+    parser.add_argument("--stall-timeout", type=float, default=5,
+                        help="seconds to wait for a reply the capture had before sending anyway")
+    parser.add_argument("--connect-concurrency", type=int, default=256,
+                        help="connections being opened at the same time")
+    args = parser.parse_args()
+
+    settings, connections, duration = load(args.capture)
+    print(f"{len(connections):,} connections, {sum(len(c.frames) for c in connections):,} messages in, "
+          f"{sum(len(c.expected) for c in connections):,} out over {duration:.1f}s, seed {settings.get('seed')}")
+
+    server = None
+    if args.server:
+        host, port = args.server.rsplit(":", 1)
+        port = int(port)
+    else:
+        host, port = "127.0.0.1", launcher.free_port()
+        server = start_server(settings, args.engine, port, args.speed)
+    try:
+        cpu = launcher.cpu_seconds(server.pid) if server else None
+        tally, elapsed = asyncio.run(replay(connections, host, port, args.speed, args.stall_timeout,
+                                              args.connect_concurrency))
+        if server:
+            cpu = launcher.cpu_seconds(server.pid) - cpu
+    finally:
+        if server:
+            # SIGTERM would let the games left end first
+            server.send_signal(signal.SIGINT)
+            server.wait()
+
+    matched = sum(connection.received == connection.expected for connection in connections)
+    print(f"replayed in {elapsed:.2f}s ({duration / elapsed if elapsed else 0:.1f}x), "
+          f"{tally.frames / elapsed if elapsed else 0:,.0f} messages/s, {tally.bytes:,} bytes sent")
+    print(f"replies p50 {launcher.percentile(tally.latencies, 0.5) * 1000:.2f} ms, "
+          f"p99 {launcher.percentile(tally.latencies, 0.99) * 1000:.2f} ms" +
+          (f", server CPU {cpu:.2f}s" if cpu is not None else ""))
+    print(f"{matched:,} of {len(connections):,} connections got the captured replies, {tally.stalls:,} stalls, "
+          f"{tally.refused:,} refused")
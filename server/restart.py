@@ -0,0 +1,121 @@
+# hot restart: the running server starts a new copy of itself (same interpreter, same arguments) that inherits the
+# listening socket, so no connection is ever refused. Once the new server accepts connections the old one stops
+# accepting and drains: the games it runs are played to the end, and the players still waiting for a room are handed
+# to the new server with their socket, over a Unix socket like the workers of server/cluster.py do. Start one with:
+#
+#     kill -USR2 <pid of the server>
+import json
+import os
+import select
+import socket
+import subprocess
+import sys
+
+# where the new server finds what it inherited, file descriptor numbers
+LISTEN_FD = "GAME_LISTEN_FD"
+HANDOFF_FD = "GAME_HANDOFF_FD"
+READY_FD = "GAME_READY_FD"
+# the new server has this long to start accepting, or the old one keeps serving
+START_TIMEOUT = 30
+# the most a player's handoff may wait for the new server to take it, the player is disconnected instead
+HANDOFF_TIMEOUT = 5
+# biggest player_info() once encoded, a nickname is at most MAX_NAME_LENGTH printable characters. It is also what
+# the workers of server/cluster.py send the broker
+PLAYER_INFO_SIZE = 256
+
+
+# the messages between two processes are JSON, written as UTF-8 so a name takes at most 4 bytes per character
+def encode(value):
+    return json.dumps(value, ensure_ascii=False).encode("UTF-8")
+
+
+# raises ValueError for a message (from recvmsg() with flags) that was cut off or can not be read
+def decode(message, flags):
+    if flags & (socket.MSG_TRUNC | socket.MSG_CTRUNC):
+        raise ValueError(f"message longer than {len(message)} bytes")
+    return json.loads(message.decode("UTF-8"))
+
+
+def inherited(name):
+    fd = os.environ.pop(name, None)
+    return None if fd is None else int(fd)
+
+
+# the listening socket of the server we replace, None if we were started the normal way
+def inherited_listener():
+    fd = inherited(LISTEN_FD)
+    return None if fd is None else socket.socket(fileno=fd)
+
+
+# the socket the server we replace hands its waiting players over, None if there is none
+def inherited_channel():
+    fd = inherited(HANDOFF_FD)
+    return None if fd is None else socket.socket(fileno=fd)
+
+
+# tell the server we replace that we accept connections now
+def announce_ready():
+    fd = inherited(READY_FD)
+    if fd is not None:
+        os.write(fd, b"1")
+        os.close(fd)
+
+
+# a player and their socket, from one server to the other
+def send_player(channel, info, sock):
+    socket.send_fds(channel, [encode(info)], [sock.fileno()])
+
+
+# returns (socket, what we know about the player), None once the other server closed the channel. A player whose
+# message can not be read is disconnected and ValueError raised, the next one can still be received
+def receive_player(channel):
+    message, fds, flags, _ = socket.recv_fds(channel, PLAYER_INFO_SIZE, 1)
+    if not fds:
+        return None
+    sock = socket.socket(fileno=fds[0])
+    try:
+        info = decode(message, flags)
+        if not isinstance(info, dict) or "name" not in info:
+            raise ValueError("not a player")
+    except ValueError:
+        sock.close()
+        raise
+    return sock, info
+
+
+# the new server, seen from the one it replaces
+class Successor:
+    def __init__(self, listener):
+        # SOCK_SEQPACKET keeps the message boundaries like the cluster's datagrams, and the new server also sees the end
+        # of the handoff when our end is closed
+        self.channel, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        # a new server that stopped taking players must not hold up our drain
+        self.channel.settimeout(HANDOFF_TIMEOUT)
+        self.ready, announce = os.pipe()
+        fds = {LISTEN_FD: listener.fileno(), HANDOFF_FD: theirs.fileno(), READY_FD: announce}
+        environment = dict(os.environ, **{name: str(fd) for name, fd in fds.items()})
+        self.process = subprocess.Popen([sys.executable] + sys.orig_argv[1:], env=environment,
+                                        pass_fds=tuple(fds.values()))
+        theirs.close()
+        os.close(announce)
+
+    # wait until the new server accepts connections, False (and the new server is stopped) if it exited or took
+    # longer than timeout
+    def wait_ready(self, timeout=START_TIMEOUT):
+        # poll() because a busy server's descriptor numbers are beyond what select() takes
+        poller = select.poll()
+        poller.register(self.ready, select.POLLIN)
+        ready = bool(poller.poll(timeout * 1000)) and os.read(self.ready, 1) == b"1"
+        os.close(self.ready)
+        if not ready:
+            self.process.kill()
+            self.process.wait()
+            self.channel.close()
+        return ready
+
+    def send_player(self, info, sock):
+        send_player(self.channel, info, sock)
+
+    # no more players, the new server stops listening for them
+    def close(self):
+        self.channel.close()
@@ -0,0 +1,169 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# finished games are kept in a SQLite database. The game never waits for the disk: record() only appends the result to
+# a list in memory, a writer thread takes whatever piled up and writes it in one transaction. The totals of every
+# player are updated in the same transaction, so the leaderboard is read from an index instead of adding up the games
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+from collections import namedtuple
+
+log = logging.getLogger("server")
+
+# one finished room, players holds a PlayerResult for everybody still in the room when the last number was found
+GameResult = namedtuple("GameResult", "finished_at duration lower_bound upper_bound numbers winner players")
+PlayerResult = namedtuple("PlayerResult", "name guesses found won")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    finished_at REAL NOT NULL,
+    duration REAL NOT NULL,
+    lower_bound INTEGER NOT NULL,
+    upper_bound INTEGER NOT NULL,
+    numbers TEXT NOT NULL,
+    winner TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS game_players (
+    game_id INTEGER NOT NULL REFERENCES games (id),
+    name TEXT NOT NULL,
+    guesses INTEGER NOT NULL,
+    found INTEGER NOT NULL,
+    won INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS players (
+    name TEXT PRIMARY KEY,
+    games INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    guesses INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS players_by_wins ON players (wins DESC, guesses);
+CREATE INDEX IF NOT EXISTS game_players_by_name ON game_players (name);
+CREATE INDEX IF NOT EXISTS wins_by_guesses ON game_players (won, guesses);
+"""
+
+INSERT_GAME = ("INSERT INTO games (finished_at, duration, lower_bound, upper_bound, numbers, winner) "
+               "VALUES (?, ?, ?, ?, ?, ?)")
+INSERT_PLAYER = "INSERT INTO game_players (game_id, name, guesses, found, won) VALUES (?, ?, ?, ?, ?)"
+UPDATE_TOTALS = ("INSERT INTO players (name, games, wins, guesses) VALUES (?, 1, ?, ?) "
+                 "ON CONFLICT (name) DO UPDATE SET games = games + 1, wins = wins + excluded.wins, "
+                 "guesses = guesses + excluded.guesses")
+
+
+# open the database and create the tables, check_same_thread is off because the writer thread is not the one that
+# opened it. timeout: with --workers every worker writes to the same file and waits for the others' transactions
+def connect(path):
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    # readers do not block the writer and a commit does not wait for the disk
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class ResultStore:
+    def __init__(self, path, batch_size=1000, flush_interval=1.0, max_pending=100_000):
+        self.path = path
+        # the writer wakes up when batch_size results are waiting, or flush_interval seconds after the last write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # if the disk can not keep up, results beyond this are dropped instead of growing the list forever
+        self.max_pending = max_pending
+
+        self.pending = []
+        self.closed = False
+        self.condition = threading.Condition()
+        self.connection = connect(path)
+        # the leaderboard queries get their own connection, they can read while the writer writes
+        self.reader = connect(path)
+        self.reader_lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.pending)
+
+    # queue a GameResult, returns False if it was dropped
+    def record(self, result):
+        with self.condition:
+            if self.closed or len(self.pending) >= self.max_pending:
+                return False
+            self.pending.append(result)
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify()
+        return True
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.closed and len(self.pending) < self.batch_size:
+                    self.condition.wait(self.flush_interval)
+                batch, self.pending = self.pending, []
+                closed = self.closed
+
+            if batch:
+                self.write(batch)
+            # nothing is queued after close(), so this was the last batch
+            if closed:
+                return
+
+    def write(self, batch):
+        players = []
+        totals = []
+        try:
+            with self.connection:
+                for game in batch:
+                    cursor = self.connection.execute(INSERT_GAME, (
+                        game.finished_at, game.duration, game.lower_bound, game.upper_bound,
+                        json.dumps(list(game.numbers)), game.winner))
+                    for player in game.players:
+                        players.append((cursor.lastrowid, player.name, player.guesses, player.found, player.won))
+                        totals.append((player.name, int(player.won), player.guesses))
+                self.connection.executemany(INSERT_PLAYER, players)
+                self.connection.executemany(UPDATE_TOTALS, totals)
+        except sqlite3.Error as e:
+            log.error(f"Could not write {len(batch)} game results: {e}")
+
+    # the players with the most wins, fewer guesses first on a tie: (name, wins, games, guesses)
+    def top_players(self, limit=10):
+        with self.reader_lock:
+            return self.reader.execute(
+                "SELECT name, wins, games, guesses FROM players ORDER BY wins DESC, guesses LIMIT ?",
+                (limit,)).fetchall()
+
+    # the games won with the fewest guesses: (name, guesses, game id)
+    def best_games(self, limit=10):
+        with self.reader_lock:
+            return self.reader.execute(
+                "SELECT name, guesses, game_id FROM game_players WHERE won = 1 ORDER BY guesses LIMIT ?",
+                (limit,)).fetchall()
+
+    # write everything that is queued and close the database
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.connection.close()
+        self.reader.close()
+
+
+# print the leaderboard of a results database
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Leaderboard of a results database")
+    parser.add_argument("database")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    store = ResultStore(args.database)
+    print(f"{'player':<20} {'wins':>8} {'games':>8} {'guesses':>8}")
+    for name, wins, games, guesses in store.top_players(args.top):
+        print(f"{name:<20} {wins:>8} {games:>8} {guesses:>8}")
+    store.close()
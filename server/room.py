@@ -1,45 +1,173 @@
+import bisect
 import random
-from enum import Enum
+import threading
+import time
 
-class GuessResult(Enum):
+# the bounds travel as signed 64 bit integers in the binary wire format
+MIN_BOUND = -2 ** 63
+MAX_BOUND = 2 ** 63 - 1
+# every hidden number is sent to every player as its own message when the game starts, and found one by one
+MAX_HIDDEN_NUMBERS = 16
+
+# in the threaded server the players of a room guess from different threads. Rooms share a fixed set of locks
+# instead of holding one each, two rooms rarely need theirs at the same moment
+ROOM_LOCKS = tuple(threading.Lock() for _ in range(64))
+
+
+# results of a guess, plain ints so rooms and batches of results stay small and need no conversion to be sent
+class GuessResult:
     CORRECT = 0
     TOO_LOW = 1
     TOO_HIGH = 2
     GAME_OVER = 3
 
-class Room:
-    def __init__(self, client1, client2):
-        self.game_over = False
-        self.lower_bound = 0
-        self.upper_bound = 500
-        self.client1 = client1
-        self.client2 = client2
-        self.correct_number = self.generate_number()
 
-    # generate random integer between given values, helper method so we make it static
-    def generate_number(self):
-        return random.randint(self.lower_bound, self.upper_bound)
+# raises ValueError if rooms can not be created with these settings
+def validate_settings(room_size=2, lower_bound=0, upper_bound=500, hidden_numbers=1):
+    if room_size < 2:
+        raise ValueError(f"a room needs at least 2 players, not {room_size}")
+    if not MIN_BOUND <= lower_bound < upper_bound <= MAX_BOUND:
+        raise ValueError(f"bounds must be 64 bit integers with lower < upper, not {lower_bound}..{upper_bound}")
+    if not 1 <= hidden_numbers <= MAX_HIDDEN_NUMBERS:
+        raise ValueError(f"a room hides 1 to {MAX_HIDDEN_NUMBERS} numbers, not {hidden_numbers}")
+    if hidden_numbers > upper_bound - lower_bound + 1:
+        raise ValueError(f"can not hide {hidden_numbers} numbers between {lower_bound} and {upper_bound}")
 
-    def verify_guess(self, guess):
-        # if the game is over, there should be no guess submissions
-        if self.game_over:
-            return GuessResult.GAME_OVER
+
+class Room:
+    __slots__ = ("players", "lower_bound", "upper_bound", "correct_numbers", "found", "scores", "leader",
+                 "finisher", "game_over", "lock", "started", "spectators", "audience")
+
+    # rng is the random.Random the numbers are drawn from, a seeded one makes the room repeatable (see --seed). None
+    # draws from the random module
+    def __init__(self, players, lower_bound=0, upper_bound=500, hidden_numbers=1, rng=None):
+        # the sessions of the players, the one that waited longest first
+        self.players = players
+        self.game_over = False
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+        # every number to find, sorted so a guess is a binary search
+        self.correct_numbers = tuple(sorted(self.generate_numbers(hidden_numbers, rng or random)))
+        # bit i is set once correct_numbers[i] has been found
+        self.found = 0
+        # how many numbers each player found (created with the first one), and the player who found the most first
+        self.scores = None
+        self.leader = None
+        # the player who found the last number and ended the game
+        self.finisher = None
+        self.lock = ROOM_LOCKS[id(self) // 64 % len(ROOM_LOCKS)]
+        # when the players were paired, the games duration includes the countdown
+        self.started = time.monotonic()
+        # the sessions watching the game (a dict used as an ordered set, created with the first one), and the same
+        # sessions as a tuple for broadcast(), built again only after somebody started or stopped watching
+        self.spectators = None
+        self.audience = ()
+
+    # the room has not been closed, one of its players is still in it (see Server.leave_room)
+    def is_open(self):
+        return any(player.room is self for player in self.players)
+
+    # the first hidden number, the whole answer in a room with one number
+    @property
+    def correct_number(self):
+        return self.correct_numbers[0]
+
+    # generate distinct random integers between the bounds, the range can be far too big to sample() from
+    def generate_numbers(self, count, rng=random):
+        numbers = []
+        seen = set()
+        while len(numbers) < count:
+            number = rng.randint(self.lower_bound, self.upper_bound)
+            if number not in seen:
+                seen.add(number)
+                numbers.append(number)
+        return numbers
+
+    # player is the session that made the guess, it is credited with the number if the guess is correct
+    def verify_guess(self, guess, player=None):
+        with self.lock:
+            # if the game is over, there should be no guess submissions
+            if self.game_over:
+                return GuessResult.GAME_OVER
+            return self.check(guess, player)
+
+    def check(self, guess, player):
+        numbers = self.correct_numbers
+        index = bisect.bisect_left(numbers, guess)
 
         # verify if the clients guess is correct, too low/high.
-        if self.correct_number == guess:
-            self.game_over = True
+        if index < len(numbers) and numbers[index] == guess and not self.found >> index & 1:
+            self.found |= 1 << index
+            self.score(player)
+            if self.found == (1 << len(numbers)) - 1:
+                self.game_over = True
+                self.finisher = player
             return GuessResult.CORRECT
 
-        if self.correct_number > guess:
-            return GuessResult.TOO_LOW
-
-        return GuessResult.TOO_HIGH
-
-
-
-
-
-
-
-
-
+        # with several numbers the hint is about the smallest one nobody has found yet (the lowest bit not set in
+        # found), so a binary search still finds them all, one after the other
+        smallest = numbers[(~self.found & (self.found + 1)).bit_length() - 1]
+        return GuessResult.TOO_LOW if guess < smallest else GuessResult.TOO_HIGH
+
+    def score(self, player):
+        if self.scores is None:
+            self.scores = {}
+        count = self.scores.get(player, 0) + 1
+        self.scores[player] = count
+        if self.leader is None or count > self.scores[self.leader]:
+            self.leader = player
+
+    # verify the guesses in order, stopping at the first one that is correct (or if the game is already over)
+    def verify_guesses(self, guesses, player=None):
+        results = []
+        with self.lock:
+            for guess in guesses:
+                result = GuessResult.GAME_OVER if self.game_over else self.check(guess, player)
+                results.append(result)
+                if result == GuessResult.CORRECT or result == GuessResult.GAME_OVER:
+                    break
+        return results
+
+    # a player resumed their session from a new connection, the new session takes over everything of the old one
+    def replace(self, old, new):
+        with self.lock:
+            self.players = tuple(new if player is old else player for player in self.players)
+            if self.scores and old in self.scores:
+                self.scores[new] = self.scores.pop(old)
+            if self.leader is old:
+                self.leader = new
+            if self.finisher is old:
+                self.finisher = new
+
+    def watch(self, spectator):
+        with self.lock:
+            if self.spectators is None:
+                self.spectators = {}
+            self.spectators[spectator] = None
+            self.audience = None
+
+    def unwatch(self, spectator):
+        with self.lock:
+            if self.spectators and spectator in self.spectators:
+                del self.spectators[spectator]
+                self.audience = None
+
+    # every spectator, the tuple is shared by every message sent to them until the audience changes
+    def watchers(self):
+        audience = self.audience
+        if audience is None:
+            with self.lock:
+                audience = self.audience = tuple(self.spectators)
+        return audience
+
+    # the player leaves the room, returns the players that are left
+    def remove(self, player):
+        with self.lock:
+            players = self.players
+            # sessions compare by identity, the slices are done without a loop in Python
+            try:
+                index = players.index(player)
+            except ValueError:
+                return players
+            self.players = players[:index] + players[index + 1:]
+            return self.players
@@ -0,0 +1,119 @@
+import base64
+import hmac
+import itertools
+import secrets
+import threading
+
+
+# everything the server knows about one connected player. Before, this was spread over a dictionary per field, all
+# keyed by the socket. __slots__ keeps each session to one small object without a __dict__. The other players are
+# found through the room
+class PlayerSession:
+    __slots__ = ("id", "client", "name", "codec", "room", "ready", "outbox", "guesses", "token_count", "expiry",
+                 "released", "message_limit", "byte_limit", "opened", "seen", "heartbeat", "watching")
+
+    def __init__(self, session_id, client, codec):
+        self.id = session_id
+        # the socket (threaded engine) or StreamWriter (async engine) of the connection
+        self.client = client
+        # nickname, None until the player has logged in
+        self.name = None
+        # codec of the wire format agreed during the handshake
+        self.codec = codec
+        # the room the player is in, None while waiting
+        self.room = None
+        # event create_room sets once the player has been paired, None when not waiting
+        self.ready = None
+        # queue the player's messages are written from
+        self.outbox = None
+        # guesses made in the current room, only the player's own handler counts them
+        self.guesses = 0
+        # how many tokens to resume the session from another connection the client was given, only the last one
+        # works (see SessionRegistry.issue_token). 0 until the player is in a room
+        self.token_count = 0
+        # while the connection is lost: the timer that ends the session if the client does not come back in time
+        self.expiry = None
+        # event a resuming client waits on until the handler of the lost connection let go of the session (see
+        # Server.wait_detached), None when nobody waits
+        self.released = None
+        # token buckets of the messages and bytes the client may send, created with the first message (see
+        # Server.message_limit_of). None without a limit
+        self.message_limit = None
+        self.byte_limit = None
+        # time.monotonic() when the connection was accepted and when the client last sent something, only kept for
+        # the reaper
+        self.opened = self.seen = 0
+        # seconds of quiet after which the client is sent a PING, 0 if it did not agree to heartbeats
+        self.heartbeat = 0
+        # the room a spectator watches, None for a player
+        self.watching = None
+
+    def __repr__(self):
+        return f"<PlayerSession {self.id} {self.name!r}>"
+
+
+# every connected player by session id
+class SessionRegistry:
+    def __init__(self):
+        self.sessions = {}
+        # next() on a count is atomic, handler threads can create sessions at the same time
+        self.ids = itertools.count(1)
+        # tokens are not stored, each one is signed with this key and checked against the session it names
+        self.key = secrets.token_bytes(32)
+        # the resuming client and the expiry timer can try to take a detached session at the same time
+        self.lock = threading.Lock()
+
+    def create(self, client, codec):
+        session = PlayerSession(next(self.ids), client, codec)
+        self.sessions[session.id] = session
+        return session
+
+    def remove(self, session):
+        self.sessions.pop(session.id, None)
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    # a new token for the session, the old one (if any) can not be used anymore. A token is the session id, the
+    # count of tokens it was given and a MAC of both: a session keeps a small int instead of a secret string and an
+    # entry in a dictionary of tokens
+    def issue_token(self, session):
+        session.token_count += 1
+        return self.token_of(session)
+
+    def token_of(self, session):
+        text = f"{session.id}.{session.token_count}"
+        mac = hmac.digest(self.key, text.encode("ASCII"), "sha256")[:16]
+        return text + "." + base64.urlsafe_b64encode(mac).rstrip(b"=").decode("ASCII")
+
+    # the session the token was issued to, None if it was replaced by a newer one, its session is gone or it is
+    # not one of ours
+    def find(self, token):
+        try:
+            session = self.sessions.get(int(token.split(".", 1)[0]))
+            if session is None or not session.token_count:
+                return None
+            # the whole token is compared in constant time, the client learns nothing from how long it took
+            if hmac.compare_digest(token.encode("UTF-8"), self.token_of(session).encode("ASCII")):
+                return session
+        except ValueError:
+            pass
+        return None
+
+    # the session lost its connection, expiry is the timer that ends it
+    def detach(self, session, expiry):
+        with self.lock:
+            session.expiry = expiry
+
+    # a detached session is taken by whoever comes first, the client resuming it or its expiry. Returns False for
+    # the one that came too late (and for a session that is not detached)
+    def take(self, session):
+        with self.lock:
+            expiry, session.expiry = session.expiry, None
+        if expiry is None:
+            return False
+        expiry.cancel()
+        return True
+
+    def __len__(self):
+        return len(self.sessions)
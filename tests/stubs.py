@@ -0,0 +1,74 @@
+# stand-ins the tests share for what the server runs on: sockets, outbound queues, sessions and the clock. A server
+# built by new_server() listens on port 0 and never accepts a connection, its players are made with new_session()
+import logging
+from server.main import Server
+from protocols import CODECS
+
+
+# a socket nothing is ever written to, it only remembers being shut down
+class FakeClient:
+    def __init__(self):
+        self.shut_down = False
+
+    def shutdown(self, how):
+        self.shut_down = True
+
+    def close(self):
+        pass
+
+
+# keeps the messages queued for a player, parsed
+class ListOutbox:
+    def __init__(self, codec):
+        self.codec = codec
+        self.messages = []
+
+    def put(self, data):
+        self.messages.append(self.codec.parse(data.rstrip(b"\n")))
+
+    def close(self):
+        pass
+
+    def join(self, timeout=None):
+        pass
+
+    # never full, the handler always goes on reading
+    def wait_writable(self):
+        pass
+
+    def types(self):
+        return [message["type"] for message in self.messages]
+
+
+# a session where only its id is looked at (the reaper's heap, the capture log)
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+
+
+# stands in for time.monotonic(), the test moves it by hand
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+# a server for test, quiet and closed with it. Without settings nothing runs in the background: no tokens, no reaper
+def new_server(test, server_class=Server, **settings):
+    logging.disable(logging.CRITICAL)
+    test.addCleanup(logging.disable, logging.NOTSET)
+    settings = dict({"resume_grace": 0, "login_timeout": 0, "idle_timeout": 0, "heartbeat": 0}, **settings)
+    server = server_class(port=0, **settings)
+    test.addCleanup(server.server.close)
+    return server
+
+
+# a player that logged in on server and is not paired yet
+def new_session(server, name, wire_format="json"):
+    codec = CODECS[wire_format]
+    session = server.sessions.create(FakeClient(), codec)
+    session.outbox = ListOutbox(codec)
+    session.name = name
+    return session
@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# CaptureLog reads back what it recorded, in order, and drops (and counts) what goes past max_pending
+import logging
+import os
+import tempfile
+import unittest
+from server.capture import CaptureLog, read_capture, RECORD, OPENED, RECEIVED, CLOSED
+from stubs import Session
+
+
+class CaptureLogTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "capture.log")
+
+    def test_round_trip(self):
+        capture = CaptureLog(self.path, {"seed": 1})
+        session = Session(7)
+        capture.opened(session)
+        capture.received(session, b"hello")
+        capture.ended(session)
+        capture.close()
+
+        settings, records = read_capture(self.path)
+        self.assertEqual(settings, {"seed": 1})
+        self.assertEqual([(session_id, kind, data) for _, session_id, kind, data in records],
+                         [(7, OPENED, b""), (7, RECEIVED, b"hello"), (7, CLOSED, b"")])
+
+    def test_records_beyond_max_pending_are_dropped(self):
+        # the writer does not wake up during the test, everything waits in memory
+        capture = CaptureLog(self.path, {}, flush_interval=60, max_pending=3 * (RECORD.size + 10))
+        session = Session(1)
+        results = [capture.received(session, bytes(10)) for _ in range(5)]
+        self.assertEqual(results, [True, True, True, False, False])
+        self.assertEqual(capture.dropped, 2)
+        capture.close()
+
+        _, records = read_capture(self.path)
+        self.assertEqual(len(list(records)), 3)
+        self.assertEqual(capture.pending_size, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
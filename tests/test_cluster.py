@@ -0,0 +1,88 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# the broker of server/cluster.py, with workers that are only the other end of their channel. A room goes to the next
+# worker that can take it, and when none can, its players are told and let go instead of the broker dying
+import logging
+import socket
+import unittest
+from server.cluster import Broker, WaitingPlayer, CHANNEL_BUFFER
+from server.restart import decode
+from protocols import Protocols, CODECS
+
+
+class BrokerTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        # (broker end, worker end) of every worker's channel
+        self.channels = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in range(3)]
+        for pair in self.channels:
+            for sock in pair:
+                self.addCleanup(sock.close)
+        self.broker = Broker([broker_end for broker_end, _ in self.channels])
+        for broker_end, _ in self.channels:
+            broker_end.setblocking(False)
+
+    # a logged in player handed to the broker, returns the player and the client's end of its connection
+    def new_player(self, name, wire_format="json"):
+        server_end, client_end = socket.socketpair()
+        self.addCleanup(client_end.close)
+        client_end.settimeout(5)
+        return WaitingPlayer(server_end, {"name": name, "format": wire_format}), client_end
+
+    # the room a worker got, the names of its players and how many sockets came with them
+    def room_of(self, worker):
+        message, fds, flags, _ = socket.recv_fds(self.channels[worker][1], CHANNEL_BUFFER, 8)
+        for fd in fds:
+            socket.socket(fileno=fd).close()
+        return [player["name"] for player in decode(message, flags)], len(fds)
+
+    def test_rooms_go_to_the_workers_in_turn(self):
+        for worker, names in enumerate((("a", "b"), ("c", "d"))):
+            for name in names:
+                self.broker.receive_player(self.new_player(name)[0])
+            self.assertEqual(self.room_of(worker), (list(names), 2))
+
+    def test_dead_worker_is_skipped(self):
+        self.channels[0][1].close()
+        alice, _ = self.new_player("alice")
+        bob, _ = self.new_player("bob")
+        self.broker.start_room((alice, bob))
+        self.assertEqual(self.room_of(1), (["alice", "bob"], 2))
+        # the broker's copies are closed either way
+        self.assertEqual(alice.sock.fileno(), -1)
+
+    def test_full_channel_is_skipped(self):
+        broker_end = self.channels[0][0]
+        try:
+            while True:
+                broker_end.send(b"x" * 1000)
+        except BlockingIOError:
+            pass
+        self.broker.start_room((self.new_player("alice")[0], self.new_player("bob")[0]))
+        self.assertEqual(self.room_of(1), (["alice", "bob"], 2))
+
+    def test_players_are_let_go_when_no_worker_takes_the_room(self):
+        for _, worker_end in self.channels:
+            worker_end.close()
+        alice, alice_client = self.new_player("alice")
+        bob, bob_client = self.new_player("bob", "binary")
+        # paired by the matchmaker, the broker keeps running
+        self.broker.receive_player(alice)
+        self.broker.receive_player(bob)
+        for client, wire_format in ((alice_client, "json"), (bob_client, "binary")):
+            with self.subTest(wire_format=wire_format):
+                codec = CODECS[wire_format]
+                data = client.recv(1024)
+                frame, _ = codec.next_frame(bytearray(data))
+                self.assertEqual(codec.parse(frame)["type"], Protocols.Response.OPPONENT_EXITED)
+                self.assertEqual(client.recv(1024), b"")
+        self.assertEqual(len(self.broker.matchmaker), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# compatibility of every kind of client (protocol version x wire format x compression) with every kind of server
+# (engine x protocol version, plus workers and batch sizes), in rooms mixing two kinds of clients. Each client must
+# finish its game and agree with the server on what the older of the two supports.
+import asyncio
+import itertools
+import unittest
+from client.core import GameClient
+from protocols import COMPRESSIONS, MAX_GUESS_BATCH, HEARTBEAT_INTERVAL
+import launcher
+
+# (protocol version, wire format, compressions)
+CLIENTS = list(itertools.product((1, 2, 3), ("json", "binary"), ((), COMPRESSIONS)))
+
+# (engine, protocol version, most guesses in a batch, worker processes)
+SERVERS = [(engine, version, MAX_GUESS_BATCH, 0) for engine, version in itertools.product(("threaded", "async"),
+                                                                                          (1, 2, 3))]
+SERVERS += [("threaded", 3, MAX_GUESS_BATCH, 2), ("threaded", 3, 64, 0), ("async", 3, 0, 0)]
+
+
+def start_server(engine, version, max_batch, workers, port):
+    # no rate limits, the clients without batching send every guess on its own
+    return launcher.start_server(port, ["--engine", engine, "--protocol-version", str(version), "--max-batch",
+                                        str(max_batch), "--start-delay", "0", "--message-rate", "0", "--byte-rate",
+                                        "0", "--resume-grace", "0", "--workers", str(workers), "--log-level",
+                                        "warning"])
+
+
+# what a client of this kind should end up with on this server: (version, wire format, compression, batching,
+# heartbeat)
+def expected(client, server):
+    client_version, wire_format, compressions = client
+    _, server_version, max_batch, _ = server
+    version = min(client_version, server_version)
+    if version < 2:
+        return 1, wire_format, None, 0, 0
+    return (version, wire_format, compressions[0] if compressions and wire_format == "binary" else None, max_batch,
+            HEARTBEAT_INTERVAL if version >= 3 else 0)
+
+
+# one player: every number between the bounds in one batch, the server stops at the hidden one. Returns the client
+# and whether the game ended the way it should
+async def play(kind, port, name):
+    version, wire_format, compressions = kind
+    client = GameClient("127.0.0.1", port, wire_format, reconnect_attempts=0, protocol_version=version,
+                        compressions=compressions)
+    client.quiet = True
+    await client.connect()
+    try:
+        await client.login(name)
+        # the opponent may win before our START arrives
+        if not await client.wait_for_start():
+            return client, client.winner is not None
+        results = await client.guess_batch(range(client.lower_bound, client.upper_bound + 1))
+        await client.wait_for_end()
+        # the loser's batch may be cut short by the end of the game, the winner's ends with a correct guess
+        ok = client.winner is not None and (client.winner != name or results[-1] == client.CORRECT)
+        return client, ok
+    finally:
+        await client.close()
+
+
+# every kind of client plays twice, once with the kind before it and once with the kind after it. Returns
+# [(kind, (client, ok) or the exception)]
+async def play_rooms(port, timeout):
+    rooms = [(CLIENTS[index], CLIENTS[(index + 1) % len(CLIENTS)]) for index in range(len(CLIENTS))]
+    games = []
+    for number, room in enumerate(rooms):
+        for seat, kind in enumerate(room):
+            games.append(asyncio.create_task(play(kind, port, f"p{number}{seat}")))
+        # both players of a room log in before the next room's, so they are paired together
+        await asyncio.sleep(0.05)
+    outcomes = await asyncio.wait_for(asyncio.gather(*games, return_exceptions=True), timeout)
+    return list(zip([kind for room in rooms for kind in room], outcomes))
+
+
+class CompatibilityTest(unittest.TestCase):
+    def test_every_client_against_every_server(self):
+        for server in SERVERS:
+            with self.subTest(server=server):
+                port = launcher.free_port()
+                process = start_server(*server, port)
+                try:
+                    games = asyncio.run(play_rooms(port, timeout=30))
+                finally:
+                    process.terminate()
+                    process.wait()
+
+                for kind, outcome in games:
+                    with self.subTest(server=server, client=kind):
+                        if isinstance(outcome, BaseException):
+                            raise outcome
+                        client, ok = outcome
+                        self.assertTrue(ok, "the game did not end the way it should")
+                        agreed = (client.version, client.codec.name, client.codec.compression, client.max_batch,
+                                  client.heartbeat)
+                        self.assertEqual(agreed, expected(kind, server))
+
+
+if __name__ == "__main__":
+    unittest.main()
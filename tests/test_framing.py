@@ -0,0 +1,78 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# FrameReader fed a stream in pieces, a wire format switched mid-stream, and the frame size limit
+import unittest
+from framing import FrameReader
+from protocols import Protocols, CODECS, FrameError
+
+
+# feeds stream size bytes at a time and takes every frame out with codec, returns the parsed messages
+def read_all(stream, codec, size):
+    reader = FrameReader(size)
+    messages = []
+    for position in range(0, len(stream), size):
+        reader.feed(stream[position:position + size])
+        while (frame := reader.next_frame(codec)) is not None:
+            messages.append(codec.parse(frame))
+    return messages, reader
+
+
+class FrameReaderTest(unittest.TestCase):
+    def test_every_read_size(self):
+        for name, codec in CODECS.items():
+            stream = b"".join(codec.encode(Protocols.Request.GUESS, guess) for guess in range(-50, 50))
+            for size in (1, 7, 64, 4096):
+                with self.subTest(codec=name, size=size):
+                    messages, reader = read_all(stream, codec, size)
+                    self.assertEqual([message["data"] for message in messages], list(range(-50, 50)))
+                    self.assertEqual(len(reader), 0)
+
+    def test_multibyte_character_split_between_reads(self):
+        codec = CODECS["json"]
+        stream = codec.encode(Protocols.Request.NICKNAME, "é" * 600)
+        messages, _ = read_all(stream, codec, 1023)
+        self.assertEqual(messages[0]["data"], "é" * 600)
+
+    def test_codec_changes_after_a_frame(self):
+        # the JSON nickname arrives in the same read as binary messages, which may hold newlines of their own
+        json_codec, binary = CODECS["json"], CODECS["binary"]
+        guesses = [10, 2570, -246, 0x0A0A0A0A]
+        stream = json_codec.encode(Protocols.Request.NICKNAME, "alice") + json_codec.encode(
+            Protocols.Request.GUESS, 1) + b"".join(binary.encode(Protocols.Request.GUESS, guess) for guess in guesses)
+        reader = FrameReader()
+        reader.feed(stream)
+        self.assertEqual(json_codec.parse(reader.next_frame(json_codec))["data"], "alice")
+        self.assertEqual(json_codec.parse(reader.next_frame(json_codec))["data"], 1)
+        received = []
+        while (frame := reader.next_frame(binary)) is not None:
+            received.append(binary.parse(frame)["data"])
+        self.assertEqual(received, guesses)
+
+    def test_frame_over_the_limit(self):
+        for name, codec in CODECS.items():
+            with self.subTest(codec=name):
+                reader = FrameReader()
+                reader.feed(codec.encode(Protocols.Request.GUESS, 1))
+                reader.feed(codec.encode(Protocols.Request.NICKNAME, "x" * (codec.max_frame_size + 1)))
+                # the frame before the large one is still handed out
+                self.assertEqual(codec.parse(reader.next_frame(codec))["data"], 1)
+                with self.assertRaises(FrameError):
+                    reader.next_frame(codec)
+
+
+class JsonCodecTest(unittest.TestCase):
+    def test_parse_allows_whitespace_around_the_object(self):
+        codec = CODECS["json"]
+        self.assertEqual(codec.parse(b' {"type": "t", "data": 1}\r '), {"type": "t", "data": 1})
+
+    def test_parse_rejects_extra_data(self):
+        with self.assertRaises(ValueError):
+            CODECS["json"].parse(b'{"type": "t", "data": 1} 2')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,224 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# Matchmaker pairs in order of arrival and never puts anyone in two rooms; RatedMatchmaker pairs the closest
+# ratings inside a window that widens with the wait
+import random
+import threading
+import unittest
+from server.matchmaking import Matchmaker, RatedMatchmaker, SortedKeys
+
+
+class MatchmakerTest(unittest.TestCase):
+    def test_pairs_in_order_of_arrival(self):
+        matchmaker = Matchmaker()
+        self.assertEqual(matchmaker.join("a"), [])
+        self.assertEqual(matchmaker.join("b"), [("a", "b")])
+        self.assertEqual(matchmaker.join_many(["c", "d", "e", "f", "g"]), [("c", "d"), ("e", "f")])
+        self.assertEqual(len(matchmaker), 1)
+        self.assertIn("g", matchmaker)
+
+    def test_rooms_of_more_players(self):
+        matchmaker = Matchmaker(room_size=3)
+        self.assertEqual(matchmaker.join_many(["a", "b"]), [])
+        self.assertEqual(matchmaker.join_many(["c", "d"]), [("a", "b", "c")])
+        # the one left over keeps its place at the front
+        self.assertEqual(matchmaker.join_many(["e", "f"]), [("d", "e", "f")])
+
+    def test_player_who_left_is_skipped(self):
+        matchmaker = Matchmaker()
+        matchmaker.join("a")
+        matchmaker.leave("a")
+        self.assertNotIn("a", matchmaker)
+        self.assertEqual(matchmaker.join("b"), [])
+        self.assertEqual(matchmaker.join("c"), [("b", "c")])
+        self.assertEqual(len(matchmaker), 0)
+
+    def test_take_all(self):
+        matchmaker = Matchmaker(room_size=4)
+        matchmaker.join_many(["a", "b", "c"])
+        matchmaker.leave("b")
+        self.assertEqual(matchmaker.take_all(), ["a", "c"])
+        self.assertEqual(len(matchmaker), 0)
+        self.assertEqual(matchmaker.join_many(["d", "e", "f"]), [])
+
+    def test_no_player_is_paired_twice(self):
+        matchmaker = Matchmaker()
+        groups = []
+        lock = threading.Lock()
+
+        def join(players):
+            for player in players:
+                found = matchmaker.join(player)
+                with lock:
+                    groups.extend(found)
+
+        threads = [threading.Thread(target=join, args=(range(start, 4000, 8),)) for start in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        paired = [player for group in groups for player in group]
+        self.assertEqual(len(paired), 4000)
+        self.assertEqual(set(paired), set(range(4000)))
+        self.assertEqual(len(matchmaker), 0)
+
+
+# a player is their own rating, the clock is moved by hand
+class RatedMatchmakerTest(unittest.TestCase):
+    def new_matchmaker(self, room_size=2, window=50, widen=25, max_window=800):
+        self.now = 0
+        return RatedMatchmaker(room_size, rating=lambda player: player, window=window, widen=widen,
+                               max_window=max_window, clock=lambda: self.now)
+
+    def test_pairs_the_closest_rating(self):
+        matchmaker = self.new_matchmaker()
+        self.assertEqual(matchmaker.join_many([1000, 1200, 1400]), [])
+        # 1210 is closer to 1200 than to anybody else, the one who waited longest comes first
+        self.assertEqual(matchmaker.join(1210), [(1200, 1210)])
+        self.assertEqual(matchmaker.join(1390), [(1400, 1390)])
+        self.assertEqual(len(matchmaker), 1)
+        self.assertIn(1000, matchmaker)
+
+    def test_window_widens_while_waiting(self):
+        matchmaker = self.new_matchmaker()
+        self.assertEqual(matchmaker.join_many([1000, 1100]), [])
+        self.now = 1
+        self.assertEqual(matchmaker.window_of(1000, self.now), 75)
+        self.assertEqual(matchmaker.match(), [])
+        # 100 apart is inside a window of 50 + 2 * 25
+        self.now = 2
+        self.assertEqual(matchmaker.match(), [(1000, 1100)])
+        self.assertEqual(len(matchmaker), 0)
+
+    def test_the_most_patient_player_decides(self):
+        matchmaker = self.new_matchmaker()
+        matchmaker.join(1000)
+        self.now = 4
+        # the window of 1000 is now 150, the newcomer's is 50
+        self.assertEqual(matchmaker.join(1140), [(1000, 1140)])
+
+    def test_window_stops_at_max_window(self):
+        matchmaker = self.new_matchmaker(max_window=300)
+        matchmaker.join_many([1000, 1400])
+        self.now = 1000
+        self.assertEqual(matchmaker.window_of(1000, self.now), 300)
+        self.assertEqual(matchmaker.match(), [])
+        self.assertEqual(len(matchmaker), 2)
+        # a settled player is still paired by somebody joining close enough
+        self.assertEqual(matchmaker.join(1350), [(1400, 1350)])
+
+    def test_no_widening(self):
+        matchmaker = self.new_matchmaker(widen=0)
+        matchmaker.join_many([1000, 1060])
+        self.now = 1000
+        self.assertEqual(matchmaker.match(), [])
+        self.assertEqual(matchmaker.join(1040), [(1060, 1040)])
+
+    def test_rooms_of_more_players(self):
+        matchmaker = self.new_matchmaker(room_size=3, window=100)
+        self.assertEqual(matchmaker.join_many([1000, 1500, 1040]), [])
+        self.assertEqual(matchmaker.join(1020), [(1000, 1040, 1020)])
+        # only two players left, nothing to form
+        self.now = 1000
+        self.assertEqual(matchmaker.match(), [])
+
+    def test_leave_and_take_all(self):
+        matchmaker = self.new_matchmaker()
+        matchmaker.join_many([1000, 1200, 1400])
+        matchmaker.leave(1200)
+        matchmaker.leave(1200)
+        self.assertNotIn(1200, matchmaker)
+        self.assertEqual(matchmaker.join(1210), [])
+        self.assertEqual(matchmaker.take_all(), [1000, 1400, 1210])
+        self.assertEqual(len(matchmaker), 0)
+        self.assertEqual(matchmaker.join(1000), [])
+
+    def test_many_players(self):
+        matchmaker = self.new_matchmaker(window=0.5, widen=0)
+        rng = random.Random(1)
+        ratings = rng.sample(range(0, 1_000_000, 2), 5000)
+        self.assertEqual(matchmaker.join_many(ratings), [])
+        for rating in ratings[::2]:
+            matchmaker.leave(rating)
+        # every newcomer is paired with the player rated half a point below
+        groups = matchmaker.join_many([rating + 0.5 for rating in ratings[1::2]])
+        self.assertEqual(sorted(groups), sorted((rating, rating + 0.5) for rating in ratings[1::2]))
+        self.assertEqual(len(matchmaker), 0)
+
+    def test_only_due_players_are_looked_at(self):
+        matchmaker = self.new_matchmaker()
+        # 1000 apart, further than max_window: nobody is ever due
+        matchmaker.join_many(range(0, 1_000_000, 1000))
+        # 500_100 is paired with 500_000 once the window is 100 wide, 2 seconds later
+        matchmaker.join(500_100)
+        looked_at = []
+        find_group = matchmaker.find_group
+        matchmaker.find_group = lambda key, now: looked_at.append(key[0]) or find_group(key, now)
+        self.now = 1
+        self.assertEqual(matchmaker.match(), [])
+        self.assertEqual(looked_at, [])
+        self.now = 2
+        self.assertEqual(matchmaker.match(), [(500_000, 500_100)])
+        self.assertLessEqual(len(looked_at), 2)
+
+    def test_nobody_who_could_play_is_left_waiting(self):
+        # a widen of a power of two keeps the windows exact
+        matchmaker = self.new_matchmaker(room_size=3, window=16, widen=32, max_window=400)
+        rng = random.Random(1)
+        formed = 0
+        for step in range(400):
+            self.now = step / 4
+            for _ in range(rng.randrange(4)):
+                formed += len(matchmaker.join(rng.randrange(20_000) / 4))
+            if matchmaker and rng.random() < 0.3:
+                matchmaker.leave(rng.choice(list(matchmaker.waiting)))
+            formed += len(matchmaker.match())
+            for key, _ in matchmaker.waiting.values():
+                closest = matchmaker.closest(key)
+                if closest is not None:
+                    members, spread = closest
+                    windows = [matchmaker.window_of(matchmaker.players[member], self.now) for member in members]
+                    self.assertGreater(spread, max(windows))
+        self.assertGreater(formed, 50)
+
+
+class SortedKeysTest(unittest.TestCase):
+    def test_stays_sorted(self):
+        keys = SortedKeys(load=4)
+        expected = []
+        rng = random.Random(1)
+        for _ in range(2000):
+            if expected and rng.random() < 0.4:
+                key = expected.pop(rng.randrange(len(expected)))
+                keys.remove(key)
+            else:
+                key = (rng.randrange(100), rng.random())
+                keys.add(key)
+                expected.append(key)
+            expected.sort()
+            self.assertEqual(len(keys), len(expected))
+        self.assertEqual(list(keys), expected)
+        self.assertTrue(all(0 < len(bucket) <= 8 for bucket in keys.buckets))
+        self.assertEqual(keys.maxes, [bucket[-1] for bucket in keys.buckets])
+
+    def test_around(self):
+        keys = SortedKeys(load=2)
+        for key in range(0, 20, 2):
+            keys.add(key)
+        self.assertEqual(keys.around(10, 3), ([8, 6, 4], [12, 14, 16]))
+        # a key that is not there
+        self.assertEqual(keys.around(9, 2), ([8, 6], [10, 12]))
+        self.assertEqual(keys.around(2, 3), ([0], [4, 6, 8]))
+        self.assertEqual(keys.around(30, 2), ([18, 16], []))
+        self.assertEqual(keys.around(-1, 1), ([], [0]))
+        keys.clear()
+        self.assertEqual(keys.around(1, 1), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# what a Prometheus scrape of server/metrics.py reads, from the registry and over HTTP, and the server's counts
+import http.client
+import unittest
+from server.metrics import Metric, Registry, Histogram, serve_metrics, format_value
+from protocols import Protocols
+from stubs import new_server, new_session
+
+
+class RenderTest(unittest.TestCase):
+    def test_counter_and_gauge(self):
+        registry = Registry()
+        registry.counter("requests_total", "Requests").inc(3)
+        gauge = registry.gauge("queue_depth", "Depth")
+        gauge.inc(5)
+        gauge.dec(2)
+        registry.gauge("live", "Read when scraped", function=lambda: 7)
+        self.assertEqual(registry.render(),
+                         "# HELP requests_total Requests\n# TYPE requests_total counter\nrequests_total 3\n"
+                         "# HELP queue_depth Depth\n# TYPE queue_depth gauge\nqueue_depth 3\n"
+                         "# HELP live Read when scraped\n# TYPE live gauge\nlive 7\n")
+
+    def test_labels_are_sorted_and_created_once(self):
+        counter = Registry().counter("messages_total", "Messages", "type")
+        counter.labels("b").inc()
+        counter.labels("a").inc(2)
+        self.assertIs(counter.labels("b"), counter.labels("b"))
+        self.assertEqual(counter.render().splitlines()[2:],
+                         ['messages_total{type="a"} 2', 'messages_total{type="b"} 1'])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.render().splitlines()[2:],
+                         ['latency_seconds_bucket{le="0.1"} 2', 'latency_seconds_bucket{le="1"} 3',
+                          'latency_seconds_bucket{le="+Inf"} 4', "latency_seconds_sum 3.65",
+                          "latency_seconds_count 4"])
+
+    def test_labelled_histogram_keeps_the_buckets(self):
+        histogram = Histogram("phase_seconds", "Phases", "phase", buckets=(1.0,))
+        histogram.labels("send").observe(2)
+        self.assertEqual(histogram.render().splitlines()[2:4],
+                         ['phase_seconds_bucket{phase="send",le="1"} 0',
+                          'phase_seconds_bucket{phase="send",le="+Inf"} 1'])
+
+    def test_format_value(self):
+        self.assertEqual([format_value(value) for value in (2.0, 0.25, float("inf"), 3)], ["2", "0.25", "+Inf", "3"])
+
+    def test_metric_is_abstract(self):
+        with self.assertRaises(TypeError):
+            Metric("name", "help")
+
+
+class EndpointTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+        self.registry.counter("scrapes_total", "Scrapes").inc()
+        self.httpd = serve_metrics(self.registry, port=0)
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(self.httpd.shutdown)
+
+    def get(self, path):
+        connection = http.client.HTTPConnection(*self.httpd.server_address, timeout=5)
+        self.addCleanup(connection.close)
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, response.getheader("Content-Type"), response.read().decode()
+
+    def test_metrics(self):
+        status, content_type, body = self.get("/metrics?format=text")
+        self.assertEqual(status, 200)
+        self.assertTrue(content_type.startswith("text/plain; version=0.0.4"))
+        self.assertEqual(body, self.registry.render())
+
+    def test_other_paths(self):
+        self.assertEqual(self.get("/")[0], 404)
+
+
+class ServerCountsTest(unittest.TestCase):
+    def setUp(self):
+        self.server = new_server(self, seed=1)
+
+    def test_unknown_types_share_one_label(self):
+        session = new_session(self.server, "alice")
+        for r_type in ("made_up", "another", Protocols.Request.NICKNAME):
+            self.server.count_received({"type": r_type})
+        received = self.server.metrics.messages_received
+        self.assertEqual(sorted(received.children), sorted(["unknown", Protocols.Request.NICKNAME]))
+        self.assertEqual(received.labels("unknown").value, 2)
+        self.server.send(Protocols.Response.NICKNAME, None, session)
+        self.assertEqual(self.server.metrics.messages_sent.labels(Protocols.Response.NICKNAME).value, 1)
+
+    def test_state_gauges(self):
+        players = [new_session(self.server, name) for name in ("alice", "bob")]
+        self.server.create_room(players)
+        text = self.server.metrics.render()
+        self.assertIn("game_rooms_active 1\n", text)
+        self.assertIn("game_rooms_total 1\n", text)
+        self.assertIn("game_waiting_players 0\n", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# the outbound queues of server/outbound.py against a client that reads when the test lets it: writes are joined,
+# the handler is held back between the watermarks, and a client that falls max_backlog behind is evicted
+import asyncio
+import socket
+import threading
+import unittest
+from server.outbound import Outbox, AsyncOutbox
+from stubs import Session
+
+
+# transmit() of a client that takes each write only when the test lets it
+class SlowClient:
+    def __init__(self):
+        self.writes = []
+        self.started = threading.Semaphore(0)
+        self.allowed = threading.Semaphore(0)
+
+    def transmit(self, session, data):
+        self.writes.append(data)
+        self.started.release()
+        self.allowed.acquire()
+
+    # until the writer is in the middle of its next write
+    def wait_started(self):
+        if not self.started.acquire(timeout=5):
+            raise AssertionError("the writer did not write in time")
+
+    def let_through(self, count=1):
+        for _ in range(count):
+            self.allowed.release()
+
+
+class OutboxTest(unittest.TestCase):
+    # an outbox writing to self.client, a SlowClient unless the test brings its own transmit()
+    def new_outbox(self, transmit=None, **limits):
+        self.client = SlowClient()
+        self.evicted = []
+        outbox = Outbox(Session(1), transmit or self.client.transmit,
+                        lambda session, reason: self.evicted.append(reason), **limits)
+        self.addCleanup(self.stop, outbox)
+        return outbox
+
+    def stop(self, outbox):
+        outbox.close()
+        # the writer is not left waiting for a write the test never let through
+        self.client.let_through(100)
+        outbox.join(5)
+
+    # wait_writable() from another thread, returns an event set once it returned
+    def wait_writable(self, outbox):
+        returned = threading.Event()
+        thread = threading.Thread(target=lambda: (outbox.wait_writable(), returned.set()), daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        return returned
+
+    def test_what_is_queued_during_a_write_goes_out_in_one(self):
+        outbox = self.new_outbox()
+        outbox.put(b"a")
+        self.client.wait_started()
+        # the writer is stuck writing "a" while these are queued
+        outbox.put(b"b")
+        outbox.put(b"c")
+        self.client.let_through()
+        self.client.wait_started()
+        self.assertEqual(self.client.writes, [b"a", b"bc"])
+
+    def test_handler_waits_between_the_watermarks(self):
+        outbox = self.new_outbox(high_water=10, low_water=5, max_backlog=100)
+        outbox.put(b"x" * 10)
+        self.client.wait_started()
+        # at high_water the handler still reads
+        self.assertTrue(self.wait_writable(outbox).wait(5))
+        outbox.put(b"y" * 6)
+        outbox.put(b"z" * 4)
+        returned = self.wait_writable(outbox)
+        self.assertFalse(returned.wait(0.1))
+        # the 10 bytes being written next are still above low_water
+        self.client.let_through()
+        self.client.wait_started()
+        self.assertFalse(returned.wait(0.1))
+        self.client.let_through()
+        self.assertTrue(returned.wait(5))
+        self.assertEqual(self.evicted, [])
+
+    def test_slow_consumer_is_evicted_once(self):
+        outbox = self.new_outbox(high_water=10, low_water=5, max_backlog=20)
+        outbox.put(b"x" * 20)
+        self.client.wait_started()
+        outbox.put(b"y")
+        self.assertEqual(self.evicted, ["21 bytes waiting to be sent"])
+        # what was waiting is dropped and nothing more is taken
+        outbox.put(b"z")
+        self.assertEqual(outbox.chunks, [])
+        self.assertEqual(len(self.evicted), 1)
+        # an evicted client's handler is not held back
+        self.assertTrue(self.wait_writable(outbox).wait(5))
+
+    def test_close_sends_what_is_queued(self):
+        outbox = self.new_outbox()
+        outbox.put(b"a")
+        self.client.wait_started()
+        outbox.put(b"b")
+        outbox.close()
+        outbox.put(b"late")
+        self.client.let_through(2)
+        outbox.join(5)
+        self.assertFalse(outbox.thread.is_alive())
+        self.assertEqual(self.client.writes, [b"a", b"b"])
+
+    def test_failed_write_closes_the_queue(self):
+        def transmit(session, data):
+            raise BrokenPipeError()
+
+        outbox = self.new_outbox(transmit, high_water=1, low_water=0)
+        outbox.put(b"ab")
+        outbox.join(5)
+        self.assertTrue(outbox.closed)
+        self.assertTrue(self.wait_writable(outbox).wait(5))
+        self.assertEqual(self.evicted, [])
+
+
+class AsyncOutboxTest(unittest.TestCase):
+    # runs test(outbox, reader) with the outbox of one end of a socket pair and the reader of the other end
+    def run_with_outbox(self, test, **limits):
+        async def main():
+            server_end, client_end = socket.socketpair()
+            _, writer = await asyncio.open_connection(sock=server_end)
+            reader, peer = await asyncio.open_connection(sock=client_end)
+            session = Session(1)
+            session.client = writer
+            self.evicted = []
+            outbox = AsyncOutbox(session, lambda session, data: session.client.write(data),
+                                 lambda session, reason: self.evicted.append(reason), **limits)
+            try:
+                await test(outbox, reader)
+            finally:
+                writer.transport.abort()
+                peer.close()
+
+        asyncio.run(main())
+
+    def test_one_write_per_pass_of_the_loop(self):
+        async def test(outbox, reader):
+            writes = []
+            transmit = outbox.transmit
+            outbox.transmit = lambda session, data: (writes.append(data), transmit(session, data))
+            for data in (b"a", b"b", b"c"):
+                outbox.put(data)
+            self.assertEqual(writes, [])
+            await asyncio.sleep(0)
+            self.assertEqual(writes, [b"abc"])
+            self.assertEqual(await reader.readexactly(3), b"abc")
+
+        self.run_with_outbox(test)
+
+    def test_slow_consumer_is_evicted(self):
+        async def test(outbox, reader):
+            # the peer never reads, what the socket does not take stays in the transport's buffer
+            for _ in range(64):
+                outbox.put(b"x" * 64 * 1024)
+                await asyncio.sleep(0)
+                if self.evicted:
+                    break
+            self.assertEqual(len(self.evicted), 1)
+            self.assertTrue(outbox.closed)
+            outbox.put(b"late")
+            self.assertEqual(outbox.chunks, [])
+
+        self.run_with_outbox(test, max_backlog=256 * 1024)
+
+    def test_close_flushes(self):
+        async def test(outbox, reader):
+            outbox.put(b"last")
+            outbox.close()
+            outbox.put(b"late")
+            self.assertEqual(await reader.readexactly(4), b"last")
+            self.assertEqual(outbox.chunks, [])
+
+        self.run_with_outbox(test)
+
+
+if __name__ == "__main__":
+    unittest.main()
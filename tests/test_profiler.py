@@ -0,0 +1,129 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# the SamplingProfiler of server/profiler.py sampling threads the test parks in known functions, the collapsed stacks
+# it writes, and the phase timers the server keeps for the same purpose
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+from server.profiler import SamplingProfiler
+from protocols import Protocols
+from stubs import new_server, new_session
+
+
+def parked_in_busy_function(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def parked_idle(stop):
+    stop.wait()
+
+
+class SamplingProfilerTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.prefix = os.path.join(directory.name, "profile")
+
+    # a thread running target until the test ends
+    def park(self, target):
+        stop = threading.Event()
+        thread = threading.Thread(target=target, args=(stop,), daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(stop.set)
+        return thread
+
+    # the innermost function of every stack sample() counted
+    def innermost(self, profiler):
+        return {stack[-1] for stack in profiler.stacks}
+
+    # every function of every stack sample() counted
+    def seen(self, profiler):
+        return {name for stack in profiler.stacks for name in stack}
+
+    def test_idle_threads_are_left_out(self):
+        self.park(parked_idle)
+        self.park(parked_in_busy_function)
+        profiler = SamplingProfiler(self.prefix)
+        profiler.sample(threading.get_ident())
+        self.assertIn("test_profiler.py:parked_in_busy_function", self.seen(profiler))
+        self.assertNotIn("threading.py:Condition.wait", self.innermost(profiler))
+        self.assertGreater(profiler.skipped, 0)
+
+        profiler = SamplingProfiler(self.prefix, idle=True)
+        profiler.sample(threading.get_ident())
+        self.assertIn("threading.py:Condition.wait", self.innermost(profiler))
+        stack = next(stack for stack in profiler.stacks if stack[-1] == "threading.py:Condition.wait")
+        # outermost first, down to where the thread waits
+        self.assertEqual(stack[0], "threading.py:Thread._bootstrap")
+        self.assertIn("test_profiler.py:parked_idle", stack)
+
+    def test_a_blocked_thread_is_walked_once(self):
+        thread = self.park(parked_idle)
+        profiler = SamplingProfiler(self.prefix, idle=True)
+        walked = []
+        walk = profiler.walk
+        profiler.walk = lambda frame: walked.append(frame) or walk(frame)
+        profiler.sample(threading.get_ident())
+        stack = profiler.last[thread.ident][2]
+        profiler.sample(threading.get_ident())
+        self.assertIs(profiler.last[thread.ident][2], stack)
+        self.assertEqual(sum(frame is profiler.last[thread.ident][0] for frame in walked), 1)
+        self.assertEqual(profiler.stacks[stack], 2)
+
+    def test_stop_writes_collapsed_stacks(self):
+        self.park(parked_in_busy_function)
+        profiler = SamplingProfiler(self.prefix, interval=0.001)
+        self.assertIsNone(profiler.stop())
+        profiler.toggle()
+        self.assertTrue(profiler.running)
+        deadline = time.monotonic() + 5
+        while profiler.samples < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        profiler.toggle()
+        self.assertFalse(profiler.running)
+        path = f"{self.prefix}.{os.getpid()}.1.folded"
+        with open(path) as folded:
+            lines = folded.read().splitlines()
+        stacks = dict(line.rsplit(" ", 1) for line in lines)
+        busy = [stack for stack in stacks if ";test_profiler.py:parked_in_busy_function" in stack]
+        self.assertGreaterEqual(sum(int(stacks[stack]) for stack in busy), 1)
+        self.assertTrue(all(stack.startswith("threading.py:Thread._bootstrap;") for stack in busy))
+        # the next profile goes to the next file
+        profiler.start()
+        self.assertEqual(profiler.stop(), f"{self.prefix}.{os.getpid()}.2.folded")
+
+    def test_top(self):
+        profiler = SamplingProfiler(self.prefix)
+        profiler.stacks.update({("main", "play", "guess"): 5, ("main", "play"): 2, ("main", "send"): 1})
+        self.assertEqual(profiler.top(2), [("guess", 5, 5), ("play", 2, 7)])
+
+
+class PhaseTimerTest(unittest.TestCase):
+    def test_phases_of_a_game(self):
+        server = new_server(self, seed=1)
+        players = [new_session(server, name) for name in ("alice", "bob")]
+        for player in players:
+            player.ready = server.new_event()
+        server.create_room(players)
+        self.assertIsNotNone(server.wait_for_room(players[0], iter(())))
+        server.handle_received_msg({"type": Protocols.Request.GUESS, "data": -1}, players[0])
+        metrics = server.metrics
+        self.assertEqual(metrics.wait_for_room_seconds.count, 1)
+        self.assertEqual(metrics.verify_guess_seconds.count, 1)
+        self.assertGreaterEqual(metrics.send_phase_seconds.count, 2)
+        self.assertIn('game_phase_seconds_count{phase="verify_guess"} 1', metrics.render())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# round trips of the binary wire format, its varint lengths and compressed payloads
+import unittest
+from protocols import (Protocols, ProtocolError, FrameError, BinaryCodec, CODECS, encode_varint, decode_varint,
+                       find_codec)
+
+# data of every layout, by message type
+SAMPLES = {
+    Protocols.Response.NICKNAME: None,
+    Protocols.Response.OPPONENT: "bob, carol",
+    Protocols.Response.CORRECT_NUMBER: -2 ** 63,
+    Protocols.Response.GAME_BOUNDS: {"lower": -2 ** 63, "upper": 2 ** 63 - 1},
+    Protocols.Response.GUESS_BATCH_RESULT: [0, 1, 2, 3],
+    Protocols.Response.HELLO: {"version": 3, "format": "binary", "compression": "zlib", "batching": 1024},
+    Protocols.Request.NICKNAME: "élodie",
+    Protocols.Request.GUESS: 250,
+    Protocols.Request.GUESS_BATCH: [1, -1, 2 ** 40],
+    # a type the table does not know is sent as a whole JSON message
+    "protocol.unknown": {"anything": [1, 2]},
+}
+
+
+class BinaryCodecTest(unittest.TestCase):
+    def round_trip(self, codec, r_type, data):
+        encoded = codec.encode(r_type, data)
+        frame, end = codec.next_frame(bytearray(encoded))
+        self.assertEqual(end, len(encoded))
+        self.assertEqual(codec.wire(frame), encoded)
+        return codec.parse(frame)
+
+    def test_round_trip(self):
+        for codec in (BinaryCodec(), BinaryCodec("zlib")):
+            for r_type, data in SAMPLES.items():
+                with self.subTest(compression=codec.compression, type=r_type):
+                    self.assertEqual(self.round_trip(codec, r_type, data), {"type": r_type, "data": data})
+
+    def test_small_messages(self):
+        codec = BinaryCodec()
+        self.assertEqual(len(codec.encode(Protocols.Response.GUESS_TOO_LOW, None)), 2)
+        self.assertEqual(len(codec.encode(Protocols.Request.GUESS, 250)), 10)
+
+    def test_compression_flag(self):
+        codec = BinaryCodec("zlib")
+        batch = list(range(1000))
+        encoded = codec.encode(Protocols.Request.GUESS_BATCH, batch)
+        self.assertTrue(encoded[0] & BinaryCodec.COMPRESSED)
+        self.assertLess(len(encoded), len(BinaryCodec().encode(Protocols.Request.GUESS_BATCH, batch)))
+        self.assertEqual(self.round_trip(codec, Protocols.Request.GUESS_BATCH, batch)["data"], batch)
+        # below the threshold nothing is compressed
+        self.assertFalse(codec.encode(Protocols.Request.GUESS_BATCH, [1, 2])[0] & BinaryCodec.COMPRESSED)
+
+    def test_compressed_message_without_compression(self):
+        encoded = BinaryCodec("zlib").encode(Protocols.Request.GUESS_BATCH, list(range(1000)))
+        codec = BinaryCodec()
+        frame, _ = codec.next_frame(bytearray(encoded))
+        with self.assertRaises(ProtocolError):
+            codec.parse(frame)
+
+    def test_partial_frame(self):
+        codec = BinaryCodec()
+        encoded = codec.encode(Protocols.Request.NICKNAME, "x" * 300)
+        for size in range(len(encoded)):
+            self.assertEqual(codec.next_frame(bytearray(encoded[:size])), (None, 0))
+
+    def test_bad_payload(self):
+        codec = BinaryCodec()
+        opcode = codec.opcodes[Protocols.Request.GUESS][0]
+        with self.assertRaises(ProtocolError):
+            codec.parse(bytes((opcode,)) + encode_varint(3) + b"abc")
+        with self.assertRaises(ProtocolError):
+            codec.parse(bytes((63,)) + encode_varint(0))
+
+    def test_bad_json_payload(self):
+        codec = BinaryCodec()
+        # a JSON layout of the table, and a whole message of a type the table does not know
+        json_opcode = next(opcode for opcode, (_, layout) in codec.types.items() if layout == BinaryCodec.JSON)
+        for opcode in (json_opcode, BinaryCodec.GENERIC):
+            for payload in (b"\x80{}", b"{\"type\": ", b"not json"):
+                with self.subTest(opcode=opcode, payload=payload):
+                    with self.assertRaises(ProtocolError):
+                        codec.parse(bytes((opcode,)) + encode_varint(len(payload)) + payload)
+        # valid JSON that is not an object is no message either
+        with self.assertRaises(ProtocolError):
+            codec.parse(bytes((BinaryCodec.GENERIC,)) + encode_varint(3) + b"[1]")
+
+    def test_frame_over_the_limit(self):
+        codec = BinaryCodec()
+        with self.assertRaises(FrameError):
+            codec.next_frame(bytearray(b"\x41" + encode_varint(codec.max_frame_size + 1)))
+
+    def test_find_codec(self):
+        self.assertIs(find_codec("json"), CODECS["json"])
+        self.assertEqual(find_codec("binary", "zlib").compression, "zlib")
+        self.assertIsNone(find_codec("json", "zlib"))
+        self.assertIsNone(find_codec("xml"))
+
+
+class VarintTest(unittest.TestCase):
+    def test_round_trip(self):
+        for value in (0, 1, 0x7F, 0x80, 0x3FFF, 0x4000, 2 ** 28 - 1, 2 ** 32):
+            with self.subTest(value=value):
+                encoded = encode_varint(value)
+                self.assertEqual(decode_varint(b"x" + encoded + b"y", 1, len(encoded) + 2), (value, len(encoded) + 1))
+
+    def test_lengths(self):
+        self.assertEqual(encode_varint(0x7F), b"\x7f")
+        self.assertEqual(encode_varint(0x80), b"\x80\x01")
+        self.assertEqual(encode_varint(300), b"\xac\x02")
+
+    def test_incomplete(self):
+        self.assertEqual(decode_varint(b"\x80\x80", 0, 2), (None, 0))
+
+    def test_too_long(self):
+        with self.assertRaises(FrameError):
+            decode_varint(b"\x80" * 6 + b"\x01", 0, 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
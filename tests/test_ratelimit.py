@@ -0,0 +1,75 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# token buckets on a hand-moved clock, and buckets only given to clients that send something
+import unittest
+from unittest import mock
+from server.ratelimit import TokenBucket, new_bucket
+from protocols import CODECS
+from stubs import Clock, new_server
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("server.ratelimit.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_starts_full(self):
+        bucket = TokenBucket(10, 5)
+        for _ in range(5):
+            self.assertEqual(bucket.take(), 0)
+        self.assertAlmostEqual(bucket.take(), 0.1)
+
+    def test_refills_at_its_rate_up_to_the_burst(self):
+        bucket = TokenBucket(10, 5)
+        bucket.take(5)
+        self.clock.now += 0.25
+        self.assertEqual(bucket.take(2), 0)
+        self.assertAlmostEqual(bucket.take(), 0.05)
+        self.clock.now += 0.25
+        self.assertEqual(bucket.take(1), 0)
+        self.assertAlmostEqual(bucket.take(2), 0.1)
+        # a long quiet does not save up more than the burst
+        self.clock.now += 60
+        self.assertEqual(bucket.take(5), 0)
+        self.assertGreater(bucket.take(), 0)
+
+    def test_taking_more_than_there_is(self):
+        bucket = TokenBucket(100, 200)
+        # a batch of 1000 guesses is 800 tokens of debt, 8 seconds at 100 a second
+        self.assertAlmostEqual(bucket.take(1000), 8)
+        self.clock.now += 8
+        self.assertEqual(bucket.take(0), 0)
+        self.assertAlmostEqual(bucket.take(), 0.01)
+
+    def test_new_bucket(self):
+        self.assertIsNone(new_bucket(0, 100))
+        bucket = new_bucket(50, 0)
+        self.assertEqual((bucket.rate, bucket.burst, bucket.tokens), (50, 50, 50))
+
+
+class ServerBucketTest(unittest.TestCase):
+    def test_buckets_are_created_with_the_first_message(self):
+        server = new_server(self, message_rate=10, message_burst=20, byte_rate=1000, byte_burst=0)
+        session = server.sessions.create(None, CODECS["json"])
+        self.assertIsNone(session.message_limit)
+        bucket = server.message_limit_of(session)
+        self.assertEqual((bucket.rate, bucket.burst, bucket.tokens), (10, 20, 20))
+        self.assertIs(server.message_limit_of(session), bucket)
+        self.assertEqual(server.byte_limit_of(session).burst, 1000)
+
+    def test_no_limit(self):
+        server = new_server(self, message_rate=0, byte_rate=0)
+        session = server.sessions.create(None, CODECS["json"])
+        self.assertIsNone(server.message_limit_of(session))
+        self.assertIsNone(server.byte_limit_of(session))
+        self.assertEqual(server.throttle(None, "messages"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
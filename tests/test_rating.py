@@ -0,0 +1,70 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# Elo: expected scores, points moving from loser to winner, rooms of three or more as pairwise games
+import unittest
+from server.rating import Ratings, expected_score, INITIAL_RATING, K_FACTOR
+
+
+class ExpectedScoreTest(unittest.TestCase):
+    def test_expected_score(self):
+        self.assertEqual(expected_score(1500, 1500), 0.5)
+        # 400 points more is 10 to 1
+        self.assertAlmostEqual(expected_score(1900, 1500), 10 / 11)
+        self.assertAlmostEqual(expected_score(1500, 1900), 1 / 11)
+        self.assertAlmostEqual(expected_score(1620, 1480) + expected_score(1480, 1620), 1)
+
+
+class RatingsTest(unittest.TestCase):
+    def test_new_players(self):
+        ratings = Ratings()
+        self.assertEqual(ratings.get("alice"), INITIAL_RATING)
+        self.assertEqual(len(ratings), 0)
+        ratings.record("alice", ["alice", "bob"])
+        # an even game moves half of the K factor
+        self.assertEqual(ratings.get("alice"), INITIAL_RATING + K_FACTOR / 2)
+        self.assertEqual(ratings.get("bob"), INITIAL_RATING - K_FACTOR / 2)
+        self.assertEqual(len(ratings), 2)
+
+    def test_upsets_move_more(self):
+        ratings = Ratings()
+        ratings.learn("strong", 1900)
+        ratings.learn("weak", 1500)
+        ratings.record("strong", ["strong", "weak"])
+        gain = K_FACTOR * (1 - 10 / 11)
+        self.assertAlmostEqual(ratings.get("strong"), 1900 + gain)
+        self.assertAlmostEqual(ratings.get("weak"), 1500 - gain)
+
+        ratings = Ratings()
+        ratings.learn("strong", 1900)
+        ratings.learn("weak", 1500)
+        ratings.record("weak", ["strong", "weak"])
+        self.assertAlmostEqual(ratings.get("weak"), 1500 + K_FACTOR * 10 / 11)
+        self.assertAlmostEqual(ratings.get("strong"), 1900 - K_FACTOR * 10 / 11)
+
+    def test_room_of_more_players(self):
+        ratings = Ratings(k_factor=20)
+        ratings.learn("bob", 1600)
+        ratings.record("alice", ["alice", "bob", "carol"])
+        # each loss is computed from the ratings before the game, the winner gains what they lost
+        bob = 20 * (1 - expected_score(1500, 1600))
+        carol = 20 * 0.5
+        self.assertAlmostEqual(ratings.get("bob"), 1600 - bob)
+        self.assertAlmostEqual(ratings.get("carol"), 1500 - carol)
+        self.assertAlmostEqual(ratings.get("alice"), 1500 + bob + carol)
+        self.assertAlmostEqual(sum(ratings.ratings.values()), 1500 + 1600 + 1500)
+
+    def test_learn_keeps_what_we_know(self):
+        ratings = Ratings(initial=1000)
+        ratings.record("alice", ["alice", "bob"])
+        ratings.learn("alice", 2000)
+        ratings.learn("carol", 1800)
+        self.assertEqual(ratings.get("alice"), 1016)
+        self.assertEqual(ratings.get("carol"), 1800)
+
+
+if __name__ == "__main__":
+    unittest.main()
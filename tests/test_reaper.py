@@ -0,0 +1,58 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# the deadline heap hands out sessions earliest first, only once due, and never sleeps past MAX_WAIT
+import random
+import unittest
+from server.reaper import Reaper, MAX_WAIT
+from stubs import Session
+
+
+class ReaperTest(unittest.TestCase):
+    def test_due_earliest_first(self):
+        reaper = Reaper()
+        sessions = [Session(number) for number in range(100)]
+        deadlines = {session: random.Random(session.id).uniform(0, 10) for session in sessions}
+        for session in sessions:
+            reaper.schedule(session, deadlines[session])
+
+        due = reaper.due(5)
+        self.assertEqual(due, sorted((session for session in sessions if deadlines[session] <= 5), key=deadlines.get))
+        self.assertEqual(len(reaper), 100 - len(due))
+        # a session is handed out once
+        self.assertEqual(reaper.due(5), [])
+        self.assertEqual(len(reaper.due(10)) + len(due), 100)
+        self.assertEqual(len(reaper), 0)
+
+    def test_same_deadline(self):
+        reaper = Reaper()
+        first, second = Session(1), Session(2)
+        reaper.schedule(second, 3)
+        reaper.schedule(first, 3)
+        self.assertEqual(reaper.due(3), [first, second])
+
+    def test_a_session_can_be_scheduled_again(self):
+        reaper = Reaper()
+        session = Session(1)
+        reaper.schedule(session, 1)
+        for session in reaper.due(1):
+            reaper.schedule(session, 4)
+        self.assertEqual(reaper.due(3), [])
+        self.assertEqual(reaper.due(4), [session])
+
+    def test_wait(self):
+        reaper = Reaper()
+        self.assertEqual(reaper.wait(0), MAX_WAIT)
+        reaper.schedule(Session(1), 100)
+        self.assertEqual(reaper.wait(0), MAX_WAIT)
+        reaper.schedule(Session(2), 10.25)
+        self.assertEqual(reaper.wait(10), 0.25)
+        # overdue
+        self.assertEqual(reaper.wait(11), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# the hot restart of server/restart.py and the drain of server/main.py: a waiting player crosses to the new server
+# with their connection and what the old one knew about them, and without a new server they are let go. The handoff
+# channel here is a socket pair, no second process is started
+import socket
+import unittest
+from server.restart import encode, decode, send_player, receive_player
+from stubs import new_server, new_session
+
+
+# the old server's side of the handoff, a Successor without the process
+class Channel:
+    def __init__(self, test):
+        self.channel, self.theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        test.addCleanup(self.channel.close)
+        test.addCleanup(self.theirs.close)
+
+    def send_player(self, info, sock):
+        send_player(self.channel, info, sock)
+
+    def close(self):
+        self.channel.close()
+
+
+class CodingTest(unittest.TestCase):
+    def test_round_trip(self):
+        info = {"name": "Zoë 🎲", "format": "binary", "rating": 1512.5}
+        self.assertEqual(decode(encode(info), 0), info)
+
+    def test_cut_off(self):
+        for flag in (socket.MSG_TRUNC, socket.MSG_CTRUNC):
+            with self.assertRaises(ValueError):
+                decode(encode({"name": "alice"}), flag)
+
+
+class HandoffTest(unittest.TestCase):
+    def setUp(self):
+        self.channel = Channel(self)
+
+    # one end of a new connection, the other is returned to talk through
+    def connection(self):
+        ours, client = socket.socketpair()
+        self.addCleanup(ours.close)
+        self.addCleanup(client.close)
+        client.settimeout(5)
+        return ours, client
+
+    def test_socket_goes_with_the_player(self):
+        ours, client = self.connection()
+        send_player(self.channel.channel, {"name": "alice"}, ours)
+        ours.close()
+        sock, info = receive_player(self.channel.theirs)
+        self.addCleanup(sock.close)
+        self.assertEqual(info, {"name": "alice"})
+        sock.sendall(b"hello")
+        self.assertEqual(client.recv(5), b"hello")
+
+    def test_unreadable_player(self):
+        ours, client = self.connection()
+        socket.send_fds(self.channel.channel, [b"[1, 2]"], [ours.fileno()])
+        ours.close()
+        with self.assertRaises(ValueError):
+            receive_player(self.channel.theirs)
+        # the socket that came with it was closed, the client sees the end of the connection
+        self.assertEqual(client.recv(1), b"")
+
+    def test_end_of_the_handoff(self):
+        self.channel.close()
+        self.assertIsNone(receive_player(self.channel.theirs))
+
+
+class DrainTest(unittest.TestCase):
+    def setUp(self):
+        self.server = new_server(self, seed=1, drain_timeout=0)
+        self.server.stop_accepting()
+
+    def test_waiting_player_is_let_go_without_a_new_server(self):
+        session = new_session(self.server, "alice")
+        session.ready = self.server.new_event()
+        client = session.client
+        self.server.join_lobby(session)
+        self.assertTrue(client.shut_down)
+        self.assertEqual(len(self.server.matchmaker), 0)
+        # the handler is not left waiting for a room
+        self.assertIsNone(self.server.wait_for_room(session, iter(())))
+
+    def test_drain_ends_what_is_left(self):
+        players = [new_session(self.server, name) for name in ("alice", "bob")]
+        self.server.create_room(players)
+        waiting = new_session(self.server, "carol")
+        self.server.matchmaker.join(waiting)
+        self.server.drain()
+        # the room did not end within drain_timeout, the waiting player was released
+        self.assertTrue(all(player.client.shut_down for player in players))
+        self.assertTrue(waiting.client.shut_down)
+        self.assertEqual(len(self.server.matchmaker), 0)
+
+    def test_waiting_player_is_handed_over(self):
+        successor = Channel(self)
+        self.server.successor = successor
+        ours, client = socket.socketpair()
+        self.addCleanup(client.close)
+        session = new_session(self.server, "alice", "binary")
+        session.client = ours
+        self.server.ratings.learn("alice", 1600)
+        session.ready = self.server.new_event()
+        self.server.join_lobby(session)
+        self.assertNotIn(session.id, self.server.sessions.sessions)
+        self.assertEqual(ours.fileno(), -1)
+
+        new = new_server(self)
+        sock, info = receive_player(successor.theirs)
+        adopted = new.adopt_player(sock, info)
+        self.addCleanup(new.remove_connection, adopted)
+        self.addCleanup(sock.close)
+        self.assertEqual((adopted.name, adopted.codec.name), ("alice", "binary"))
+        self.assertEqual(new.ratings.get("alice"), 1600)
+        # the connection itself was never closed
+        sock.sendall(b"x")
+        client.settimeout(5)
+        self.assertEqual(client.recv(1), b"x")
+
+
+if __name__ == "__main__":
+    unittest.main()
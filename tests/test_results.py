@@ -0,0 +1,91 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# ResultStore: games recorded are written in batches and read back in the leaderboard, results beyond max_pending
+# are dropped instead of queued, and close() writes what is left. A writer that sleeps for a minute between
+# flushes stands for a disk that fell behind
+import os
+import tempfile
+import time
+import unittest
+from server.results import ResultStore, GameResult, PlayerResult
+from protocols import Protocols
+from stubs import new_server, new_session
+
+
+def game(winner, *players):
+    return GameResult(time.time(), 1.5, 0, 500, (250,), winner,
+                      tuple(PlayerResult(name, guesses, int(name == winner), name == winner)
+                            for name, guesses in players))
+
+
+class ResultStoreTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "results.db")
+
+    def new_store(self, **settings):
+        store = ResultStore(self.path, **dict({"flush_interval": 60}, **settings))
+        self.addCleanup(lambda: store.closed or store.close())
+        return store
+
+    def test_close_writes_what_is_queued(self):
+        store = self.new_store()
+        self.assertTrue(store.record(game("alice", ("alice", 5), ("bob", 7))))
+        self.assertTrue(store.record(game("bob", ("alice", 9), ("bob", 3))))
+        self.assertTrue(store.record(game("alice", ("alice", 4), ("carol", 8))))
+        self.assertEqual(len(store), 3)
+        store.close()
+        self.assertFalse(store.record(game("bob", ("bob", 1))))
+
+        store = self.new_store()
+        self.assertEqual(store.top_players(2), [("alice", 2, 3, 18), ("bob", 1, 2, 10)])
+        self.assertEqual([(name, guesses) for name, guesses, _ in store.best_games()],
+                         [("bob", 3), ("alice", 4), ("alice", 5)])
+
+    def test_a_full_batch_is_written_without_waiting(self):
+        store = self.new_store(batch_size=2)
+        store.record(game("alice", ("alice", 5), ("bob", 7)))
+        store.record(game("alice", ("alice", 6), ("bob", 7)))
+        deadline = time.monotonic() + 5
+        while not store.top_players() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(store.top_players(1), [("alice", 2, 2, 11)])
+
+    def test_results_beyond_max_pending_are_dropped(self):
+        store = self.new_store(max_pending=2)
+        self.assertTrue(store.record(game("alice", ("alice", 1))))
+        self.assertTrue(store.record(game("bob", ("bob", 2))))
+        self.assertFalse(store.record(game("carol", ("carol", 3))))
+        store.close()
+        store = self.new_store()
+        self.assertEqual(sorted(name for name, *_ in store.top_players()), ["alice", "bob"])
+
+
+class ServerRecordTest(unittest.TestCase):
+    def test_finished_games_are_counted(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        server = new_server(self, seed=1, results_db=os.path.join(directory.name, "results.db"))
+        # the database fell behind by one game
+        server.results.max_pending = 1
+        for _ in range(2):
+            players = [new_session(server, name) for name in ("alice", "bob")]
+            server.create_room(players)
+            room = players[0].room
+            server.handle_received_msg({"type": Protocols.Request.GUESS, "data": room.correct_numbers[0]},
+                                       players[0])
+        self.assertEqual(server.metrics.results_recorded.value, 1)
+        self.assertEqual(server.metrics.results_dropped.value, 1)
+        server.results.close()
+        store = ResultStore(server.results.path)
+        self.addCleanup(store.close)
+        self.assertEqual(store.top_players(), [("alice", 1, 1, 1), ("bob", 0, 1, 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# found-number bitmask, hints, verify_guesses(), spectators and the room settings that are refused
+import random
+import unittest
+from server.room import Room, GuessResult, validate_settings, MAX_HIDDEN_NUMBERS
+
+
+# a player of the room, only its room is looked at
+class Player:
+    def __init__(self, name):
+        self.name = name
+        self.room = None
+
+
+class RoomTest(unittest.TestCase):
+    def new_room(self, hidden_numbers=3, players=("alice", "bob")):
+        players = tuple(Player(name) for name in players)
+        room = Room(players, 0, 500, hidden_numbers, random.Random(1))
+        for player in players:
+            player.room = room
+        return room
+
+    def test_numbers_are_distinct_and_sorted(self):
+        numbers = self.new_room(hidden_numbers=50).correct_numbers
+        self.assertEqual(list(numbers), sorted(set(numbers)))
+        self.assertTrue(all(0 <= number <= 500 for number in numbers))
+        # as many numbers as there are to draw from
+        self.assertEqual(Room((), 1, 3, 3, random.Random(1)).correct_numbers, (1, 2, 3))
+
+    def test_found_bitmask(self):
+        room = self.new_room()
+        alice = room.players[0]
+        low, middle, high = room.correct_numbers
+        self.assertEqual(room.verify_guess(middle, alice), GuessResult.CORRECT)
+        self.assertEqual(room.found, 0b010)
+        # a number is only found once
+        self.assertNotEqual(room.verify_guess(middle, alice), GuessResult.CORRECT)
+        self.assertEqual(room.verify_guess(high, alice), GuessResult.CORRECT)
+        self.assertEqual(room.found, 0b110)
+        self.assertFalse(room.game_over)
+        self.assertEqual(room.verify_guess(low, alice), GuessResult.CORRECT)
+        self.assertTrue(room.game_over)
+        self.assertIs(room.finisher, alice)
+        self.assertEqual(room.verify_guess(low, alice), GuessResult.GAME_OVER)
+
+    def test_hints_point_at_the_smallest_number_left(self):
+        room = self.new_room()
+        low, middle, high = room.correct_numbers
+        self.assertEqual(room.verify_guess(low - 1), GuessResult.TOO_LOW)
+        self.assertEqual(room.verify_guess(low + 1), GuessResult.TOO_HIGH)
+        room.verify_guess(low)
+        # the smallest one is found, the hints are about the next one
+        self.assertEqual(room.verify_guess(low + 1), GuessResult.TOO_LOW)
+        self.assertEqual(room.verify_guess(high), GuessResult.CORRECT)
+        self.assertEqual(room.verify_guess(middle + 1), GuessResult.TOO_HIGH)
+
+    def test_verify_guesses_stops_at_the_first_correct_guess(self):
+        room = self.new_room()
+        low, middle, high = room.correct_numbers
+        self.assertEqual(room.verify_guesses([low - 1, middle, high, 501]),
+                         [GuessResult.TOO_LOW, GuessResult.CORRECT])
+        self.assertEqual(room.found, 0b010)
+        self.assertEqual(room.verify_guesses([low, high]), [GuessResult.CORRECT])
+        self.assertEqual(room.verify_guesses([high]), [GuessResult.CORRECT])
+        self.assertEqual(room.verify_guesses([low, middle]), [GuessResult.GAME_OVER])
+
+    def test_scores_and_leader(self):
+        room = self.new_room()
+        alice, bob = room.players
+        low, middle, high = room.correct_numbers
+        room.verify_guess(low, bob)
+        room.verify_guess(middle, alice)
+        self.assertIs(room.leader, bob)
+        room.verify_guess(high, alice)
+        self.assertEqual(room.scores, {bob: 1, alice: 2})
+        self.assertIs(room.leader, alice)
+
+    def test_remove(self):
+        room = self.new_room(players=("alice", "bob", "carol"))
+        alice, bob, carol = room.players
+        self.assertEqual(room.remove(bob), (alice, carol))
+        self.assertEqual(room.remove(bob), (alice, carol))
+        self.assertEqual(room.remove(alice), (carol,))
+        self.assertTrue(room.is_open())
+        carol.room = None
+        self.assertFalse(room.is_open())
+
+    def test_watchers(self):
+        room = self.new_room()
+        self.assertEqual(room.watchers(), ())
+        room.watch("spectator")
+        room.watch("another")
+        self.assertEqual(room.watchers(), ("spectator", "another"))
+        room.unwatch("spectator")
+        self.assertEqual(room.watchers(), ("another",))
+        # the rooms do not share their spectators
+        self.assertEqual(self.new_room().watchers(), ())
+
+    def test_settings(self):
+        validate_settings(2, 0, 500, MAX_HIDDEN_NUMBERS)
+        refused = {"one player": (1, 0, 500, 1), "no range": (2, 5, 5, 1), "beyond 64 bits": (2, 0, 2 ** 63, 1),
+                   "no number": (2, 0, 500, 0), "more numbers than the range": (2, 1, 3, 4),
+                   "too many numbers to send": (2, 0, 500, MAX_HIDDEN_NUMBERS + 1)}
+        for reason, settings in refused.items():
+            with self.subTest(reason):
+                with self.assertRaises(ValueError):
+                    validate_settings(*settings)
+
+if __name__ == "__main__":
+    unittest.main()
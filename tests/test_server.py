@@ -0,0 +1,372 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# game logic of server/main.py with no network (see stubs.py), and the deadlines the reaper checks
+import asyncio
+import selectors
+import socket
+import threading
+import time
+import unittest
+from server.async_server import AsyncServer
+from server.room import GuessResult
+from protocols import Protocols, ProtocolError, DEFAULT_CODEC
+from stubs import FakeClient, ListOutbox, new_server, new_session
+
+
+class GuessTest(unittest.TestCase):
+    def setUp(self):
+        self.server = new_server(self, seed=1)
+        self.players = [new_session(self.server, name) for name in ("alice", "bob")]
+        self.server.create_room(self.players)
+        self.room = self.players[0].room
+
+    def guess(self, r_type, data):
+        self.server.handle_received_msg({"type": r_type, "data": data}, self.players[0])
+
+    def replies(self):
+        return self.players[0].outbox.types()
+
+    def test_guess(self):
+        self.guess(Protocols.Request.GUESS, self.room.lower_bound - 1)
+        self.assertEqual(self.replies()[-1], Protocols.Response.GUESS_TOO_LOW)
+
+    def test_guess_that_is_not_an_integer(self):
+        for data in (None, "250", 2.5, True, [250], {"guess": 250}):
+            with self.subTest(data=data):
+                with self.assertRaises(ProtocolError):
+                    self.guess(Protocols.Request.GUESS, data)
+        self.assertEqual(self.players[0].guesses, 0)
+
+    def test_batch(self):
+        self.guess(Protocols.Request.GUESS_BATCH, [self.room.lower_bound - 1, self.room.upper_bound + 1])
+        self.assertEqual(self.players[0].outbox.messages[-1]["data"], [1, 2])
+
+    def test_batch_that_is_not_a_list_of_integers(self):
+        for data in (None, "250", 250, {"guesses": [250]}, [250, "251"], [250, None], [False]):
+            with self.subTest(data=data):
+                with self.assertRaises(ProtocolError):
+                    self.guess(Protocols.Request.GUESS_BATCH, data)
+        self.assertEqual(self.players[0].guesses, 0)
+        self.assertNotIn(Protocols.Response.GUESS_BATCH_RESULT, self.replies())
+
+
+
+class SpectateTest(unittest.TestCase):
+    def setUp(self):
+        self.server = new_server(self, seed=1)
+        self.players = [new_session(self.server, name) for name in ("alice", "bob")]
+        self.server.create_room(self.players)
+        self.room = self.players[0].room
+
+    def spectate(self, name):
+        spectator = new_session(self.server, None)
+        watching = self.server.spectate(spectator, {"type": Protocols.Request.SPECTATE, "data": name})
+        return spectator, watching
+
+    def guess(self, player, guess):
+        self.server.handle_received_msg({"type": Protocols.Request.GUESS, "data": guess}, player)
+
+    def test_watch_a_player(self):
+        spectator, watching = self.spectate("bob")
+        self.assertTrue(watching)
+        self.assertEqual(spectator.outbox.messages[-1]["data"]["players"], ["alice", "bob"])
+        self.guess(self.players[0], self.room.lower_bound - 1)
+        self.assertEqual(spectator.outbox.messages[-1], {"type": Protocols.Response.ROOM_GUESSES, "data": {
+            "player": "alice", "guesses": [self.room.lower_bound - 1], "results": [GuessResult.TOO_LOW]}})
+
+        # once gone, the spectator is not sent the game anymore
+        outbox = spectator.outbox
+        self.server.disconnect_client(spectator)
+        self.assertTrue(spectator.client.shut_down)
+        self.assertEqual(self.room.watchers(), ())
+        self.guess(self.players[1], self.room.upper_bound + 1)
+        self.assertEqual(outbox.types(), [Protocols.Response.SPECTATING, Protocols.Response.ROOM_GUESSES])
+
+    def test_nobody_to_watch(self):
+        for name in ("carol", ["alice"], 5):
+            with self.subTest(name=name):
+                spectator, watching = self.spectate(name)
+                self.assertFalse(watching)
+                self.assertEqual(spectator.outbox.types(), [Protocols.Response.SPECTATE_REJECTED])
+
+    def test_players_that_left_are_not_found(self):
+        spectator, _ = self.spectate("alice")
+        self.server.disconnect_client(self.players[0])
+        self.assertEqual(spectator.outbox.types()[-1], Protocols.Response.OPPONENT_EXITED)
+        self.assertFalse(self.spectate("alice")[1])
+        self.assertFalse(self.spectate("bob")[1])
+        self.assertEqual(self.server.rooms_by_name, {})
+
+    def test_a_new_room_takes_the_name(self):
+        players = [new_session(self.server, name) for name in ("bob", "carol")]
+        self.server.create_room(players)
+        # the first bob leaves after a second one took the name, it stays with the new room
+        self.server.disconnect_client(self.players[1])
+        self.assertIs(self.server.find_room("bob"), players[0].room)
+
+class WaitDetachedTest(unittest.TestCase):
+    def setUp(self):
+        self.server = new_server(self, resume_grace=30, seed=1)
+        self.players = [new_session(self.server, name) for name in ("alice", "bob")]
+        self.server.create_room(self.players)
+        self.server.sessions.issue_token(self.players[0])
+
+    def wait_for(self, let_go):
+        session = self.players[0]
+        timer = threading.Timer(0.05, let_go, args=(session,))
+        timer.start()
+        started = time.monotonic()
+        self.server.wait_detached(session)
+        timer.join()
+        return time.monotonic() - started
+
+    def test_woken_up_when_the_session_is_detached(self):
+        waited = self.wait_for(self.server.drop)
+        self.assertLess(waited, 2)
+        self.assertIsNotNone(self.players[0].expiry)
+        self.assertIsNone(self.players[0].released)
+        self.assertTrue(self.server.sessions.take(self.players[0]))
+
+    def test_woken_up_when_the_room_is_closed(self):
+        waited = self.wait_for(lambda session: self.server.disconnect_client(self.players[1]))
+        self.assertLess(waited, 2)
+        self.assertIsNone(self.players[0].room)
+
+    def test_no_wait_for_a_detached_session(self):
+        self.server.drop(self.players[0])
+        started = time.monotonic()
+        self.server.wait_detached(self.players[0])
+        self.assertLess(time.monotonic() - started, 1)
+        self.server.sessions.take(self.players[0])
+
+
+# the connection of a player in a room drops, play() is given the frames the client sent before
+class LostConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.server = new_server(self, resume_grace=30, start_delay=0, seed=1)
+        self.players = [new_session(self.server, name) for name in ("alice", "bob")]
+        for player in self.players:
+            player.ready = self.server.new_event()
+        self.server.create_room(self.players)
+
+    def play(self, session, *messages):
+        frames = [(DEFAULT_CODEC, DEFAULT_CODEC.encode(r_type, data).rstrip(b"\n")) for r_type, data in messages]
+        self.server.play(session, iter(frames))
+
+    def test_gone_before_being_heard_from(self):
+        self.play(self.players[0])
+        # the room ends at once, nobody waits for a client that may never have got its token
+        self.assertIsNone(self.players[0].expiry)
+        self.assertEqual(self.players[1].outbox.types()[-1], Protocols.Response.OPPONENT_EXITED)
+        self.assertIsNone(self.players[1].room)
+
+    def test_gone_after_a_guess(self):
+        self.play(self.players[0], (Protocols.Request.GUESS, self.players[0].room.lower_bound - 1))
+        self.assertIsNotNone(self.players[0].expiry)
+        self.addCleanup(self.server.sessions.take, self.players[0])
+        self.assertNotIn(Protocols.Response.OPPONENT_EXITED, self.players[1].outbox.types())
+
+    def test_gone_after_resuming(self):
+        self.play(self.players[0], (Protocols.Request.PONG, None))
+        session = new_session(self.server, None)
+        token = self.server.sessions.token_of(self.players[0])
+        self.assertTrue(self.server.resume(session, self.server.find_resumable(session, {"data": token})))
+        self.play(session)
+        self.assertIsNotNone(session.expiry)
+        self.addCleanup(self.server.sessions.take, session)
+
+
+# a player waiting for a room over a real connection, with the watcher of the threaded engine running
+class WaitingTest(unittest.TestCase):
+    def setUp(self):
+        self.server = new_server(self, seed=1, idle_timeout=60)
+        self.server.new_outbox = lambda session: ListOutbox(session.codec)
+        self.server.watched = selectors.DefaultSelector()
+        self.addCleanup(self.server.watched.close)
+        stop = threading.Event()
+
+        def watch():
+            while not stop.is_set():
+                self.server.wake_readable(0.01)
+        watcher = threading.Thread(target=watch)
+        watcher.start()
+        self.addCleanup(watcher.join, 5)
+        self.addCleanup(stop.set)
+
+        ours, self.client = socket.socketpair()
+        self.addCleanup(ours.close)
+        self.addCleanup(self.client.close)
+        self.session = self.server.add_connection(ours, opened=100)
+        self.session.name = "alice"
+        self.session.ready = self.server.new_event()
+        self.server.join_lobby(self.session)
+        self.waited = []
+        frames = self.server.read_frames(self.session)
+        self.handler = threading.Thread(target=lambda: self.waited.append(self.server.wait_for_room(self.session,
+                                                                                                    frames)))
+        self.handler.start()
+        self.addCleanup(self.handler.join, 5)
+
+    def send(self, r_type):
+        self.client.sendall(DEFAULT_CODEC.encode(r_type, None))
+
+    def test_what_a_waiting_player_sends_is_read(self):
+        self.send(Protocols.Request.PONG)
+        deadline = time.monotonic() + 5
+        while self.session.seen == 100 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertGreater(self.session.seen, 100)
+        self.assertIn(self.session, self.server.matchmaker)
+        self.assertEqual(self.server.metrics.messages_received.labels(Protocols.Request.PONG).value, 1)
+
+        self.server.join_lobby(new_session(self.server, "bob"))
+        self.handler.join(5)
+        self.assertIsNotNone(self.waited[0])
+        self.assertIn(Protocols.Response.GAME_BOUNDS, self.session.outbox.types())
+
+    def test_a_waiting_player_that_leaves_is_taken_out_of_the_lobby(self):
+        self.client.close()
+        self.handler.join(5)
+        self.assertEqual(self.waited, [None])
+        self.assertNotIn(self.session, self.server.matchmaker)
+        self.assertIsNone(self.session.outbox)
+        # the next player is not paired with them
+        self.assertEqual(self.server.matchmaker.join(new_session(self.server, "bob")), [])
+
+
+# the same on the async engine, the handler reads while it waits for the event
+class AsyncListOutbox(ListOutbox):
+    async def wait_writable(self):
+        pass
+
+
+class AsyncWaitingTest(unittest.TestCase):
+    def setUp(self):
+        self.server = new_server(self, AsyncServer, seed=1, idle_timeout=60)
+        self.server.new_outbox = lambda session: AsyncListOutbox(session.codec)
+
+    # runs play(client, session, waiting) with the connection of a waiting player, waiting is the task of its handler
+    def run_waiting(self, play):
+        async def main():
+            ours, client = socket.socketpair()
+            self.addCleanup(client.close)
+            reader, writer = await asyncio.open_connection(sock=ours)
+            session = self.server.add_connection(writer, opened=100)
+            session.name = "alice"
+            session.ready = self.server.new_event()
+            self.server.join_lobby(session)
+            waiting = asyncio.ensure_future(self.server.wait_for_room(session, self.server.read_frames(reader,
+                                                                                                      session)))
+            try:
+                await play(client, session, waiting)
+            finally:
+                writer.transport.abort()
+        asyncio.run(main())
+
+    async def heard_from(self, session):
+        while session.seen == 100:
+            await asyncio.sleep(0.01)
+
+    def test_what_a_waiting_player_sends_is_read(self):
+        async def play(client, session, waiting):
+            client.sendall(DEFAULT_CODEC.encode(Protocols.Request.PONG, None))
+            await asyncio.wait_for(self.heard_from(session), 5)
+            self.assertIn(session, self.server.matchmaker)
+            # half of a GUESS is being read when the room is created, play() gets the rest
+            guess = DEFAULT_CODEC.encode(Protocols.Request.GUESS, 250)
+            client.sendall(guess[:5])
+            await asyncio.sleep(0.05)
+            self.server.join_lobby(new_session(self.server, "bob"))
+            frames = await asyncio.wait_for(waiting, 5)
+            self.assertIn(Protocols.Response.GAME_BOUNDS, session.outbox.types())
+            client.sendall(guess[5:])
+            codec, frame = await asyncio.wait_for(anext(frames), 5)
+            self.assertEqual(codec.parse(frame), {"type": Protocols.Request.GUESS, "data": 250})
+        self.run_waiting(play)
+
+    def test_a_waiting_player_that_leaves_is_taken_out_of_the_lobby(self):
+        async def play(client, session, waiting):
+            client.close()
+            self.assertIsNone(await asyncio.wait_for(waiting, 5))
+            self.assertNotIn(session, self.server.matchmaker)
+        self.run_waiting(play)
+
+
+class DeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.server = new_server(self, login_timeout=10, idle_timeout=60, heartbeat=15, seed=1)
+        self.server.new_outbox = lambda session: ListOutbox(session.codec)
+        # the connection was accepted at 100 on the test's clock
+        self.session = self.server.add_connection(FakeClient(), opened=100)
+
+    def reaped(self, reason):
+        return self.server.metrics.reaped.labels(reason).value
+
+    def test_connection_is_scheduled(self):
+        self.assertEqual(self.server.reaper.due(110), [self.session])
+
+    def test_login(self):
+        self.assertEqual(self.server.check_deadline(self.session, 105), 110)
+        self.assertIsNone(self.server.check_deadline(self.session, 110))
+        self.assertTrue(self.session.client.shut_down)
+        self.assertEqual(self.reaped("login"), 1)
+
+    def test_idle(self):
+        self.session.name = "alice"
+        self.session.seen = 200
+        self.assertEqual(self.server.check_deadline(self.session, 230), 260)
+        self.assertIsNone(self.server.check_deadline(self.session, 260))
+        self.assertEqual(self.reaped("idle"), 1)
+
+    def test_heartbeat(self):
+        self.session.name = "alice"
+        self.session.heartbeat = 15
+        self.session.seen = 200
+        self.assertEqual(self.server.check_deadline(self.session, 210), 215)
+        # quiet for a whole interval: a PING, and the next one an interval later unless the idle deadline is first
+        self.assertEqual(self.server.check_deadline(self.session, 215), 230)
+        self.assertEqual(self.session.outbox.messages[-1]["type"], Protocols.Response.PING)
+        self.assertEqual(self.server.check_deadline(self.session, 250), 260)
+        self.assertFalse(self.session.client.shut_down)
+
+    def test_silent_waiting_player(self):
+        self.session.name = "alice"
+        self.session.heartbeat = 15
+        self.session.seen = 200
+        self.session.ready = threading.Event()
+        self.server.matchmaker.join(self.session)
+        outbox = self.session.outbox
+        waited = []
+        handler = threading.Thread(target=lambda: waited.append(self.server.wait_for_room(self.session, iter(()))))
+        handler.start()
+        # a PING like any quiet player, then the idle deadline
+        self.assertEqual(self.server.check_deadline(self.session, 215), 230)
+        self.assertEqual(outbox.types(), [Protocols.Response.PING])
+        self.assertIsNone(self.server.check_deadline(self.session, 260))
+        self.assertEqual(self.reaped("idle"), 1)
+        self.assertNotIn(self.session, self.server.matchmaker)
+        self.assertTrue(self.session.client.shut_down)
+        # the handler was woken up and has nothing left to do
+        handler.join(5)
+        self.assertEqual(waited, [None])
+
+    def test_connection_gone(self):
+        self.server.disconnect_client(self.session)
+        self.assertIsNone(self.server.check_deadline(self.session, 200))
+
+    def test_reap(self):
+        self.session.name = "alice"
+        self.session.seen = 100
+        self.server.reaper.due(110)
+        self.server.reaper.schedule(self.session, 160)
+        self.server.reap(160)
+        self.assertEqual(self.reaped("idle"), 1)
+        self.assertEqual(len(self.server.reaper), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
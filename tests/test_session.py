@@ -0,0 +1,108 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# session ids and tokens, and a detached session taken once, either by its resume or by its expiry
+import threading
+import unittest
+from server.session import SessionRegistry
+from protocols import CODECS
+
+
+# stands in for the expiry timer of a detached session
+class FakeTimer:
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class SessionRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = SessionRegistry()
+
+    def test_create(self):
+        first = self.registry.create("client 1", CODECS["json"])
+        second = self.registry.create("client 2", CODECS["binary"])
+        self.assertNotEqual(first.id, second.id)
+        self.assertIs(self.registry.get(first.id), first)
+        self.assertEqual((second.client, second.codec), ("client 2", CODECS["binary"]))
+        self.assertEqual(len(self.registry), 2)
+        self.assertEqual(first.token_count, 0)
+
+    def test_ids_are_unique_across_threads(self):
+        sessions = []
+
+        def create():
+            for _ in range(1000):
+                sessions.append(self.registry.create(None, CODECS["json"]))
+
+        threads = [threading.Thread(target=create) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({session.id for session in sessions}), 8000)
+        self.assertEqual(len(self.registry), 8000)
+
+    def test_tokens(self):
+        session = self.registry.create(None, CODECS["json"])
+        old = self.registry.issue_token(session)
+        self.assertIs(self.registry.find(old), session)
+        token = self.registry.issue_token(session)
+        self.assertNotEqual(token, old)
+        self.assertIsNone(self.registry.find(old))
+        self.assertIs(self.registry.find(token), session)
+
+        self.registry.remove(session)
+        self.assertIsNone(self.registry.find(token))
+        self.assertIsNone(self.registry.get(session.id))
+        self.assertEqual(len(self.registry), 0)
+        # removing it again does nothing
+        self.registry.remove(session)
+
+    def test_tokens_that_are_not_ours(self):
+        session = self.registry.create(None, CODECS["json"])
+        # a session that was never given a token
+        self.assertIsNone(self.registry.find(f"{session.id}.0.{'A' * 22}"))
+        token = self.registry.issue_token(session)
+        session_id, count, mac = token.split(".")
+        other = SessionRegistry()
+        other.create(None, CODECS["json"])
+        forged = [f"{session_id}.{count}.{mac[:-1]}{'B' if mac[-1] == 'A' else 'A'}", f"{session_id}.2.{mac}",
+                  other.issue_token(other.get(session.id)), token + ".", "", "..", "x.1.y",
+                  f"{session_id}.{count}.\ud800", "١." + token]
+        for token in forged:
+            with self.subTest(token=token):
+                self.assertIsNone(self.registry.find(token))
+
+    def test_take_detached_session(self):
+        session = self.registry.create(None, CODECS["json"])
+        self.assertFalse(self.registry.take(session))
+        timer = FakeTimer()
+        self.registry.detach(session, timer)
+        self.assertIs(session.expiry, timer)
+        self.assertTrue(self.registry.take(session))
+        self.assertTrue(timer.cancelled)
+        self.assertIsNone(session.expiry)
+        # whoever comes second is too late
+        self.assertFalse(self.registry.take(session))
+
+    def test_only_one_taker_wins(self):
+        for _ in range(100):
+            session = self.registry.create(None, CODECS["json"])
+            self.registry.detach(session, FakeTimer())
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(self.registry.take(session))) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(sorted(results), [False, False, False, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,226 @@
+import sys
+from pathlib import Path
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+# tls.py with a certificate made for the run: TlsSocket handshakes and their deadline, one connection shared by
+# two threads, session resumption, and the async server counting failed handshakes
+import asyncio
+import logging
+import shutil
+import socket
+import ssl
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from server.async_server import AsyncServer
+from tls import TlsSocket, ClientContext, server_context, make_self_signed
+
+
+@unittest.skipUnless(shutil.which("openssl"), "needs the openssl command line tool")
+class TlsSocketTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.certfile, cls.keyfile = make_self_signed(cls.directory.name)
+        # one context for every connection, like the server
+        cls.context = server_context(cls.certfile, cls.keyfile)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        self.addCleanup(self.listener.close)
+
+    # accepts one connection on a thread of its own and runs serve(TlsSocket) on it, returns the thread. What serve
+    # returns or raises ends up in outcome
+    def serve(self, serve, outcome, timeout=5):
+        def run():
+            client, _ = self.listener.accept()
+            connection = TlsSocket(client, self.context)
+            try:
+                connection.handshake(timeout)
+                outcome["result"] = serve(connection)
+            except Exception as e:
+                outcome["error"] = e
+            finally:
+                connection.close()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def test_handshake(self):
+        def echo(connection):
+            buffer = bytearray(100)
+            count = connection.recv_into(buffer)
+            connection.sendall(bytes(buffer[:count]))
+            return connection.session_reused
+
+        outcome = {}
+        thread = self.serve(echo, outcome)
+        with socket.create_connection(("127.0.0.1", self.port)) as sock:
+            with ClientContext(self.certfile).wrap_socket(sock, server_hostname="localhost") as client:
+                client.sendall(b"hello")
+                self.assertEqual(client.recv(100), b"hello")
+        thread.join(5)
+        self.assertNotIn("error", outcome)
+        self.assertIs(outcome["result"], False)
+
+    def test_untrusted_certificate_is_refused(self):
+        outcome = {}
+        thread = self.serve(lambda connection: None, outcome)
+        with socket.create_connection(("127.0.0.1", self.port)) as sock:
+            with self.assertRaises(ssl.SSLCertVerificationError):
+                ssl.create_default_context().wrap_socket(sock, server_hostname="localhost")
+        thread.join(5)
+        self.assertIn("error", outcome)
+
+    # a client that sends its hello a byte at a time never lets a single read time out, the handshake as a whole must
+    def test_handshake_deadline(self):
+        incoming, outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+        hello = ClientContext(self.certfile).wrap_bio(incoming, outgoing, server_hostname="localhost")
+        with self.assertRaises(ssl.SSLWantReadError):
+            hello.do_handshake()
+        client_hello = outgoing.read()
+
+        outcome = {}
+        started = time.monotonic()
+        thread = self.serve(lambda connection: None, outcome, timeout=0.5)
+        with socket.create_connection(("127.0.0.1", self.port)) as sock:
+            for byte in client_hello:
+                if not thread.is_alive():
+                    break
+                try:
+                    sock.sendall(bytes((byte,)))
+                except OSError:
+                    break
+                time.sleep(0.05)
+            thread.join(5)
+        self.assertIsInstance(outcome.get("error"), socket.timeout)
+        self.assertLess(time.monotonic() - started, 2)
+
+    # the player's handler reads while the writer of its outbound queue writes, on the same connection
+    def test_concurrent_recv_and_sendall(self):
+        messages = 2000
+        message = bytes(range(256)) * 4
+
+        def serve(connection):
+            received = bytearray()
+
+            def read():
+                buffer = bytearray(4096)
+                while len(received) < messages * len(message):
+                    count = connection.recv_into(buffer)
+                    if not count:
+                        break
+                    received.extend(buffer[:count])
+            reader = threading.Thread(target=read)
+            reader.start()
+            for _ in range(messages):
+                connection.sendall(message)
+            reader.join(10)
+            return bytes(received)
+
+        async def client():
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port,
+                                                           ssl=ClientContext(self.certfile),
+                                                           server_hostname="localhost")
+
+            async def write():
+                for _ in range(messages):
+                    writer.write(message)
+                    await writer.drain()
+            writing = asyncio.create_task(write())
+            data = await reader.readexactly(messages * len(message))
+            await writing
+            writer.close()
+            return data
+
+        outcome = {}
+        thread = self.serve(serve, outcome)
+        data = asyncio.run(asyncio.wait_for(client(), 20))
+        thread.join(10)
+        self.assertNotIn("error", outcome)
+        self.assertEqual(data, message * messages)
+        self.assertEqual(outcome["result"], message * messages)
+
+    # a second connection with the same ClientContext resumes the session the first one was given
+    def test_session_resumption(self):
+        context = ClientContext(self.certfile)
+
+        def greet(connection):
+            # TLS 1.3 tickets go out with the first data the server sends
+            connection.sendall(b"hi")
+            buffer = bytearray(10)
+            connection.recv_into(buffer)
+            return connection.session_reused
+
+        async def connect():
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port, ssl=context,
+                                                           server_hostname="localhost")
+            await reader.readexactly(2)
+            tls = writer.get_extra_info("ssl_object")
+            context.remember("localhost", tls)
+            writer.write(b"bye")
+            await writer.drain()
+            writer.close()
+            return tls.session_reused
+
+        reused = []
+        for _ in range(2):
+            outcome = {}
+            thread = self.serve(greet, outcome)
+            client_reused = asyncio.run(asyncio.wait_for(connect(), 10))
+            thread.join(5)
+            self.assertNotIn("error", outcome)
+            reused.append((client_reused, outcome["result"]))
+        self.assertEqual(reused, [(False, False), (True, True)])
+        self.assertIn("localhost", context.sessions)
+
+
+@unittest.skipUnless(shutil.which("openssl"), "needs the openssl command line tool")
+class AsyncHandshakeTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.certfile, keyfile = make_self_signed(directory.name)
+        # port 0, the listening socket is handed to asyncio by the test
+        self.server = AsyncServer(port=0, tls_cert=self.certfile, tls_key=keyfile, resume_grace=0, login_timeout=0,
+                                  idle_timeout=0, heartbeat=0)
+        self.addCleanup(self.server.server.close)
+
+    async def connect(self, timeout):
+        loop = asyncio.get_running_loop()
+        listener = await loop.create_server(self.server.accept_tls, sock=self.server.server, ssl=self.server.tls,
+                                            ssl_handshake_timeout=timeout)
+        port = self.server.server.getsockname()[1]
+        # one that is not TLS at all, and one that never says anything
+        _, plain = await asyncio.open_connection("127.0.0.1", port)
+        plain.write(b"GET / HTTP/1.0\r\n\r\n")
+        _, silent = await asyncio.open_connection("127.0.0.1", port)
+        _, secure = await asyncio.open_connection("127.0.0.1", port, ssl=ClientContext(self.certfile),
+                                                  server_hostname="localhost")
+        await asyncio.sleep(timeout + 1.5)
+        for writer in (plain, silent, secure):
+            writer.close()
+        listener.close()
+
+    def test_failed_handshakes_are_counted(self):
+        with mock.patch("server.async_server.HANDSHAKE_TIMEOUT", 0.2):
+            asyncio.run(self.connect(0.2))
+        handshakes = self.server.metrics.tls_handshakes
+        self.assertEqual(handshakes.labels("failed").value, 2)
+        self.assertEqual(handshakes.labels("full").value, 1)
+        self.assertEqual(self.server.handshaking, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+# optional TLS for the server and the client. Each side builds one SSLContext when it starts and wraps every
+# connection with it: the certificate is loaded once, and the tickets (TLS 1.3) or session ids (TLS 1.2) the server
+# hands out are accepted by every connection. A client that comes back, after a dropped connection or for its next
+# game, resumes its TLS session with one round trip less and without the certificate and key exchange.
+#
+# Generate a self-signed certificate for testing with:  python3 tls.py certs
+import argparse
+import os
+import socket
+import ssl
+import subprocess
+import threading
+import time
+
+# the most a client may take for the TLS handshake before the server gives up on it
+HANDSHAKE_TIMEOUT = 10
+# a TLS record carries at most 16 KiB
+RECORD_SIZE = 16 * 1024
+
+
+def server_context(certfile, keyfile=None):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+# the client's context, it remembers the last session of every server so the next connection can resume it. cafile is
+# the certificate to trust (the self-signed one of a test server), None for the system's, verify=False accepts any
+class ClientContext(ssl.SSLContext):
+    def __new__(cls, cafile=None, verify=True):
+        return super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self, cafile=None, verify=True):
+        super().__init__()
+        self.minimum_version = ssl.TLSVersion.TLSv1_2
+        if not verify:
+            self.check_hostname = False
+            self.verify_mode = ssl.CERT_NONE
+        elif cafile:
+            self.load_verify_locations(cafile)
+        else:
+            self.load_default_certs()
+        # last session by server name
+        self.sessions = {}
+
+    # asyncio wraps every connection with wrap_bio() and has no way to pass a session, so we pass the one we kept
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = self.sessions.get(server_hostname)
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+    # keep the session of a connection once its handshake is done (TLS 1.3 tickets only arrive with the first data)
+    def remember(self, server_hostname, ssl_object):
+        if ssl_object is not None and ssl_object.session is not None:
+            self.sessions[server_hostname] = ssl_object.session
+
+
+# a TLS connection of the threaded server. It stands in for the socket (recv_into, sendall, shutdown, close): the
+# player's handler reads from it while the writer of its outbound queue writes to it, and an SSL object must not be
+# used by two threads at once. So the encryption runs on memory buffers under a lock that is never held while
+# waiting for the network
+class TlsSocket:
+    def __init__(self, sock, context):
+        self.sock = sock
+        self.incoming = ssl.MemoryBIO()
+        self.outgoing = ssl.MemoryBIO()
+        self.tls = context.wrap_bio(self.incoming, self.outgoing, server_side=True)
+        # the SSL object and its buffers
+        self.lock = threading.Lock()
+        # the encrypted records go out in the order they were made, always taken before lock
+        self.send_lock = threading.Lock()
+
+    # the whole handshake has to be done within timeout seconds, a client trickling its bytes in does not get more
+    def handshake(self, timeout=HANDSHAKE_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                try:
+                    with self.lock:
+                        self.tls.do_handshake()
+                    break
+                except ssl.SSLWantReadError:
+                    self.settimeout(deadline)
+                    self.flush()
+                    self.settimeout(deadline)
+                    if not self.fill():
+                        raise ConnectionError("connection closed during the TLS handshake")
+            self.settimeout(deadline)
+            self.flush()
+        finally:
+            self.sock.settimeout(None)
+
+    # the next socket operation may only take what is left until deadline
+    def settimeout(self, deadline):
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise socket.timeout("the TLS handshake took too long")
+        self.sock.settimeout(left)
+
+    @property
+    def session_reused(self):
+        return self.tls.session_reused
+
+    # read encrypted bytes from the socket into the SSL object, False once the client closed the connection
+    def fill(self):
+        data = self.sock.recv(RECORD_SIZE)
+        if not data:
+            self.incoming.write_eof()
+            return False
+        self.incoming.write(data)
+        return True
+
+    # send whatever the SSL object wants to send
+    def flush(self):
+        with self.send_lock:
+            with self.lock:
+                data = self.outgoing.read()
+            if data:
+                self.sock.sendall(data)
+
+    def recv_into(self, buffer):
+        while True:
+            with self.lock:
+                try:
+                    return self.tls.read(len(buffer), buffer)
+                # the client closed the connection, with or without telling us first
+                except (ssl.SSLZeroReturnError, ssl.SSLEOFError):
+                    return 0
+                except ssl.SSLWantReadError:
+                    pass
+                except ssl.SSLError as e:
+                    raise ConnectionResetError(f"TLS error: {e}")
+                pending = self.outgoing.pending
+            # reading may have produced something to send (a key update)
+            if pending:
+                self.flush()
+            self.fill()
+
+    def sendall(self, data):
+        with self.send_lock:
+            with self.lock:
+                self.tls.write(data)
+                data = self.outgoing.read()
+            self.sock.sendall(data)
+
+    def shutdown(self, how):
+        self.sock.shutdown(how)
+
+    def close(self):
+        self.sock.close()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+
+# the openssl options for each kind of key
+KEYS = {
+    "ec": ["-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1"],
+    "rsa": ["-newkey", "rsa:2048"],
+}
+
+
+# a self-signed certificate and its key for testing, valid for localhost and 127.0.0.1. Made by the openssl
+# command line tool, returns (certificate, key)
+def make_self_signed(directory, days=30, key="ec"):
+    os.makedirs(directory, exist_ok=True)
+    certfile = os.path.join(directory, "server.crt")
+    keyfile = os.path.join(directory, "server.key")
+    subprocess.run(["openssl", "req", "-x509", *KEYS[key], "-nodes", "-keyout", keyfile, "-out", certfile,
+                    "-days", str(days), "-subj", "/CN=localhost",
+                    "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1"],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make a self-signed certificate for testing the server with TLS")
+    parser.add_argument("directory")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--key", choices=sorted(KEYS), default="ec")
+    args = parser.parse_args()
+
+    certfile, keyfile = make_self_signed(args.directory, args.days, args.key)
+    print(f"python3 server/main.py --tls-cert {certfile} --tls-key {keyfile}")
+    print(f"python3 -m client.game --tls-ca {certfile}")